@@ -1,34 +1,155 @@
 import logging
 import logging.config
+import os
 from argparse import ArgumentParser, RawDescriptionHelpFormatter
-from datetime import datetime
+from datetime import datetime, timedelta
 from multiprocessing import Process
-
-import yaml
+from typing import TYPE_CHECKING
 
 from dlsVibrationTools import __version__
-from dlsVibrationTools.vib_archive import vib_archive
-from dlsVibrationTools.vib_plots import (
-    plot_spectrogram,
-    plot_vc_histograms,
-    plot_vc_timeseries,
+from dlsVibrationTools.vib_metrics import REGISTRY, enable_metrics
+from dlsVibrationTools.vib_report import (
+    PLOT_VARIABLES,
+    QUALITY_BUCKETS,
+    REPORT_FORMATS,
+    REPORT_PLOTS,
 )
 
+# numpy, pandas, matplotlib, seaborn and the archiver client are only imported
+# once a command needs them, so that --help and --version start quickly
+if TYPE_CHECKING:
+    from dlsVibrationTools.vib_archive import vib_archive
+
 __all__ = ["main"]
 
+# logging configuration read by logging_setup, unless VIBRATION_LOGGING_CONFIG
+# names another file
+LOGGING_CONFIG = "logging.conf.yml"
+
 
-def logging_setup():
+def logging_setup(filename: str = None) -> None:
+    """configures logging from a YAML dictConfig file, creating the directories
+    of its log files. Without a usable file, INFO messages go to the console.
+
+    Args:
+        filename (str, optional): configuration file. Defaults to
+            $VIBRATION_LOGGING_CONFIG, or LOGGING_CONFIG in the working directory.
+    """
 
-    with open("logging.conf.yml", "r") as f:
-        config = yaml.safe_load(f.read())
-        print(config)
+    filename = filename or os.environ.get("VIBRATION_LOGGING_CONFIG", LOGGING_CONFIG)
+
+    try:
+        import yaml
+
+        with open(filename, "r") as f:
+            config = yaml.safe_load(f)
+        for handler in config.get("handlers", {}).values():
+            if "filename" in handler:
+                os.makedirs(os.path.dirname(handler["filename"]) or ".", exist_ok=True)
         logging.config.dictConfig(config)
+    except FileNotFoundError:
+        logging.basicConfig(level=logging.INFO)
+    except Exception as e:
+        logging.basicConfig(level=logging.INFO)
+        logging.warning("Could not configure logging from {}: {}".format(filename, e))
 
 
-def main(args=None):
+def _plot_shared(plot, shared, *args):
+    # runs in the plotting processes, on read-only views of the shared data
+    from dlsVibrationTools.vib_shared import dataframe_from_shared, spectra_from_shared
+
+    if "values" in shared:
+        plot(spectra_from_shared(shared), *args)
+    else:
+        plot(dataframe_from_shared(shared), *args)
+
+
+def _plot_alarms(data, vc_threshold: str):
+    from dlsVibrationTools.vib_alarms import get_vib_alarms
+    from dlsVibrationTools.vib_plots import plot_alarm_table
+    from dlsVibrationTools.vib_quality import gap_threshold
+
+    plot_alarm_table(get_vib_alarms(data, vc_threshold, max_gap=gap_threshold(data)))
+
+
+def _plot_quality(data, start_date: datetime, end_date: datetime):
+    from dlsVibrationTools.vib_plots import plot_coverage
+    from dlsVibrationTools.vib_quality import get_coverage
+
+    bucket = (end_date - start_date) / QUALITY_BUCKETS
+    plot_coverage(get_coverage(data, start_date, end_date, bucket=bucket))
 
-    # logging set up
-    logging_setup()
+
+def _parse_datetime(s: str) -> datetime:
+    # local time unless a timezone is given
+    return datetime.fromisoformat(s).astimezone()
+
+
+def show_plots(
+    archive: "vib_archive",
+    start_date: datetime,
+    end_date: datetime,
+    plots: list,
+    beamlines: list,
+    channels: list,
+    ids: list,
+    vc_threshold: str,
+) -> None:
+    """shows each plot in its own process and window. The data of each beamline is
+    fetched once and handed to all its plots through shared memory."""
+
+    from dlsVibrationTools.vib_plots import (
+        plot_spectrogram,
+        plot_vc_histograms,
+        plot_vc_timeseries,
+    )
+    from dlsVibrationTools.vib_report import fetch_report_data
+    from dlsVibrationTools.vib_shared import share_dataframe, share_spectra
+
+    # plotting function and extra arguments of each plot
+    vc_targets = {
+        "timeseries": (plot_vc_timeseries,),
+        "histogram": (plot_vc_histograms,),
+        "alarms": (_plot_alarms, vc_threshold),
+        "quality": (_plot_quality, start_date, end_date),
+    }
+
+    processes = []
+    blocks = []
+
+    for beamline in beamlines:
+        logging.info("Fetching data for {}...".format(beamline))
+        data, spectra = fetch_report_data(
+            archive, start_date, end_date, plots, beamline, channels, ids
+        )
+
+        # the plotting processes attach to the data in shared memory rather than
+        # receiving a pickled copy each
+        targets = []
+        if data is not None:
+            blocks.append(share_dataframe(data))
+            for plot in plots:
+                if PLOT_VARIABLES[plot] == "VC_PEAK":
+                    plot, *extra = vc_targets[plot]
+                    targets.append((plot, blocks[-1], *extra))
+        for s in spectra.values():
+            blocks.append(share_spectra(s))
+            targets.append((plot_spectrogram, blocks[-1]))
+        del data, spectra
+
+        for target in targets:
+            p = Process(target=_plot_shared, args=target)
+            p.start()
+            processes.append(p)
+
+    for p in processes:
+        p.join()
+
+    for block in blocks:
+        block.close()
+
+
+def main(args=None):
 
     # TODO: this should really live outside of this
     # FIXME: return carriages aren't really workin
@@ -38,6 +159,9 @@ def main(args=None):
     pipenv run vibration-report
     pipenv run vibration-report --help
     pipenv run vibration-report --start="2022-06-08 12:00" --end="2022-06-08 13:00"
+    pipenv run vibration-report -b BL20I BL20J -c 1 2 3 --plot timeseries alarms
+    pipenv run vibration-report --report=/tmp/report --format png html
+    pipenv run vibration-report --report=/tmp/report --cache=~/.cache/vibration
     """
 
     # input parsing
@@ -49,88 +173,167 @@ def main(args=None):
     parser.add_argument("--version", action="version", version=__version__)
 
     # date/time parsing
-    # TODO: actually use these values...
     parser.add_argument(
-        "--start", nargs=1, help='start datetime: "YYYY-MM-DD HH:MM:SS"'
+        "--start",
+        type=_parse_datetime,
+        help='start datetime: "YYYY-MM-DD HH:MM:SS". Defaults to 24 hours before end',
+    )
+    parser.add_argument(
+        "--end",
+        type=_parse_datetime,
+        help='end datetime:  "YYYY-MM-DD HH:MM:SS". Defaults to now',
     )
-    parser.add_argument("--end", nargs=1, help='end datetime:  "YYYY-MM-DD HH:MM:SS"')
-
-    args = parser.parse_args(args)
 
-    # TODO: allow multiple plot types
-    plot_type = "spectrogram"
-    logging.warning("""Plot selection not implemented, this is hardcoded for now""")
+    # PV selection
+    parser.add_argument(
+        "-b",
+        "--beamline",
+        nargs="+",
+        help="beamlines (BL20I...). Defaults to the current beamline",
+    )
+    parser.add_argument(
+        "--id", nargs="+", type=int, default=[1], help="vibration IOC ids"
+    )
+    parser.add_argument(
+        "-c", "--channel", nargs="+", type=int, default=[1], help="channels"
+    )
+    parser.add_argument(
+        "--variable",
+        nargs="+",
+        choices=sorted(set(PLOT_VARIABLES.values())),
+        help="make every plot of these variables",
+    )
+    parser.add_argument(
+        "--plot",
+        nargs="+",
+        choices=REPORT_PLOTS,
+        help="plots to make. Defaults to all of them",
+    )
+    parser.add_argument(
+        "--threshold",
+        default="G",
+        help="VC level (A-M) above which alarms are raised. Defaults to G",
+    )
+    parser.add_argument(
+        "--appliance",
+        default="archappl.diamond.ac.uk",
+        help="archiver appliance hostname",
+    )
+    parser.add_argument("--port", type=int, default=80, help="archiver appliance port")
+    parser.add_argument(
+        "--cache",
+        metavar="DIR",
+        default=os.environ.get("VIBRATION_CACHE"),
+        help="keep the archiver data in DIR, so that later runs only fetch data "
+        "that is not there yet. Defaults to $VIBRATION_CACHE, or no cache",
+    )
 
-    # parse args and get data
-    arch = vib_archive()
-    logging.warning(
-        (
-            "IOC selection not implemented - defaulting to "
-            "I20 vibration kit for now, or local machine if on a beamline"
-        )
+    # headless report, e.g. from cron
+    parser.add_argument(
+        "--report",
+        metavar="OUTPUT_DIR",
+        help="write all plots to OUTPUT_DIR instead of showing them",
+    )
+    parser.add_argument(
+        "--format",
+        nargs="+",
+        choices=REPORT_FORMATS,
+        default=["png"],
+        help="report file formats",
+    )
+    parser.add_argument(
+        "--metrics",
+        metavar="FILE",
+        help="write the time, rows, bytes and memory of each stage to FILE, in the "
+        "Prometheus text format if it ends with .prom and as JSON otherwise",
     )
-    # create a vibration archive object
 
-    # TODO: this is for testing only
-    if plot_type == "vc":
-        start_date = datetime(2022, 5, 4).astimezone()
-        end_date = datetime(2022, 5, 5).astimezone()
-    elif plot_type == "spectrogram":
-        start_date = datetime(2022, 5, 4, 12, 0, 0).astimezone()
-        end_date = datetime(2022, 5, 4, 12, 10, 0).astimezone()
-    else:
-        raise NotImplementedError
+    args = parser.parse_args(args)
+
+    # logging set up
+    logging_setup()
 
-    logging.warning("""Date selection currently hardcoded for testing purposes""")
+    from dlsVibrationTools.vc_curves import VC_LABELS
+    from dlsVibrationTools.vib_archive import vib_archive
+    from dlsVibrationTools.vib_report import generate_report
 
-    # end_date = datetime.now(timezone.utc).astimezone()
-    # start_date = end_date - timedelta(hours=24*7)
+    if args.threshold not in VC_LABELS:
+        parser.error(
+            "argument --threshold: invalid choice: {!r} (choose from {})".format(
+                args.threshold, ", ".join(VC_LABELS)
+            )
+        )
 
-    # TODO: turn this into a dictionary type match, throwing notImplemented otherwise
-    if plot_type == "vc":
-        pv_name = "VC_PEAK"
-    elif plot_type == "spectrogram":
-        pv_name = "FFT"
-    else:
-        raise NotImplementedError
+    # defaults to the last 24 hours, for nightly reports
+    end_date = args.end or datetime.now().astimezone()
+    start_date = args.start or end_date - timedelta(days=1)
+    if start_date >= end_date:
+        parser.error("--start must be before --end")
 
-    logging.warning(
-        "Channel selection ont implemented - defaulting to channel 1 for now"
-    )
+    plots = args.plot or list(REPORT_PLOTS)
+    if args.variable:
+        plots = [plot for plot in plots if PLOT_VARIABLES[plot] in args.variable]
+        if not plots:
+            parser.error(
+                "none of the plots {} show the variables {}".format(
+                    ", ".join(args.plot), ", ".join(args.variable)
+                )
+            )
 
-    # Threshold for "alarms" report (will trigger if above the velocity
-    # required to meet this level's spec)
-    vc_threshold = "G"
-    arch.set_vc_threshold(vc_threshold)
-    logging.warning("VC level not implemented - defaulting to VC-G alarms for now!")
+    cache = None
+    if args.cache is not None:
+        from dlsVibrationTools.vib_cache import vib_cache
 
-    # fetch data & display
-    logging.info("Fetching data from EPICS...")
+        cache = vib_cache(args.cache)
 
-    df = arch.fetch_pv_to_dataframe(
-        pv_name=pv_name, start_date=start_date, end_date=end_date, channels=[1]
+    arch = vib_archive(
+        appliance_url=args.appliance,
+        appliance_port=args.port,
+        beamline=args.beamline[0] if args.beamline else None,
+        cache=cache,
     )
+    beamlines = args.beamline or [arch.beamline]
 
-    # print(df.head())
-    # print(df.info())
+    logging.info(
+        "{} of {} channels {} from {} to {}".format(
+            ", ".join(plots), ", ".join(beamlines), args.channel, start_date, end_date
+        )
+    )
 
-    # TODO: this needs to be done in a loop... or dictionary match. please
-    if plot_type == "vc":
-        p1 = Process(target=plot_vc_timeseries, args=(df,))
-        p1.start()
+    if args.metrics is not None:
+        enable_metrics(trace_memory=True)
 
-        p2 = Process(target=plot_vc_histograms, args=(df,))
-        p2.start()
-    elif plot_type == "spectrogram":
-        p1 = Process(target=plot_spectrogram, args=(df,))
-        p1.start()
+    if args.report is not None:
+        generate_report(
+            arch,
+            start_date,
+            end_date,
+            args.report,
+            beamlines=beamlines,
+            channels=args.channel,
+            ids=args.id,
+            plots=plots,
+            formats=args.format,
+            vc_threshold=args.threshold,
+        )
     else:
-        raise NotImplementedError
+        show_plots(
+            arch,
+            start_date,
+            end_date,
+            plots,
+            beamlines,
+            args.channel,
+            args.id,
+            args.threshold,
+        )
 
-    p1.join()
+    if cache is not None:
+        cache.flush()
 
-    if plot_type == "vc":
-        p2.join()
+    if args.metrics is not None:
+        REGISTRY.write(args.metrics)
+        logging.info("Metrics written to {}".format(args.metrics))
 
 
 # test with: pipenv run python -m dlsVibrationTools
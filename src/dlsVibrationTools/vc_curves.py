@@ -1,18 +1,41 @@
+from functools import lru_cache
 from string import ascii_uppercase
+
 import numpy as np
+import pandas as pd
+
+# VC levels
+VC_UPPER_LIMIT = (
+    np.array(
+        [0.012, 0.024, 0.048, 0.097, 0.195, 0.39, 0.78, 1.56, 3.12, 6.25, 12.5, 25, 50]
+    )
+    * 1e-6
+)
+VC_LABELS = list(ascii_uppercase)[0 : len(VC_UPPER_LIMIT)][::-1]
+# all levels returned by vc_get_levels, from the most to the least stringent
+VC_CATEGORIES = VC_LABELS + ["ISO"]
+# integer code of each level in VC_CATEGORIES (-1 is used for missing values)
+VC_CODES = {label: code for code, label in enumerate(VC_CATEGORIES)}
+
+# samples classified at once by vc_get_level_codes, bounds temporary memory
+_CHUNK = 1 << 16
+# vc_get_level_codes buckets floats by their sign, exponent and top 7 mantissa bits
+_LOOKUP_SHIFT = np.uint64(45)
 
-# VC levels 
-VC_UPPER_LIMIT = np.array([0.012, 0.024, 0.048, 0.097, 0.195, 0.39, 0.78, 1.56, 3.12, 6.25, 12.5, 25, 50])*1e-6
-VC_LABELS = list(ascii_uppercase)[0:len(VC_UPPER_LIMIT)][::-1]
 
 def vc_get_level(val: float) -> str:
     """Return the VC level key (letter) from a 1/3 octave velocity in m/s
 
-    This function maps VC_UPPER_LIMIT velocities to VC level labels, according to IEST-RP-CC012 (paywalled). The original paper (with out of date values) is available as:
-    
-    Colin G. Gordon, "Generic vibration criteria for vibration-sensitive equipment," Proc. SPIE 3786, Optomechanical Engineering and Vibration Control, (28 September 1999); https://doi.org/10.1117/12.363802
+    This function maps VC_UPPER_LIMIT velocities to VC level labels, according to
+    IEST-RP-CC012 (paywalled). The original paper (with out of date values) is
+    available as:
 
-    Note that this does not meet IEST on VC-B and above, as we are not relaxing <8Hz on VC-A and VC-B for brevity. This is a conservative approach for us.
+    Colin G. Gordon, "Generic vibration criteria for vibration-sensitive
+    equipment," Proc. SPIE 3786, Optomechanical Engineering and Vibration Control,
+    (28 September 1999); https://doi.org/10.1117/12.363802
+
+    Note that this does not meet IEST on VC-B and above, as we are not relaxing
+    <8Hz on VC-A and VC-B for brevity. This is a conservative approach for us.
 
     Args:
         val (float): value of the 1/3 velocity peak
@@ -23,16 +46,278 @@ def vc_get_level(val: float) -> str:
     try:
         return VC_LABELS[np.searchsorted(VC_UPPER_LIMIT, val)]
     except IndexError:
-        return 'ISO'
-    
+        return "ISO"
+
+
+@lru_cache(maxsize=None)
+def _level_lookup():
+    """Precomputed lookup tables for vc_get_level_codes
+
+    Every float64 falls in one of 2**19 buckets given by its top 19 bits. Buckets
+    are narrower (<1%) than the spacing of VC_UPPER_LIMIT, so each contains at most
+    one limit: the level of a value is the level at the bottom of its bucket
+    (base), plus one if it is above the limit inside the bucket (inner, +inf if
+    none).
+    """
+    buckets = np.arange(1 << (64 - int(_LOOKUP_SHIFT)), dtype=np.uint64)
+    lower = (buckets << _LOOKUP_SHIFT).view(np.float64)
+    upper = np.append(lower[1:], np.nan)
+
+    with np.errstate(invalid="ignore"):
+        index = np.searchsorted(VC_UPPER_LIMIT, lower)
+        limit = VC_UPPER_LIMIT[np.minimum(index, len(VC_UPPER_LIMIT) - 1)]
+        has_limit = (index < len(VC_UPPER_LIMIT)) & (lower >= 0) & (limit < upper)
+
+    base = index.astype(np.int8)
+    base[np.signbit(lower)] = 0  # negative values are below every limit
+    base[np.isnan(lower)] = -1
+    inner = np.where(has_limit, limit, np.inf)
+
+    return base, inner
+
+
+def vc_get_level_codes(vals) -> np.ndarray:
+    """Classifies a whole array of 1/3 octave velocities at once, returning integer
+    level codes instead of labels
+
+    This gives the same result as np.searchsorted(VC_UPPER_LIMIT, vals) but uses
+    precomputed lookup tables (see _level_lookup), which is several times faster on
+    large arrays.
+
+    Args:
+        vals (array-like): values of the 1/3 velocity peak in m/s (ndarray, Series
+            or list, any shape)
+
+    Returns:
+        np.ndarray: int8 array of the same shape, with the index of each level in
+            VC_CATEGORIES (0 for VC-M ... 12 for VC-A, 13 for ISO) and -1 for NaN
+            values
+    """
+    base, inner = _level_lookup()
+
+    vals = np.ascontiguousarray(vals, dtype=np.float64)
+    codes = np.empty(vals.shape, dtype=np.int8)
+
+    flat_vals = vals.reshape(-1)
+    flat_codes = codes.reshape(-1)
+    for i in range(0, flat_vals.size, _CHUNK):
+        chunk = flat_vals[i : i + _CHUNK]
+        bucket = chunk.view(np.uint64) >> _LOOKUP_SHIFT
+        flat_codes[i : i + _CHUNK] = base[bucket] + (chunk > inner[bucket])
+
+    return codes
+
+
+def vc_get_levels(vals) -> pd.Categorical:
+    """Vectorised version of vc_get_level, classifies a whole array of 1/3 octave
+    velocities at once
+
+    Args:
+        vals (array-like): values of the 1/3 velocity peak in m/s
+
+    Returns:
+        pd.Categorical: ordered categorical with categories VC_CATEGORIES (most
+            stringent first). NaN values are returned as missing.
+    """
+    codes = vc_get_level_codes(np.ravel(vals))
+    return pd.Categorical.from_codes(codes, categories=VC_CATEGORIES, ordered=True)
+
+
+def vc_level_counts(vals) -> pd.Series:
+    """Number of samples at each VC level
+
+    Args:
+        vals (array-like): values of the 1/3 velocity peak in m/s
+
+    Returns:
+        pd.Series: number of samples for each level in VC_CATEGORIES. NaN values
+            are not counted.
+    """
+    codes = vc_get_level_codes(vals).reshape(-1)
+    counts = np.bincount(codes[codes >= 0], minlength=len(VC_CATEGORIES))
+    return pd.Series(counts, index=VC_CATEGORIES, name="Samples")
+
+
+def vc_time_at_level(vals, durations) -> pd.Series:
+    """Total time spent at each VC level
+
+    Args:
+        vals (array-like): values of the 1/3 velocity peak in m/s
+        durations (array-like): time each sample is valid for, in seconds (e.g.
+            dT_Seconds from fetch_pv_to_dataframe). NaN durations are not counted.
+
+    Returns:
+        pd.Series: time in seconds at each level in VC_CATEGORIES
+    """
+    codes = vc_get_level_codes(vals).reshape(-1)
+    durations = np.asarray(durations, dtype=float).reshape(-1)
+    valid = (codes >= 0) & ~np.isnan(durations)
+    seconds = np.bincount(
+        codes[valid], weights=durations[valid], minlength=len(VC_CATEGORIES)
+    )
+    return pd.Series(seconds, index=VC_CATEGORIES, name="Seconds")
+
+
+def vc_count_above(vals, vc_labels: list) -> pd.Series:
+    """Number of samples above the threshold of each of several VC levels, in a
+    single pass over vals
+
+    Args:
+        vals (array-like): values of the 1/3 velocity peak in m/s
+        vc_labels (list): VC levels [A-M]
+
+    Returns:
+        pd.Series: number of samples above the threshold of each level
+    """
+    counts = vc_level_counts(vals).to_numpy()
+    # samples above a level's threshold are those in any less stringent level
+    above = np.cumsum(counts[::-1])[::-1]
+    codes = np.array([VC_CODES[label] for label in vc_labels], dtype=int)
+    return pd.Series(
+        np.append(above, 0)[codes + 1], index=list(vc_labels), name="Samples"
+    )
+
+
 def vc_get_threshold(vc_label: str) -> float:
-    """Returns the 1/3 velocity threshold in m/s corresponding to the VC-level specified as an input
+    """Returns the 1/3 velocity threshold in m/s corresponding to the VC-level
+    specified as an input
 
     Args:
-        vc_label (str): VC level [A-M] 
+        vc_label (str): VC level [A-M]
 
     Returns:
         float: 1/3 velocity threshold limit for specified VC level.
     """
     return VC_UPPER_LIMIT[VC_LABELS.index(vc_label)]
 
+
+def vc_get_thresholds(vc_labels) -> np.ndarray:
+    """Vectorised version of vc_get_threshold, for several VC levels at once
+
+    Args:
+        vc_labels (array-like): VC levels [A-M]
+
+    Returns:
+        np.ndarray: 1/3 velocity threshold limit for each VC level.
+    """
+    return VC_UPPER_LIMIT[[VC_CODES[label] for label in vc_labels]]
+
+
+# 1/3 octave bands over which VC curves are defined
+VC_BAND_RANGE = (1.0, 80.0)
+
+
+def third_octave_bands(fmin: float = VC_BAND_RANGE[0], fmax: float = VC_BAND_RANGE[1]):
+    """Base-10 1/3 octave bands (IEC 61260) with centre frequencies between fmin
+    and fmax
+
+    Args:
+        fmin (float, optional): lowest centre frequency in Hz. Defaults to 1.
+        fmax (float, optional): highest centre frequency in Hz. Defaults to 80.
+
+    Returns:
+        tuple: centre, lower and upper frequency of each band in Hz
+    """
+    n = np.arange(
+        np.ceil(10 * np.log10(fmin) - 1e-9), np.floor(10 * np.log10(fmax) + 1e-9) + 1
+    )
+    centre = 10 ** (n / 10)
+    return centre, centre * 10 ** (-1 / 20), centre * 10 ** (1 / 20)
+
+
+@lru_cache(maxsize=32)
+def _band_weights_cached(freq_bytes: bytes, fmin: float, fmax: float) -> np.ndarray:
+    freq = np.frombuffer(freq_bytes, dtype=np.float64)
+    _, lower, upper = third_octave_bands(fmin, fmax)
+
+    # each FFT bin covers [f - df/2, f + df/2)
+    edges = np.concatenate(
+        [
+            [freq[0] - (freq[1] - freq[0]) / 2],
+            (freq[1:] + freq[:-1]) / 2,
+            [freq[-1] + (freq[-1] - freq[-2]) / 2],
+        ]
+    )
+    bin_lo, bin_hi = edges[:-1, None], edges[1:, None]
+    overlap = np.clip(
+        np.minimum(bin_hi, upper[None, :]) - np.maximum(bin_lo, lower[None, :]), 0, None
+    )
+
+    weights = (overlap / (bin_hi - bin_lo)).astype(np.float32)
+    weights.flags.writeable = False
+    return weights
+
+
+def third_octave_weights(
+    freq, fmin: float = VC_BAND_RANGE[0], fmax: float = VC_BAND_RANGE[1]
+) -> np.ndarray:
+    """Band-to-bin weight matrix to integrate a spectrum into 1/3 octave bands
+
+    The weight of a bin in a band is the fraction of the bin width inside the band.
+    The matrix is computed once and cached for each frequency axis.
+
+    Args:
+        freq (array-like): frequency of each FFT bin in Hz, increasing (at least 2
+            bins)
+        fmin (float, optional): lowest band centre frequency in Hz. Defaults to 1.
+        fmax (float, optional): highest band centre frequency in Hz. Defaults to 80.
+
+    Returns:
+        np.ndarray: read-only (bins x bands) float32 weights
+    """
+    freq = np.ascontiguousarray(freq, dtype=np.float64)
+    return _band_weights_cached(freq.tobytes(), float(fmin), float(fmax))
+
+
+def vc_band_velocities(
+    spectra,
+    freq,
+    quantity: str = "velocity",
+    fmin: float = VC_BAND_RANGE[0],
+    fmax: float = VC_BAND_RANGE[1],
+) -> np.ndarray:
+    """RMS velocity in each 1/3 octave band, for many spectra at once
+
+    Args:
+        spectra (array-like): (time x frequency) RMS amplitude spectra (one value
+            per FFT bin), or a single spectrum
+        freq (array-like): frequency of each FFT bin in Hz
+        quantity (str, optional): "velocity" for spectra in m/s, "acceleration"
+            for spectra in m/s^2 (converted by dividing by 2*pi*f). Defaults to
+            "velocity".
+        fmin (float, optional): lowest band centre frequency in Hz. Defaults to 1.
+        fmax (float, optional): highest band centre frequency in Hz. Defaults to 80.
+
+    Returns:
+        np.ndarray: (time x bands) RMS velocities in m/s, see third_octave_bands
+            for the bands
+    """
+    spectra = np.asarray(spectra, dtype=np.float32)
+    freq = np.asarray(freq, dtype=np.float64)
+
+    power = np.square(spectra)
+    if quantity == "acceleration":
+        with np.errstate(divide="ignore"):
+            scale = np.where(freq > 0, 1 / (2 * np.pi * freq) ** 2, 0)
+        power *= scale.astype(np.float32)
+    elif quantity != "velocity":
+        raise ValueError('quantity must be "velocity" or "acceleration"')
+
+    return np.sqrt(power @ third_octave_weights(freq, fmin, fmax))
+
+
+def vc_peak_from_fft(spectra, freq, quantity: str = "velocity") -> np.ndarray:
+    """VC peak (highest 1/3 octave band RMS velocity over the VC band range) of many
+    spectra at once. This is the quantity of the VC_PEAK PV, re-derived from FFT
+    data
+
+    Args:
+        spectra (array-like): (time x frequency) RMS amplitude spectra
+        freq (array-like): frequency of each FFT bin in Hz
+        quantity (str, optional): see vc_band_velocities. Defaults to "velocity".
+
+    Returns:
+        np.ndarray: VC peak velocity of each spectrum in m/s, use vc_get_levels or
+            vc_get_level_codes for the VC level
+    """
+    return vc_band_velocities(spectra, freq, quantity).max(axis=-1)
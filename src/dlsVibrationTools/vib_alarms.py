@@ -0,0 +1,432 @@
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from dlsVibrationTools.vc_curves import vc_get_levels, vc_get_threshold
+
+__all__ = ["get_vib_alarms", "vc_alarm_detector"]
+
+ALARM_COLUMNS = ["PV", "Start", "End", "Duration", "Peak", "VC_Level", "Samples"]
+
+
+def _as_ns(time) -> np.ndarray:
+    # datetime-like array or Series to int64 nanoseconds since the epoch (UTC)
+    if isinstance(time, pd.Series):
+        return time.to_numpy(dtype="datetime64[ns]").view(np.int64)
+    return pd.DatetimeIndex(time).as_unit("ns").asi8
+
+
+def alarm_state(
+    values: np.ndarray,
+    group_start: np.ndarray,
+    threshold: float,
+    hysteresis: float = 0.0,
+    excluded: np.ndarray = None,
+    initial_state: np.ndarray = None,
+) -> np.ndarray:
+    """vectorised alarm state of each sample, with hysteresis
+
+    An alarm is raised when the value reaches threshold and is only cleared once
+    the value drops below threshold * (1 - hysteresis). Samples in between keep the
+    state of the previous sample of the same group (PV).
+
+    Args:
+        values (np.ndarray): VC peak velocities, grouped by PV and in time order
+        group_start (np.ndarray): True on the first sample of each PV
+        threshold (float): alarm threshold in m/s
+        hysteresis (float, optional): fraction of threshold below which the alarm
+            is cleared. Defaults to 0.
+        excluded (np.ndarray, optional): True on samples in exclusion windows,
+            which never alarm.
+        initial_state (np.ndarray, optional): alarm state before the first sample
+            of each group, for each sample where group_start is True. Defaults to
+            no alarm.
+
+    Returns:
+        np.ndarray: boolean alarm state of each sample
+    """
+
+    with np.errstate(invalid="ignore"):
+        raise_alarm = values >= threshold
+        clear_alarm = ~(values >= threshold * (1 - hysteresis))  # also clears on NaN
+
+    if excluded is not None:
+        raise_alarm &= ~excluded
+        clear_alarm |= excluded
+
+    # samples that set the state, each group starts from its initial state
+    decided = raise_alarm | clear_alarm
+    state = raise_alarm.copy()
+    if initial_state is not None:
+        undecided_start = group_start & ~decided
+        state[undecided_start] = initial_state[undecided_start[group_start]]
+    decided |= group_start
+
+    # forward-fill the state from the last deciding sample
+    last = np.maximum.accumulate(np.where(decided, np.arange(len(values)), 0))
+
+    return state[last]
+
+
+def alarm_episodes(state: np.ndarray, group_start: np.ndarray):
+    """start and end indices of each run of consecutive alarm samples, runs never
+    span two groups
+
+    Args:
+        state (np.ndarray): boolean alarm state of each sample
+        group_start (np.ndarray): True on the first sample of each PV
+
+    Returns:
+        tuple: arrays of the first and last sample index of each run
+    """
+
+    group_end = np.empty_like(group_start)
+    group_end[:-1] = group_start[1:]
+    group_end[-1:] = True
+
+    previous = np.empty_like(state)
+    previous[1:] = state[:-1]
+    previous[:1] = False
+    following = np.empty_like(state)
+    following[:-1] = state[1:]
+    following[-1:] = False
+
+    starts = np.flatnonzero(state & (~previous | group_start))
+    ends = np.flatnonzero(state & (~following | group_end))
+
+    return starts, ends
+
+
+def get_vib_alarms(
+    data: pd.DataFrame,
+    vc_threshold: str = "G",
+    hysteresis: float = 0.0,
+    min_duration: timedelta = timedelta(0),
+    exclusions: list = None,
+    max_gap: timedelta = None,
+) -> pd.DataFrame:
+    """returns a dataframe of alarms including time and duration
+
+    Alarms are episodes of consecutive samples of the same PV above the velocity of
+    vc_threshold. All PVs are processed at once, and data is not modified.
+
+    Args:
+        data (pandas.DataFrame): vibration dataframe from fetch_pv_to_dataframe
+        vc_threshold (str, optional): threshold for raising an alarm. Defaults to "G".
+        hysteresis (float, optional): an alarm only ends when the velocity drops
+            below the threshold by this fraction. Defaults to 0.
+        min_duration (timedelta, optional): shorter alarms are ignored. Defaults
+            to 0.
+        exclusions (list, optional): (start, end) datetimes of periods in which
+            alarms are ignored, e.g. planned works.
+        max_gap (timedelta, optional): alarms end at gaps in the data longer than
+            this, so that dropouts are not counted as alarm time (see
+            vib_quality.gap_threshold). Defaults to None, alarms span gaps.
+
+    Returns:
+        pd.DataFrame: one row per alarm, with PV, Start and End (time of the first
+            and last sample above threshold), Duration, Peak velocity, its
+            VC_Level and the number of Samples.
+    """
+
+    if data.empty:
+        return _alarms_dataframe(
+            pd.Categorical([]), data["Time"].iloc[:0], data["Time"].iloc[:0], [], []
+        )
+
+    categories, codes, time, values, order = _grouped_arrays(data)
+    group_start = _group_start(codes)
+    if max_gap is not None:
+        # samples after a gap start a new group, so episodes never span it
+        group_start[1:] |= np.diff(time) > pd.Timedelta(max_gap).value
+
+    state = alarm_state(
+        values,
+        group_start,
+        vc_get_threshold(vc_threshold),
+        hysteresis,
+        _excluded(time, exclusions),
+    )
+    starts, ends = alarm_episodes(state, group_start)
+
+    keep = time[ends] - time[starts] >= pd.Timedelta(min_duration).value
+    starts, ends = starts[keep], ends[keep]
+
+    return _alarms_dataframe(
+        pd.Categorical.from_codes(codes[starts], categories=categories),
+        data["Time"].take(starts if order is None else order[starts]),
+        data["Time"].take(ends if order is None else order[ends]),
+        episode_peaks(values, starts, ends),
+        ends - starts + 1,
+    )
+
+
+def _grouped_arrays(data: pd.DataFrame):
+    # PV categories and codes, time (ns) and VC peak arrays of data, grouped by PV
+    # and in time order. order is the sorting permutation, None if already sorted
+    pv = data["PV"]
+    if not isinstance(pv.dtype, pd.CategoricalDtype):
+        pv = pv.astype("category")
+
+    codes = pv.cat.codes.to_numpy()
+    time = _as_ns(data["Time"])
+    values = data["VC_Peak"].to_numpy(dtype=np.float64)
+
+    # no sort needed for fetch_pv_to_dataframe output
+    order = None
+    step = np.diff(codes)
+    if np.any(step < 0) or np.any((step == 0) & (np.diff(time) < 0)):
+        order = np.lexsort((time, codes))
+        codes, time, values = codes[order], time[order], values[order]
+
+    return pv.cat.categories, codes, time, values, order
+
+
+def _group_start(codes: np.ndarray) -> np.ndarray:
+    group_start = np.ones(len(codes), dtype=bool)
+    group_start[1:] = codes[1:] != codes[:-1]
+    return group_start
+
+
+def _excluded(time: np.ndarray, exclusions: list) -> np.ndarray:
+    # True on samples within any of the (start, end) exclusion windows
+    if not exclusions:
+        return None
+    excluded = np.zeros(len(time), dtype=bool)
+    for start, end in exclusions:
+        excluded |= (time >= _as_ns([start])[0]) & (time < _as_ns([end])[0])
+    return excluded
+
+
+def episode_peaks(values: np.ndarray, starts: np.ndarray, ends: np.ndarray):
+    """maximum of values over each [start, end] index range
+
+    Args:
+        values (np.ndarray): sample values
+        starts (np.ndarray): first index of each range
+        ends (np.ndarray): last index of each range
+
+    Returns:
+        np.ndarray: maximum of each range
+    """
+
+    if len(starts) == 0:
+        return np.zeros(0)
+
+    # reduceat over interleaved [start, end + 1) bounds, the last bound must be a
+    # valid index so it is dropped (the last slice then runs to the end)
+    bounds = np.empty(2 * len(starts), dtype=np.int64)
+    bounds[0::2] = starts
+    bounds[1::2] = ends + 1
+    if bounds[-1] == len(values):
+        bounds = bounds[:-1]
+    return np.maximum.reduceat(values, bounds)[0::2]
+
+
+def _alarms_dataframe(pv, start, end, peaks, samples) -> pd.DataFrame:
+    start = start.reset_index(drop=True)
+    end = end.reset_index(drop=True)
+    return pd.DataFrame(
+        {
+            "PV": pv,
+            "Start": start,
+            "End": end,
+            "Duration": end - start,
+            "Peak": np.asarray(peaks, dtype=np.float64),
+            "VC_Level": vc_get_levels(peaks),
+            "Samples": np.asarray(samples, dtype=np.int64),
+        },
+        columns=ALARM_COLUMNS,
+    )
+
+
+class vc_alarm_detector:
+    """Incremental alarm detection for live monitoring.
+
+    VC_PEAK samples are passed in batches to update, which returns the alarm start
+    and end events found in that batch. The open episode of each PV is carried
+    over from one batch to the next, so each batch is processed in O(batch) time
+    without going back over history. The episodes of the "end" events (plus those
+    closed by flush) are the same as get_vib_alarms on all the data at once.
+    """
+
+    EVENT_COLUMNS = ["Event", "Time"] + ALARM_COLUMNS
+
+    def __init__(
+        self,
+        vc_threshold: str = "G",
+        hysteresis: float = 0.0,
+        min_duration: timedelta = timedelta(0),
+        exclusions: list = None,
+        max_gap: timedelta = None,
+    ) -> None:
+        """
+        Args:
+            vc_threshold (str, optional): threshold for raising an alarm. Defaults
+                to "G".
+            hysteresis (float, optional): see get_vib_alarms. Defaults to 0.
+            min_duration (timedelta, optional): see get_vib_alarms. A "start" event
+                is only emitted once the alarm has lasted this long. Defaults to 0.
+            exclusions (list, optional): see get_vib_alarms.
+            max_gap (timedelta, optional): see get_vib_alarms, also applies to the
+                gap between batches. Defaults to None, alarms span gaps.
+        """
+
+        self.vc_threshold = vc_threshold
+        self.hysteresis = hysteresis
+        self.min_duration = pd.Timedelta(min_duration).value
+        self.exclusions = exclusions
+        self.max_gap = None if max_gap is None else pd.Timedelta(max_gap).value
+
+        # per PV: time (ns) of the last sample processed
+        self._last_time = {}
+        # per PV: [start (ns), end (ns), peak, samples, start event emitted]
+        self._open = {}
+
+    @property
+    def open_alarms(self) -> list:
+        """PVs currently in alarm"""
+        return list(self._open)
+
+    def update(self, data: pd.DataFrame) -> pd.DataFrame:
+        """processes a new batch of samples. Samples that are not newer than the
+        last sample already processed for the same PV are ignored.
+
+        Args:
+            data (pd.DataFrame): new samples, with PV, Time and VC_Peak columns
+
+        Returns:
+            pd.DataFrame: alarm events in time order, with the Event type ("start"
+                or "end"), its Time and the get_vib_alarms columns of the episode
+                (End, Duration, VC_Level are missing for "start" events).
+        """
+
+        if data.empty:
+            return self._events_dataframe([])
+
+        categories, codes, time, values, _ = _grouped_arrays(data)
+
+        # drop samples already processed
+        last_time = np.array(
+            [self._last_time.get(pv, np.iinfo(np.int64).min) for pv in categories]
+        )
+        new = time > last_time[codes]
+        codes, time, values = codes[new], time[new], values[new]
+
+        if len(codes) == 0:
+            return self._events_dataframe([])
+
+        pv_start = _group_start(codes)
+        pv_end = np.roll(pv_start, -1)
+        pvs = categories[codes[pv_start]]
+
+        gap = self._gaps(codes, time, pv_start, last_time)
+        group_start = pv_start | gap
+
+        state = alarm_state(
+            values,
+            group_start,
+            vc_get_threshold(self.vc_threshold),
+            self.hysteresis,
+            _excluded(time, self.exclusions),
+            initial_state=np.array(
+                [pv in self._open for pv in categories[codes[group_start]]]
+            )
+            & ~gap[group_start],
+        )
+        starts, ends = alarm_episodes(state, group_start)
+        peaks = episode_peaks(values, starts, ends)
+
+        events = []
+
+        # episodes left open by the previous batch that end before this one
+        for i in np.flatnonzero(pv_start & (~state | gap)):
+            episode = self._open.pop(categories[codes[i]], None)
+            if episode is not None:
+                self._close(categories[codes[i]], episode, events)
+
+        for start, end, peak in zip(starts, ends, peaks):
+            pv = categories[codes[start]]
+
+            episode = self._open.pop(pv, None) if pv_start[start] else None
+            if episode is None:
+                episode = [time[start], time[end], peak, end - start + 1, False]
+            else:
+                episode[1] = time[end]
+                episode[2] = max(episode[2], peak)
+                episode[3] += end - start + 1
+
+            if not episode[4] and episode[1] - episode[0] >= self.min_duration:
+                events.append(("start", pv, episode[0], *episode[:4]))
+                episode[4] = True
+
+            if pv_end[end]:
+                # still in alarm at the end of the batch
+                self._open[pv] = episode
+            else:
+                self._close(pv, episode, events)
+
+        self._last_time.update(zip(pvs, time[np.flatnonzero(pv_end)]))
+
+        return self._events_dataframe(events)
+
+    def _gaps(self, codes, time, pv_start, last_time) -> np.ndarray:
+        # True on samples more than max_gap after the previous sample of the same
+        # PV, including the last sample of the previous batch
+        if self.max_gap is None:
+            return np.zeros(len(time), dtype=bool)
+        previous = np.empty_like(time)
+        previous[1:] = time[:-1]
+        # PVs not seen before have no previous sample, hence no gap
+        first = np.flatnonzero(pv_start)
+        seen = last_time[codes[first]] != np.iinfo(np.int64).min
+        previous[first] = np.where(seen, last_time[codes[first]], time[first])
+        return time - previous > self.max_gap
+
+    def flush(self) -> pd.DataFrame:
+        """closes all the open alarms, e.g. at the end of the data
+
+        Returns:
+            pd.DataFrame: "end" events of the alarms that were open, see update
+        """
+
+        events = []
+        for pv, episode in self._open.items():
+            if not episode[4] and episode[1] - episode[0] >= self.min_duration:
+                events.append(("start", pv, episode[0], *episode[:4]))
+            self._close(pv, episode, events)
+        self._open = {}
+
+        return self._events_dataframe(events)
+
+    def _close(self, pv: str, episode: list, events: list) -> None:
+        if episode[1] - episode[0] >= self.min_duration:
+            events.append(("end", pv, episode[1], *episode[:4]))
+
+    def _events_dataframe(self, events: list) -> pd.DataFrame:
+        event, pv, time, start, end, peak, samples = (
+            zip(*events) if events else [[]] * 7
+        )
+        is_end = np.array(event) == "end"
+
+        start = pd.to_datetime(np.array(start, dtype=np.int64), utc=True)
+        end = pd.to_datetime(np.array(end, dtype=np.int64), utc=True).where(is_end)
+        peak = np.array(peak, dtype=np.float64)
+
+        df = pd.DataFrame(
+            {
+                "Event": list(event),
+                "Time": pd.to_datetime(np.array(time, dtype=np.int64), utc=True),
+                "PV": list(pv),
+                "Start": start,
+                "End": end,
+                "Duration": end - start,
+                "Peak": peak,
+                "VC_Level": vc_get_levels(np.where(is_end, peak, np.nan)),
+                "Samples": np.array(samples, dtype=np.int64),
+            },
+            columns=self.EVENT_COLUMNS,
+        )
+
+        return df.sort_values("Time", kind="stable", ignore_index=True)
@@ -1,33 +1,120 @@
 import logging
-from datetime import datetime
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
 from os import environ
+from string import Formatter
 
+import numpy as np
 import pandas as pd
+import requests
+from aa.data import ArchiveData
 from aa.js import JsonFetcher
 
-from dlsVibrationTools.vc_curves import vc_get_level, vc_get_threshold
+from dlsVibrationTools.vc_curves import vc_get_levels, vc_peak_from_fft
+from dlsVibrationTools.vib_alarms import get_vib_alarms  # noqa: F401
+from dlsVibrationTools.vib_cache import DAY, vib_cache
+from dlsVibrationTools.vib_metrics import stage
+from dlsVibrationTools.vib_spectra import fft_row_views, fft_spectra
 
 # logging.getLogger(__name__).addHandler(logging.NullHandler())
 
+# HTTP status codes of an appliance that is down or overloaded, rather than one
+# rejecting the request
+_UNAVAILABLE = (502, 503, 504)
+
+
+class _TimeoutJsonFetcher(JsonFetcher):
+    """JsonFetcher that applies a timeout to every request it sends to the appliance.
+
+    aa.js.JsonFetcher calls requests.get without a timeout, which means a stalled
+    archiver connection blocks a worker forever.
+    """
+
+    def __init__(self, hostname: str, port: int, timeout: float = None) -> None:
+        super().__init__(hostname, port)
+        self._timeout = timeout
+
+    def _fetch_data(self, pv, start, end, request_params):
+        url = self._construct_url(pv, start, end, request_params)
+        return requests.get(url, stream=self._binary, timeout=self._timeout)
+
+    def _get_values(self, pv, start, end, count, request_params):
+        # as aa.fetcher.AaFetcher, timing the request and the parsing separately
+        with stage("archiver.request", pv=pv) as record:
+            response = self._fetch_data(pv, start, end, request_params)
+            response.raise_for_status()
+            record["bytes"] = len(response.content)
+        with stage("archiver.parse", pv=pv) as record:
+            data = self._parse_raw_data(response, pv, start, end, count)
+            record["rows"] = len(data.timestamps)
+        return data
+
 
 class vib_archive:
     implemented_variables = ("VC_PEAK", "FFT")  # PVs currently supported
     default_beamline = "i20"
+    fft_resolution = 1.0  # Hz, width of each bin of the FFT PVs
+    fft_quantity = "velocity"  # FFT PVs are RMS velocity spectra in m/s
+    catalogue_ttl = 3600.0  # s, how long the archiver PV list is cached for
+
+    # archiver post-processors supported for reduced fetches, see fetch_pv_reduced
+    reduce_operators = ("mean", "min", "max", "count", "firstSample", "lastSample")
+    reduce_bins = (1, 5, 10, 30, 60, 300, 600, 900, 1800, 3600, 7200, 21600, 43200)
 
     def __init__(
         self,
         appliance_url="archappl.diamond.ac.uk",
         pv_mask: str = "{beamline}-DI-ACCEL-{id:02}:DATA:CH{chan:02}:{var}",
         beamline: str = None,
+        appliance_port: int = 80,
+        max_workers: int = 8,
+        timeout: float = 60.0,
+        retries: int = 3,
+        backoff: float = 1.0,
+        cache: vib_cache = None,
     ) -> None:
+        """
+        Args:
+            appliance_url (str, optional): hostname of the archiver appliance.
+            pv_mask (str, optional): format string used to build PV names.
+            beamline (str, optional): beamline to fetch data from. Defaults to the
+                current beamline, see get_current_beamline_canonical.
+            appliance_port (int, optional): port of the archiver appliance.
+                Defaults to 80.
+            max_workers (int, optional): maximum number of PVs fetched concurrently.
+                Defaults to 8.
+            timeout (float, optional): timeout in seconds for each archiver request.
+                Defaults to 60.
+            retries (int, optional): number of times a failed request is retried
+                before giving up. Defaults to 3.
+            backoff (float, optional): delay in seconds before the first retry,
+                doubled at every following attempt. Defaults to 1.
+            cache (vib_cache, optional): on-disk cache of archiver data. Defaults to
+                None (no cache).
+        """
 
         self.appliance_url = appliance_url
+        self.appliance_port = appliance_port
         self.pv_mask = pv_mask
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.cache = cache
+
+        # archiver PV list of each beamline, see archived_pvs
+        self._archived = {}
+        self._archived_lock = threading.Lock()
+
+        # post-processors the appliance rejected, binned client-side from then on
+        self._rejected_reduce = set()
 
         if beamline is None:
             self.beamline = self.get_current_beamline_canonical()
         else:
-            pass
+            self.beamline = canonical_beamline(beamline)
 
     def build_pv_names(
         self,
@@ -77,110 +164,867 @@ class vib_archive:
                 ).format(beamline)
             )
 
-        # let's make the name "canonical" (from i20 to BL20I)
-        if beamline[0] in ("i", "j", "k"):
-            beamline = "BL{0}{1}".format(beamline[1:], beamline[0].upper())
-        else:
-            raise NotImplementedError(
-                "Currently only iXX, jXX and kXX beamlines are supported"
+        return canonical_beamline(beamline)
+
+    def _pv_glob(self, beamline: str) -> str:
+        # pv_mask with every field but the beamline replaced by a wildcard
+        parts = []
+        for literal, field, _, _ in Formatter().parse(self.pv_mask):
+            parts.append(literal)
+            if field is not None:
+                parts.append(beamline if field == "beamline" else "*")
+        return "".join(parts)
+
+    def archived_pvs(self, beamline: str, refresh: bool = False) -> frozenset:
+        """names of the PVs of a beamline that are archived, as listed by the
+        archiver appliance. The list is cached for catalogue_ttl seconds.
+
+        Args:
+            beamline (str): beamline, either canonical (BL20I) or not (i20)
+            refresh (bool, optional): ignore the cached list. Defaults to False.
+
+        Returns:
+            frozenset: PV full names matching pv_mask for that beamline
+        """
+
+        glob = self._pv_glob(canonical_beamline(beamline))
+
+        with self._archived_lock:
+            cached = self._archived.get(glob)
+        if cached and not refresh and time.time() - cached[0] < self.catalogue_ttl:
+            return cached[1]
+
+        response = requests.get(
+            "http://{}:{}/retrieval/bpl/getMatchingPVs".format(
+                self.appliance_url, self.appliance_port
+            ),
+            params={"pv": glob, "limit": -1},
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+        pvs = frozenset(response.json())
+
+        with self._archived_lock:
+            self._archived[glob] = (time.time(), pvs)
+        logging.info("{} archived PVs match {}".format(len(pvs), glob))
+
+        return pvs
+
+    def pv_catalogue(
+        self,
+        channels: list,
+        ids: list = [1],
+        beamlines: list = None,
+        variables: list = None,
+        validate: bool = True,
+    ) -> pd.DataFrame:
+        """expands pv_mask over every beamline, IOC id, channel and variable
+
+        Args:
+            channels (list): list of channels
+            ids (list, optional): list of vibration IOC ids. Defaults to [1].
+            beamlines (list, optional): list of beamlines, canonical or not.
+                Defaults to [self.beamline].
+            variables (list, optional): list of variables. Defaults to
+                implemented_variables.
+            validate (bool, optional): check every PV against the archiver PV list
+                (one cached request per beamline, see archived_pvs). Defaults to
+                True.
+
+        Raises:
+            NotImplementedError: if a variable is not in implemented_variables
+
+        Returns:
+            pd.DataFrame: one row per PV, with Beamline (canonical), ID, Channel,
+                Variable and PV columns, and an Archived column if validated
+        """
+
+        if beamlines is None:
+            beamlines = [self.beamline]
+        if variables is None:
+            variables = list(self.implemented_variables)
+
+        for variable in variables:
+            if variable not in self.implemented_variables:
+                raise NotImplementedError(variable)
+
+        beamlines = list(dict.fromkeys(canonical_beamline(b) for b in beamlines))
+
+        index = pd.MultiIndex.from_product(
+            [beamlines, ids, channels, variables],
+            names=["Beamline", "ID", "Channel", "Variable"],
+        )
+        catalogue = index.to_frame(index=False)
+        catalogue["PV"] = [
+            self.pv_mask.format(beamline=beamline, id=id, chan=chan, var=var)
+            for beamline, id, chan, var in index
+        ]
+
+        if validate:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                archived = frozenset().union(*pool.map(self.archived_pvs, beamlines))
+            catalogue["Archived"] = catalogue["PV"].isin(archived)
+
+        return catalogue.astype({"Beamline": "category", "Variable": "category"})
+
+    def fetch_pv(self, pv: str, start_date: datetime, end_date: datetime):
+        """retrieves a single PV from the archiver appliance, retrying requests
+        that failed to connect, timed out or got a server error (5xx) with an
+        exponential backoff. If the archive has a cache, only the
+        intervals that are not cached yet are requested from the appliance.
+
+        Args:
+            pv (str): EPICS PV full name
+            start_date (datetime): datetime, start of data.
+            end_date (datetime): datetime, end of data
+
+        Raises:
+            requests.RequestException: if the request still fails after
+                self.retries retries, or at once for client errors such as a 404
+
+        Returns:
+            aa.data.ArchiveData: the archived data for the PV
+        """
+
+        if self.cache is None:
+            return self._fetch_pv(pv, start_date, end_date)
+
+        start, end = start_date.timestamp(), end_date.timestamp()
+
+        for a, b in self.cache.missing_intervals(pv, start, end):
+            data = self._fetch_pv(
+                pv,
+                datetime.fromtimestamp(a, timezone.utc),
+                datetime.fromtimestamp(b, timezone.utc),
             )
+            self.cache.store(pv, a, b, data.timestamps, data.values, data.severities)
 
-        return beamline
+        with stage("cache.load", pv=pv) as record:
+            timestamps, values, severities = self.cache.load(pv, start, end)
+            record["rows"] = len(timestamps)
+        logging.info("Loaded PV {} from cache".format(pv))
+
+        return ArchiveData(pv, values, timestamps, severities)
+
+    def _fetch_pv(self, pv: str, start_date: datetime, end_date: datetime):
+        # fetch_pv without the cache
+
+        jf = _TimeoutJsonFetcher(self.appliance_url, self.appliance_port, self.timeout)
+
+        for attempt in range(self.retries + 1):
+            try:
+                logging.info("Fetching PV {} from {}".format(pv, self.appliance_url))
+                data = jf.get_values(pv, start_date, end_date)
+                logging.info("Finished fetching PV {}".format(pv))
+                return data
+            except requests.RequestException as e:
+                if attempt == self.retries or not _is_transient(e):
+                    raise
+                delay = self.backoff * 2**attempt
+                logging.warning(
+                    "Fetching PV {} failed ({}), retrying in {:.1f}s".format(
+                        pv, e, delay
+                    )
+                )
+                time.sleep(delay)
+
+    def fetch_pvs(
+        self, pv_fullnames: list, start_date: datetime, end_date: datetime
+    ) -> list:
+        """retrieves several PVs concurrently, using at most self.max_workers
+        simultaneous requests
+
+        Args:
+            pv_fullnames (list): list of EPICS PV full names
+            start_date (datetime): datetime, start of data.
+            end_date (datetime): datetime, end of data
+
+        Returns:
+            list: ArchiveData for each PV, in the same order as pv_fullnames
+        """
+
+        with stage("archiver.fetch") as record, ThreadPoolExecutor(
+            max_workers=self.max_workers
+        ) as executor:
+            datas = list(
+                executor.map(
+                    lambda pv: self.fetch_pv(pv, start_date, end_date), pv_fullnames
+                )
+            )
+            record["rows"] = sum(len(data.timestamps) for data in datas)
+
+        return datas
+
+    def auto_bin_size(
+        self, start_date: datetime, end_date: datetime, max_points: int
+    ) -> int:
+        """smallest of reduce_bins (or whole number of days) that reduces the range
+        to at most max_points bins
+
+        Args:
+            start_date (datetime): datetime, start of data.
+            end_date (datetime): datetime, end of data
+            max_points (int): maximum number of bins
+
+        Returns:
+            int: bin size in seconds
+        """
+
+        width = (end_date - start_date).total_seconds() / max_points
+        for bin_size in self.reduce_bins:
+            if bin_size >= width:
+                return bin_size
+        return int(np.ceil(width / DAY)) * int(DAY)
+
+    def fetch_pv_reduced(
+        self,
+        pv: str,
+        start_date: datetime,
+        end_date: datetime,
+        reduce: str,
+        bin_size: int,
+    ):
+        """retrieves a PV aggregated over bins of bin_size seconds, asking the
+        appliance to do it with a post-processor (e.g. mean_600(PV)) so that only
+        one sample per bin is transferred. Binned data is never cached, raw data
+        is (see fetch_pv). If the appliance rejects the operator,
+        raw data is fetched and binned client-side instead (see bin_archive_data),
+        and so are later fetches with the same operator. Data that is not binned
+        like the post-processor output (at most one sample per bin, at its start)
+        is binned client-side too, e.g. if the appliance ignored the operator.
+
+        Args:
+            pv (str): EPICS PV full name
+            start_date (datetime): datetime, start of data.
+            end_date (datetime): datetime, end of data
+            reduce (str): aggregate of each bin, see reduce_operators
+            bin_size (int): bin size in seconds. Bins are aligned to multiples of
+                bin_size since the epoch, and timestamped at their start.
+
+        Raises:
+            ValueError: if reduce is not in reduce_operators
+            requests.RequestException: if the PV cannot be fetched at all, or the
+                appliance is unavailable
+
+        Returns:
+            aa.data.ArchiveData: one sample per non-empty bin
+        """
+
+        if reduce not in self.reduce_operators:
+            raise ValueError("Unsupported reduce operator: {}".format(reduce))
+
+        rejected = None
+        if reduce not in self._rejected_reduce:
+            try:
+                # not cached: bins crossing the edges of cached intervals would be
+                # stored with only part of their data
+                data = self._fetch_pv(
+                    "{}_{}({})".format(reduce, bin_size, pv), start_date, end_date
+                )
+                data = ArchiveData(pv, data.values, data.timestamps, data.severities)
+                if _is_binned(data.timestamps, bin_size):
+                    return data
+                # the appliance ignored the post-processor and sent raw data
+                return bin_archive_data(data, reduce, bin_size)
+            except requests.HTTPError as e:
+                status = None if e.response is None else e.response.status_code
+                if status is None or status in _UNAVAILABLE:
+                    raise
+                rejected = e
+
+        # raises if the PV itself cannot be fetched, e.g. it is not archived
+        data = self.fetch_pv(pv, start_date, end_date)
+        if rejected is not None:
+            logging.warning(
+                "Server-side binning with {} failed ({}), binning client-side".format(
+                    reduce, rejected
+                )
+            )
+            self._rejected_reduce.add(reduce)
+
+        return bin_archive_data(data, reduce, bin_size)
 
     def fetch_pv_to_dataframe(
-        self, pv_name: str, start_date: datetime, end_date: datetime, channels: list
+        self,
+        pv_name: str,
+        start_date: datetime,
+        end_date: datetime,
+        channels: list,
+        ids: list = [1],
+        beamlines: list = None,
+        derive_vc: bool = False,
+        reduce: str = None,
+        bin_size: int = None,
+        max_points: int = 2000,
     ) -> pd.DataFrame:
         """retrieves a vibration PV from the Diamond archiver appliance, returns it as
         a dataframe with some useful calculated fields
 
+        All channels, IOC ids and beamlines are fetched concurrently (see fetch_pvs).
+        With reduce, each PV is aggregated over time bins by the appliance (see
+        fetch_pv_reduced), e.g. for long trends.
+
         Args:
             pv_name (str): EPICS PV full name
             start_date (datetime): datetime, start of data.
             end_date (datetime): datetime, end of data
             channels (list): list of channels
+            ids (list, optional): list of vibration IOC ids. Defaults to [1].
+            beamlines (list, optional): list of beamlines. Defaults to
+                [self.beamline].
+            derive_vc (bool, optional): for FFT PVs, also compute VC_Peak and
+                VC_Level from the spectra. Defaults to False.
+            reduce (str, optional): aggregate returned for each time bin instead of
+                raw samples, see reduce_operators. Defaults to None (raw data).
+            bin_size (int, optional): bin size in seconds for reduce. Defaults to
+                auto_bin_size(start_date, end_date, max_points).
+            max_points (int, optional): maximum number of bins per PV when bin_size
+                is not given. Defaults to 2000.
 
         Returns:
             pd.DataFrame: a Pandas dataframe including the PV augmented with further
                           useful data
         """
 
-        if pv_name not in self.implemented_variables:
-            raise NotImplementedError()
+        # TODO: check for timezone, if not present throw a warning and assume UTC
 
-        jf = JsonFetcher(self.appliance_url, 80)
+        pv_fullnames = self.expand_pv_names(pv_name, channels, ids, beamlines)
 
-        # TODO: support multiple PVs (maybe from the base system PV and automatically
-        #       build labels etc?)
-        # TODO: check for timezone, if not present throw a warning and assume UTC
+        if reduce is None:
+            datas = self.fetch_pvs(pv_fullnames, start_date, end_date)
+        else:
+            if bin_size is None:
+                bin_size = self.auto_bin_size(start_date, end_date, max_points)
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                datas = list(
+                    executor.map(
+                        lambda pv: self.fetch_pv_reduced(
+                            pv, start_date, end_date, reduce, bin_size
+                        ),
+                        pv_fullnames,
+                    )
+                )
+        logging.info("Finished fetching all PVs")
 
-        pv_fullnames = self.build_pv_names(
-            beamline=self.beamline, variable=pv_name, channels=channels
+        # the VC level of a number of samples is meaningless
+        vc_levels = reduce != "count"
+        return arrays_to_dataframe(
+            pv_name,
+            pv_fullnames,
+            [data.timestamps for data in datas],
+            [data.values for data in datas],
+            vc_levels=vc_levels,
+            **self._fft_options(datas, derive_vc and vc_levels),
         )
 
-        df = pd.DataFrame()
+    def _fft_options(self, datas: list, derive_vc: bool) -> dict:
+        # arrays_to_dataframe arguments to derive VC levels from FFT PVs
+        if not derive_vc or not datas:
+            return {}
+        width = _fft_width([data.values for data in datas])
+        return {
+            "fft_freq": np.arange(width) * self.fft_resolution,
+            "fft_quantity": self.fft_quantity,
+        }
 
-        for pv in pv_fullnames:
-            this_pv_df = pd.DataFrame()
+    def fetch_fft_spectra(
+        self,
+        start_date: datetime,
+        end_date: datetime,
+        channels: list,
+        ids: list = [1],
+        beamlines: list = None,
+    ) -> dict:
+        """retrieves the FFT PVs from the archiver appliance as dense (time x
+        frequency) float32 spectra
 
-            logging.info("Fetching PV {} from {}".format(pv, self.appliance_url))
-            data = jf.get_values(pv, start_date, end_date)
-            logging.info("Finished fetching PV {}".format(pv))
+        Args:
+            start_date (datetime): datetime, start of data.
+            end_date (datetime): datetime, end of data
+            channels (list): list of channels
+            ids (list, optional): list of vibration IOC ids. Defaults to [1].
+            beamlines (list, optional): list of beamlines. Defaults to
+                [self.beamline].
 
-            # time-specific stuff
-            this_pv_df["Time"] = data.utc_datetimes
-            this_pv_df["dT"] = this_pv_df["Time"].shift(-1) - this_pv_df["Time"]
-            this_pv_df["dT_Seconds"] = this_pv_df.apply(
-                lambda x: x["dT"].total_seconds(), axis=1
-            )  # needed for histplot
+        Returns:
+            dict: fft_spectra for each PV full name
+        """
 
-            # metadata
-            this_pv_df["PV"] = pv
+        pv_fullnames = self.expand_pv_names("FFT", channels, ids, beamlines)
 
-            # this is specific to VC peak data
-            if pv_name == "VC_PEAK":
-                this_pv_df["VC_Peak"] = data.values
-                this_pv_df["VC_Level"] = this_pv_df.apply(
-                    lambda x: vc_get_level(x["VC_Peak"]), axis=1
-                )
-            elif pv_name == "FFT":
-                this_pv_df["FFT"] = data.values.tolist()
+        datas = self.fetch_pvs(pv_fullnames, start_date, end_date)
+        logging.info("Finished fetching all PVs")
+
+        return self._to_spectra(pv_fullnames, datas)
+
+    def fetch_variables(
+        self,
+        variables: list,
+        start_date: datetime,
+        end_date: datetime,
+        channels: list,
+        ids: list = [1],
+        beamlines: list = None,
+    ) -> dict:
+        """retrieves several variables in a single batch of concurrent requests,
+        fetching each PV exactly once
+
+        Args:
+            variables (list): variables to retrieve, see implemented_variables
+            start_date (datetime): datetime, start of data.
+            end_date (datetime): datetime, end of data
+            channels (list): list of channels
+            ids (list, optional): list of vibration IOC ids. Defaults to [1].
+            beamlines (list, optional): list of beamlines. Defaults to
+                [self.beamline].
+
+        Returns:
+            dict: for each variable, the fetch_fft_spectra dict for FFT and the
+                fetch_pv_to_dataframe dataframe otherwise
+        """
 
-            # concatenate current PV to the rest... of the fire...
-            df = pd.concat([df, this_pv_df], axis=0).reset_index(drop=True)
+        variables = list(dict.fromkeys(variables))
+        pv_fullnames = {
+            var: self.expand_pv_names(var, channels, ids, beamlines)
+            for var in variables
+        }
 
+        datas = iter(
+            self.fetch_pvs(
+                [pv for var in variables for pv in pv_fullnames[var]],
+                start_date,
+                end_date,
+            )
+        )
         logging.info("Finished fetching all PVs")
 
-        # handle categorical data appropriately
-        if pv_name == "VC_PEAK":
-            df["VC_Level"] = df["VC_Level"].astype("category")
+        results = {}
+        for var in variables:
+            var_datas = [next(datas) for _ in pv_fullnames[var]]
+            if var == "FFT":
+                results[var] = self._to_spectra(pv_fullnames[var], var_datas)
+            else:
+                results[var] = arrays_to_dataframe(
+                    var,
+                    pv_fullnames[var],
+                    [data.timestamps for data in var_datas],
+                    [data.values for data in var_datas],
+                )
+
+        return results
+
+    def _to_spectra(self, pv_fullnames: list, datas: list) -> dict:
+        # PVs without data get the frequency axis of the others
+        values = _fft_matrices([data.values for data in datas])
+        return {
+            pv: fft_spectra(
+                _utc_index(data.timestamps),
+                v,
+                pv=pv,
+                freq_resolution=self.fft_resolution,
+            )
+            for pv, data, v in zip(pv_fullnames, datas, values)
+        }
+
+    def iter_chunks(
+        self,
+        pv_fullnames: list,
+        start_date: datetime,
+        end_date: datetime,
+        chunk: timedelta = timedelta(hours=1),
+        prefetch: int = 2,
+    ):
+        """fetches several PVs chunk by chunk, so that a long time range never needs
+        to be in memory at once. While a chunk is being processed, the next
+        `prefetch` chunks are already being fetched.
+
+        Args:
+            pv_fullnames (list): list of EPICS PV full names
+            start_date (datetime): datetime, start of data.
+            end_date (datetime): datetime, end of data
+            chunk (timedelta, optional): length of each chunk. Defaults to 1 hour.
+            prefetch (int, optional): number of chunks fetched ahead. Defaults to 2.
+
+        Yields:
+            tuple: chunk start and end datetimes, and the list of ArchiveData for
+                each PV (in the same order as pv_fullnames). Each sample belongs to
+                exactly one chunk.
+        """
+
+        bounds = []
+        while start_date < end_date:
+            bounds.append((start_date, min(start_date + chunk, end_date)))
+            start_date += chunk
+
+        pending = []
+        queued = 0
+        with ThreadPoolExecutor(max_workers=prefetch + 1) as executor:
+            try:
+                for i, (a, b) in enumerate(bounds):
+                    # keep the prefetch window full
+                    while queued < min(i + prefetch + 1, len(bounds)):
+                        pending.append(
+                            executor.submit(
+                                self.fetch_pvs, pv_fullnames, *bounds[queued]
+                            )
+                        )
+                        queued += 1
+
+                    datas = pending.pop(0).result()
+                    last = i == len(bounds) - 1
+
+                    yield a, b, [_clip(data, a, b, last) for data in datas]
+            finally:
+                for f in pending:
+                    f.cancel()
+
+    def iter_pv_to_dataframe(
+        self,
+        pv_name: str,
+        start_date: datetime,
+        end_date: datetime,
+        channels: list,
+        ids: list = [1],
+        beamlines: list = None,
+        chunk: timedelta = timedelta(hours=1),
+        prefetch: int = 2,
+        derive_vc: bool = False,
+    ):
+        """streaming version of fetch_pv_to_dataframe, see iter_chunks
+
+        Args:
+            pv_name (str): EPICS PV full name
+            start_date (datetime): datetime, start of data.
+            end_date (datetime): datetime, end of data
+            channels (list): list of channels
+            ids (list, optional): list of vibration IOC ids. Defaults to [1].
+            beamlines (list, optional): list of beamlines. Defaults to
+                [self.beamline].
+            chunk (timedelta, optional): length of each chunk. Defaults to 1 hour.
+            prefetch (int, optional): number of chunks fetched ahead. Defaults to 2.
+            derive_vc (bool, optional): see fetch_pv_to_dataframe.
+
+        Yields:
+            pd.DataFrame: fetch_pv_to_dataframe dataframe of each chunk
+        """
+
+        pv_fullnames = self.expand_pv_names(pv_name, channels, ids, beamlines)
+
+        for _, _, datas in self.iter_chunks(
+            pv_fullnames, start_date, end_date, chunk, prefetch
+        ):
+            yield arrays_to_dataframe(
+                pv_name,
+                pv_fullnames,
+                [data.timestamps for data in datas],
+                [data.values for data in datas],
+                **self._fft_options(datas, derive_vc),
+            )
+
+    def iter_fft_spectra(
+        self,
+        start_date: datetime,
+        end_date: datetime,
+        channels: list,
+        ids: list = [1],
+        beamlines: list = None,
+        chunk: timedelta = timedelta(hours=1),
+        prefetch: int = 2,
+    ):
+        """streaming version of fetch_fft_spectra, see iter_chunks
+
+        Args:
+            start_date (datetime): datetime, start of data.
+            end_date (datetime): datetime, end of data
+            channels (list): list of channels
+            ids (list, optional): list of vibration IOC ids. Defaults to [1].
+            beamlines (list, optional): list of beamlines. Defaults to
+                [self.beamline].
+            chunk (timedelta, optional): length of each chunk. Defaults to 1 hour.
+            prefetch (int, optional): number of chunks fetched ahead. Defaults to 2.
+
+        Yields:
+            dict: fft_spectra of each chunk for each PV full name
+        """
+
+        pv_fullnames = self.expand_pv_names("FFT", channels, ids, beamlines)
+
+        for _, _, datas in self.iter_chunks(
+            pv_fullnames, start_date, end_date, chunk, prefetch
+        ):
+            yield self._to_spectra(pv_fullnames, datas)
+
+    def expand_pv_names(
+        self, pv_name: str, channels: list, ids: list = [1], beamlines: list = None
+    ) -> list:
+        """builds the PV names of a variable for every beamline, IOC id and channel
+
+        Args:
+            pv_name (str): which PV to retrieve
+            channels (list): list of channels
+            ids (list, optional): list of vibration IOC ids. Defaults to [1].
+            beamlines (list, optional): list of beamlines. Defaults to
+                [self.beamline].
+
+        Raises:
+            NotImplementedError: if pv_name is not in implemented_variables
+
+        Returns:
+            list: PV full names
+        """
 
-        df["PV"] = df["PV"].astype("category")
+        if pv_name not in self.implemented_variables:
+            raise NotImplementedError()
 
-        return df
+        catalogue = self.pv_catalogue(
+            channels, ids, beamlines, [pv_name], validate=False
+        )
+        return catalogue["PV"].tolist()
 
     def set_vc_threshold(self, vc_thresh: str) -> None:
         self.vc_threshold = vc_thresh
 
 
-def get_vib_alarms(data: pd.DataFrame, vc_threshold: str = "G"):
-    """returns a dataframe of alarms including time and duration
+def canonical_beamline(beamline: str) -> str:
+    """canonical name of a beamline, e.g. BL20I for i20
 
     Args:
-        data (pandas.DataFrame): vibration dataframe from fetch_pv_to_dataframe
-        vc_threshold (str, optional): threshold for raising an alarm. Defaults to "G".
+        beamline (str): beamline name, iXX, jXX, kXX or already canonical
+
+    Raises:
+        NotImplementedError: for any other name
+
+    Returns:
+        str: the canonical beamline name
     """
 
-    # TODO: add an exclusion times PV (list of tuples?)
-    vc_alarm_val = vc_get_threshold(vc_threshold)
+    if beamline.startswith("BL"):
+        return beamline
+
+    # let's make the name "canonical" (from i20 to BL20I)
+    if beamline[0] in ("i", "j", "k"):
+        beamline = "BL{0}{1}".format(beamline[1:], beamline[0].upper())
+    else:
+        raise NotImplementedError(
+            "Currently only iXX, jXX and kXX beamlines are supported"
+        )
+
+    return beamline
+
+
+def bin_archive_data(data: ArchiveData, reduce: str, bin_size: float) -> ArchiveData:
+    """aggregates archiver data over time bins, like the appliance post-processors
+
+    Args:
+        data (ArchiveData): raw data, in time order
+        reduce (str): "mean", "min", "max", "count", "firstSample" or "lastSample"
+        bin_size (float): bin size in seconds. Bins are aligned to multiples of
+            bin_size since the epoch, and timestamped at their start.
+
+    Raises:
+        ValueError: for any other reduce
+
+    Returns:
+        ArchiveData: one sample per non-empty bin
+    """
+
+    bins = np.floor(data.timestamps / bin_size) * bin_size
+    starts = np.flatnonzero(np.r_[True, bins[1:] != bins[:-1]]) if len(bins) else []
+    counts = np.diff(np.append(starts, len(bins)))
+    values = data.values
+
+    if not len(starts):
+        reduced = values[:0]
+    elif reduce == "mean":
+        reduced = np.add.reduceat(values, starts, axis=0, dtype=np.float64)
+        reduced /= counts.reshape((-1,) + (1,) * (values.ndim - 1))
+    elif reduce == "min":
+        reduced = np.minimum.reduceat(values, starts, axis=0)
+    elif reduce == "max":
+        reduced = np.maximum.reduceat(values, starts, axis=0)
+    elif reduce == "count":
+        reduced = counts.astype(np.float64)
+    elif reduce == "firstSample":
+        reduced = values[starts]
+    elif reduce == "lastSample":
+        reduced = values[starts + counts - 1]
+    else:
+        raise ValueError("Unsupported reduce operator: {}".format(reduce))
+
+    severities = (
+        np.maximum.reduceat(data.severities, starts) if len(starts) else data.severities
+    )
+
+    return ArchiveData(data.pv, reduced, bins[starts], severities)
+
+
+def _is_transient(e: requests.RequestException) -> bool:
+    # connection problems, timeouts and server errors are worth retrying, a 404
+    # for a PV that is not archived is not
+    if isinstance(e, requests.HTTPError):
+        return e.response is not None and e.response.status_code >= 500
+    return isinstance(e, (requests.ConnectionError, requests.Timeout))
+
+
+def _is_binned(timestamps: np.ndarray, bin_size: float) -> bool:
+    # post-processed data has at most one sample per bin, timestamped at its start.
+    # A sparse raw PV has one sample per bin too, but at any time
+    bins = timestamps / bin_size
+    return bool(
+        np.all(np.abs(bins - np.round(bins)) < 1e-6) and np.all(np.diff(bins) > 0.5)
+    )
+
 
-    # TODO: when supporting multiple PVs, it will need grouping by channel before doing
-    # these next bits
-    data["VC_Alarm"] = data.apply(
-        lambda x: False if x["VC_Peak"] < vc_alarm_val else True, axis=1
+def _clip(data: ArchiveData, start: datetime, end: datetime, last: bool):
+    # keeps the samples in [start, end), or [start, end] for the last chunk. The
+    # appliance can also return the last sample before the requested range
+    ts = data.timestamps
+    keep = (ts >= start.timestamp()) & (
+        (ts <= end.timestamp()) if last else (ts < end.timestamp())
     )
+    if np.all(keep):
+        return data
+    return ArchiveData(data.pv, data.values[keep], ts[keep], data.severities[keep])
 
-    # TODO: can we avoid adding a column altogether and creating alarm_list from the
-    # lambda function above?
-    alarm_list = data.loc[data["VC_Alarm"]].copy()
 
-    alarm_list["Time_To_Next"] = alarm_list["Time"].shift(-1) - alarm_list["Time"]
+def _scalar_values(values) -> np.ndarray:
+    # aapy returns scalar PVs as (samples x 1), and (0 x 1) for PVs without data
+    values = np.asarray(values, dtype=np.float64)
+    if not len(values):
+        return np.empty(0)
+    return values.reshape(len(values), -1)[:, 0]
+
+
+def _fft_width(values: list) -> int:
+    # number of frequency bins of the first FFT PV with data
+    for v in values:
+        if len(v):
+            return np.asarray(v).reshape(len(v), -1).shape[1]
+    return 0
+
+
+def _fft_matrices(values: list) -> list:
+    # (time x frequency) values of each FFT PV. aapy returns PVs without data as
+    # (0 x 1), which would not stack with the others
+    width = _fft_width(values)
+    return [
+        np.asarray(v).reshape(len(v), -1) if len(v) else np.zeros((0, width))
+        for v in values
+    ]
+
+
+def _utc_index(timestamps: np.ndarray) -> pd.DatetimeIndex:
+    # POSIX timestamps in seconds to a nanosecond UTC DatetimeIndex
+    time_ns = np.round(np.asarray(timestamps, dtype=np.float64) * 1e9).astype(np.int64)
+    return pd.DatetimeIndex(
+        time_ns.view("datetime64[ns]"), dtype=pd.DatetimeTZDtype("ns", "UTC")
+    )
+
+
+def arrays_to_dataframe(
+    pv_name: str,
+    pvs: list,
+    timestamps: list,
+    values: list,
+    fft_freq: np.ndarray = None,
+    fft_quantity: str = "velocity",
+    vc_levels: bool = True,
+) -> pd.DataFrame:
+    """builds the fetch_pv_to_dataframe dataframe from per-PV arrays
+
+    All PVs are concatenated column by column and the dataframe is assembled once,
+    so peak memory stays close to the size of the final dataframe.
+
+    Args:
+        pv_name (str): variable the PVs refer to (one of
+            vib_archive.implemented_variables)
+        pvs (list): EPICS PV full names
+        timestamps (list): for each PV, an array of POSIX timestamps in seconds,
+            or of datetime64 UTC times (kept to the nanosecond)
+        values (list): for each PV, an array of values (one row per timestamp)
+        fft_freq (np.ndarray, optional): frequency axis of FFT PVs in Hz. If given,
+            VC_Peak and VC_Level are also computed from the FFT spectra.
+        fft_quantity (str, optional): quantity of the FFT PVs, see
+            vc_curves.vc_band_velocities. Defaults to "velocity".
+        vc_levels (bool, optional): compute the VC_Level of VC_PEAK PVs. Defaults
+            to True.
+
+    Returns:
+        pd.DataFrame: a Pandas dataframe including the PV augmented with further
+                      useful data
+    """
+
+    with stage("dataframe", variable=pv_name) as record:
+        data = _arrays_to_dataframe(
+            pv_name, pvs, timestamps, values, fft_freq, fft_quantity, vc_levels
+        )
+        record["rows"] = len(data)
+        record["bytes"] = int(data.memory_usage(deep=False).sum())
+
+    return data
+
+
+def _arrays_to_dataframe(
+    pv_name, pvs, timestamps, values, fft_freq, fft_quantity, vc_levels
+):
+    # arrays_to_dataframe without the instrumentation
+    lengths = np.array([len(ts) for ts in timestamps], dtype=np.int64)
+
+    # time-specific stuff
+    # fill a single preallocated array, so that only one PV at a time is converted
+    offsets = np.concatenate([[0], np.cumsum(lengths)])
+    time_ns = np.empty(offsets[-1], dtype=np.int64)
+    for ts, a, b in zip(timestamps, offsets[:-1], offsets[1:]):
+        ts = np.asarray(ts)
+        if ts.dtype.kind == "M":
+            time_ns[a:b] = ts.astype("datetime64[ns]").view(np.int64)
+        else:
+            time_ns[a:b] = np.round(ts.astype(np.float64) * 1e9)
+
+    # dT is the time to the next sample of the same PV
+    dT = np.empty(len(time_ns), dtype="timedelta64[ns]")
+    np.subtract(time_ns[1:], time_ns[:-1], out=dT[:-1].view(np.int64))
+    dT[offsets[1:][lengths > 0] - 1] = np.timedelta64("NaT")
+    dT = pd.TimedeltaIndex(dT)
+
+    time = pd.DatetimeIndex(
+        time_ns.view("datetime64[ns]"), dtype=pd.DatetimeTZDtype("ns", "UTC")
+    )
+    del time_ns
+
+    # metadata
+    categories = pd.Index(pvs).unique().sort_values()
+    pv_codes = np.repeat(categories.get_indexer(pvs).astype(np.int32), lengths)
+
+    columns = {
+        "Time": time,
+        "dT": dT,
+        "dT_Seconds": dT.total_seconds(),  # needed for histplot
+        "PV": pd.Categorical.from_codes(pv_codes, categories=categories),
+    }
+
+    # this is specific to VC peak data
+    if pv_name == "VC_PEAK":
+        vc_peak = np.concatenate([_scalar_values(v) for v in values] or [[]])
+        columns["VC_Peak"] = vc_peak
+        if vc_levels:
+            with stage("vc_levels", variable=pv_name) as record:
+                columns["VC_Level"] = vc_get_levels(vc_peak)
+                record["rows"] = len(vc_peak)
+    elif pv_name == "FFT":
+        # one dense float32 matrix, each row of the column is a view on it
+        fft = np.concatenate(_fft_matrices(values) or [np.zeros((0, 0))])
+        fft = fft.astype(np.float32, copy=False)
+        columns["FFT"] = fft_row_views(fft)
+
+        if fft_freq is not None:
+            with stage("vc_levels", variable=pv_name) as record:
+                columns["VC_Peak"] = (
+                    vc_peak_from_fft(fft, fft_freq, fft_quantity)
+                    if len(fft)
+                    else np.empty(0)
+                )
+                columns["VC_Level"] = vc_get_levels(columns["VC_Peak"])
+                record["rows"] = len(fft)
+
+    return pd.DataFrame(columns, copy=False)
@@ -0,0 +1,281 @@
+import asyncio
+import json
+import logging
+from concurrent.futures import Executor
+from datetime import datetime, timezone
+
+import aiohttp
+import numpy as np
+import pandas as pd
+from aa.data import ArchiveData
+
+from dlsVibrationTools.vib_archive import arrays_to_dataframe, vib_archive
+
+__all__ = ["vib_archive_async"]
+
+
+def _format_datetime(dt: datetime) -> str:
+    # same format as aa.fetcher.AaFetcher
+    return dt.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def _parse_body(pv: str, body: bytes) -> ArchiveData:
+    # decodes a getData.json response, away from the event loop
+    return _parse_json(pv, json.loads(body) if body else [])
+
+
+def _is_transient(e: Exception) -> bool:
+    # connection problems, timeouts and server errors are worth retrying, a 404
+    # for a PV that is not archived is not
+    if isinstance(e, aiohttp.ClientResponseError):
+        return e.status >= 500
+    return isinstance(
+        e,
+        (
+            aiohttp.ClientConnectionError,
+            aiohttp.ClientPayloadError,
+            asyncio.TimeoutError,
+        ),
+    )
+
+
+def _parse_json(pv: str, json_data: list) -> ArchiveData:
+    # builds the arrays directly rather than one aa.data.ArchiveEvent per sample
+    events = json_data[0]["data"] if json_data and "data" in json_data[0] else []
+
+    return ArchiveData(
+        pv,
+        np.array([event["val"] for event in events], dtype=np.float64),
+        np.array([event["secs"] + 1e-9 * event["nanos"] for event in events]),
+        np.array([event["severity"] for event in events], dtype=np.int64),
+    )
+
+
+class vib_archive_async:
+    """asyncio counterpart of vib_archive, to fetch data from within an event loop.
+
+    All requests go through one aiohttp session, whose connection pool keeps
+    connections to the appliance alive across calls. At most max_concurrency
+    requests are in flight at any time however many coroutines share the client,
+    so one client can serve many dashboards. Cancelling a fetch cancels its
+    pending requests. Responses are decoded in an executor, so that large FFT
+    responses do not hold up the event loop.
+
+    PV names, FFT resolution etc. are taken from a vib_archive (see names).
+
+    Example:
+
+        async with vib_archive_async(beamline="BL20I") as client:
+            df = await client.fetch_pv_to_dataframe("VC_PEAK", start, end, [1, 2])
+    """
+
+    def __init__(
+        self,
+        appliance_url="archappl.diamond.ac.uk",
+        pv_mask: str = "{beamline}-DI-ACCEL-{id:02}:DATA:CH{chan:02}:{var}",
+        beamline: str = None,
+        appliance_port: int = 80,
+        max_concurrency: int = 64,
+        timeout: float = 60.0,
+        retries: int = 3,
+        backoff: float = 1.0,
+        executor: Executor = None,
+    ) -> None:
+        """
+        Args:
+            appliance_url (str, optional): hostname of the archiver appliance.
+            pv_mask (str, optional): format string used to build PV names.
+            beamline (str, optional): beamline to fetch data from. Defaults to the
+                current beamline, see vib_archive.get_current_beamline_canonical.
+            appliance_port (int, optional): port of the archiver appliance.
+                Defaults to 80.
+            max_concurrency (int, optional): maximum number of requests in flight.
+                Defaults to 64.
+            timeout (float, optional): timeout in seconds for each archiver request.
+                Defaults to 60.
+            retries (int, optional): number of times a failed request is retried
+                before giving up. Defaults to 3.
+            backoff (float, optional): delay in seconds before the first retry,
+                doubled at every following attempt. Defaults to 1.
+            executor (Executor, optional): where responses are decoded, e.g. a
+                ProcessPoolExecutor. Defaults to the default executor of the loop.
+        """
+
+        self.names = vib_archive(
+            appliance_url=appliance_url,
+            pv_mask=pv_mask,
+            beamline=beamline,
+            appliance_port=appliance_port,
+        )
+        self.url = "http://{}:{}/retrieval/data/getData.json".format(
+            appliance_url, appliance_port
+        )
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.executor = executor
+
+        self._session = None
+        self._semaphore = None
+
+    async def __aenter__(self) -> "vib_archive_async":
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        """the shared session, created on first use inside the running loop"""
+
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.max_concurrency),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._session
+
+    async def close(self) -> None:
+        """closes the session and its pooled connections"""
+
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def fetch_pv(self, pv: str, start_date: datetime, end_date: datetime):
+        """retrieves a single PV from the archiver appliance, retrying requests
+        that failed to connect, timed out or got a server error (5xx) with an
+        exponential backoff
+
+        Args:
+            pv (str): EPICS PV full name
+            start_date (datetime): datetime, start of data.
+            end_date (datetime): datetime, end of data
+
+        Raises:
+            aiohttp.ClientError: if the request still fails after self.retries
+                retries, or at once for client errors such as a 404
+            asyncio.TimeoutError: if the last attempt timed out
+
+        Returns:
+            aa.data.ArchiveData: the archived data for the PV
+        """
+
+        session = self.session
+        params = {
+            "pv": pv,
+            "from": _format_datetime(start_date),
+            "to": _format_datetime(end_date),
+            "fetchLatestMetadata": "true",
+        }
+
+        for attempt in range(self.retries + 1):
+            try:
+                async with self._semaphore:
+                    logging.info("Fetching PV {} from {}".format(pv, self.url))
+                    async with session.get(self.url, params=params) as response:
+                        response.raise_for_status()
+                        body = await response.read()
+                logging.info("Finished fetching PV {}".format(pv))
+                break
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt == self.retries or not _is_transient(e):
+                    raise
+                delay = self.backoff * 2**attempt
+                logging.warning(
+                    "Fetching PV {} failed ({!r}), retrying in {:.1f}s".format(
+                        pv, e, delay
+                    )
+                )
+                await asyncio.sleep(delay)
+
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, _parse_body, pv, body)
+
+    async def fetch_pvs(
+        self, pv_fullnames: list, start_date: datetime, end_date: datetime
+    ) -> list:
+        """retrieves several PVs concurrently. If any of them fails, or the caller
+        is cancelled, the other requests are cancelled.
+
+        Args:
+            pv_fullnames (list): list of EPICS PV full names
+            start_date (datetime): datetime, start of data.
+            end_date (datetime): datetime, end of data
+
+        Returns:
+            list: ArchiveData for each PV, in the same order as pv_fullnames
+        """
+
+        tasks = [
+            asyncio.ensure_future(self.fetch_pv(pv, start_date, end_date))
+            for pv in pv_fullnames
+        ]
+        try:
+            return await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def fetch_pv_to_dataframe(
+        self,
+        pv_name: str,
+        start_date: datetime,
+        end_date: datetime,
+        channels: list,
+        ids: list = [1],
+        beamlines: list = None,
+        derive_vc: bool = False,
+    ) -> pd.DataFrame:
+        """see vib_archive.fetch_pv_to_dataframe
+
+        Args:
+            pv_name (str): which PV to retrieve
+            start_date (datetime): datetime, start of data.
+            end_date (datetime): datetime, end of data
+            channels (list): list of channels
+            ids (list, optional): list of vibration IOC ids. Defaults to [1].
+            beamlines (list, optional): list of beamlines. Defaults to
+                [self.names.beamline].
+            derive_vc (bool, optional): for FFT PVs, also compute VC_Peak and
+                VC_Level from the spectra. Defaults to False.
+
+        Returns:
+            pd.DataFrame: same as vib_archive.fetch_pv_to_dataframe
+        """
+
+        pv_fullnames = self.names.expand_pv_names(pv_name, channels, ids, beamlines)
+
+        datas = await self.fetch_pvs(pv_fullnames, start_date, end_date)
+        logging.info("Finished fetching all PVs")
+
+        return arrays_to_dataframe(
+            pv_name,
+            pv_fullnames,
+            [data.timestamps for data in datas],
+            [data.values for data in datas],
+            **self.names._fft_options(datas, derive_vc),
+        )
+
+    async def fetch_fft_spectra(
+        self,
+        start_date: datetime,
+        end_date: datetime,
+        channels: list,
+        ids: list = [1],
+        beamlines: list = None,
+    ) -> dict:
+        """see vib_archive.fetch_fft_spectra
+
+        Returns:
+            dict: fft_spectra for each PV full name
+        """
+
+        pv_fullnames = self.names.expand_pv_names("FFT", channels, ids, beamlines)
+
+        datas = await self.fetch_pvs(pv_fullnames, start_date, end_date)
+        logging.info("Finished fetching all PVs")
+
+        return self.names._to_spectra(pv_fullnames, datas)
@@ -0,0 +1,382 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import quote
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: only threads of one process share the cache
+    fcntl = None
+
+__all__ = ["vib_cache"]
+
+DAY = 86400.0  # seconds, size of each cache partition
+
+
+def merge_intervals(intervals: list) -> list:
+    """merges overlapping or touching [start, end) intervals
+
+    Args:
+        intervals (list): list of (start, end) pairs
+
+    Returns:
+        list: sorted, non-overlapping [start, end] pairs
+    """
+
+    merged = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        elif end > start:
+            merged.append([start, end])
+    return merged
+
+
+def subtract_intervals(start: float, end: float, intervals: list) -> list:
+    """returns the parts of [start, end) not covered by intervals
+
+    Args:
+        start (float): start of the range
+        end (float): end of the range
+        intervals (list): sorted, non-overlapping (start, end) pairs
+
+    Returns:
+        list: [start, end] pairs of the uncovered parts, in order
+    """
+
+    missing = []
+    for a, b in intervals:
+        if b <= start:
+            continue
+        if a >= end:
+            break
+        if a > start:
+            missing.append([start, a])
+        start = max(start, b)
+    if start < end:
+        missing.append([start, end])
+    return missing
+
+
+class vib_cache:
+    """On-disk cache of archiver data, partitioned by PV and UTC day.
+
+    Each partition is an .npz file holding the timestamps, values and severities of
+    one PV for one day. An index (index.json) records which time intervals have
+    already been fetched for each PV, so that only the missing intervals need to be
+    requested from the archiver, and when each partition was last used, so that the
+    least recently used partitions are evicted once the cache exceeds max_bytes.
+
+    Several processes (e.g. report workers or overlapping cron jobs) can share a
+    cache directory: the index is only changed under a lock file, re-read from
+    disk first, and files are replaced atomically. Reads do not write the index,
+    the last use of partitions is saved with the next store or by flush.
+    """
+
+    def __init__(
+        self,
+        path: str = os.path.join("~", ".cache", "dlsVibrationTools"),
+        max_bytes: int = 10 * 1024**3,
+        settle_time: float = 3600.0,
+    ) -> None:
+        """
+        Args:
+            path (str, optional): cache directory. Defaults to
+                ~/.cache/dlsVibrationTools.
+            max_bytes (int, optional): maximum size of the cached data, in bytes.
+                Defaults to 10 GiB.
+            settle_time (float, optional): data more recent than this many seconds
+                is never marked as cached, as the archiver may still be receiving
+                it. Defaults to 1 hour.
+        """
+
+        self.path = os.path.expanduser(path)
+        self.max_bytes = max_bytes
+        self.settle_time = settle_time
+
+        self._lock = threading.Lock()
+        # last use of partitions since the index was last written
+        self._last_used = {}
+
+        os.makedirs(self.path, exist_ok=True)
+        self._index = self._read_index()
+
+    def __enter__(self) -> "vib_cache":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.flush()
+
+    @property
+    def _index_file(self) -> str:
+        return os.path.join(self.path, "index.json")
+
+    def _read_index(self) -> dict:
+        try:
+            with open(self._index_file, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"intervals": {}, "partitions": {}}
+
+    @contextmanager
+    def _locked_index(self):
+        # holds the lock of the cache directory, with the index as it is on disk
+        # and the pending last use times applied. The index is written on exit
+        with self._lock, open(os.path.join(self.path, "index.lock"), "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                self._index = self._read_index()
+                partitions = self._index["partitions"]
+                for partition, last_used in self._last_used.items():
+                    if partition in partitions:
+                        info = partitions[partition]
+                        info["last_used"] = max(info["last_used"], last_used)
+                self._last_used = {}
+
+                yield self._index
+
+                _write_atomic(
+                    self._index_file, lambda f: f.write(json.dumps(self._index))
+                )
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def flush(self) -> None:
+        """writes the last use of the partitions read since the last store to the
+        index, for eviction"""
+
+        if self._last_used:
+            # the pending times are applied when the index is locked
+            with self._locked_index():
+                pass
+
+    def _partition(self, pv: str, day: int) -> str:
+        # relative path of a partition, PV names are escaped to be valid file names
+        return os.path.join(quote(pv, safe="-_."), "{}.npz".format(day))
+
+    def _load_partition(self, partition: str):
+        with np.load(os.path.join(self.path, partition)) as f:
+            return f["timestamps"], f["values"], f["severities"]
+
+    def _forget(self, pv: str, day: int) -> None:
+        # the intervals of a day are no longer cached
+        day_start = day * DAY
+        self._index["intervals"][pv] = [
+            i
+            for a, b in self.intervals(pv)
+            for i in subtract_intervals(a, b, [[day_start, day_start + DAY]])
+        ]
+
+    @property
+    def nbytes(self) -> int:
+        """total size of the cached partitions, in bytes"""
+        return sum(p["bytes"] for p in self._index["partitions"].values())
+
+    def intervals(self, pv: str) -> list:
+        """time intervals already cached for a PV
+
+        Args:
+            pv (str): EPICS PV full name
+
+        Returns:
+            list: sorted [start, end] pairs of POSIX timestamps
+        """
+
+        return [list(i) for i in self._index["intervals"].get(pv, [])]
+
+    def missing_intervals(self, pv: str, start: float, end: float) -> list:
+        """time intervals of [start, end) that are not cached for a PV, including
+        the ones cached by other processes since
+
+        Args:
+            pv (str): EPICS PV full name
+            start (float): POSIX timestamp, start of data
+            end (float): POSIX timestamp, end of data
+
+        Returns:
+            list: [start, end] pairs of POSIX timestamps to fetch from the archiver
+        """
+
+        with self._lock:
+            # written atomically, so it can be read without the lock file
+            self._index = self._read_index()
+            return subtract_intervals(start, end, self.intervals(pv))
+
+    def store(
+        self,
+        pv: str,
+        start: float,
+        end: float,
+        timestamps: np.ndarray,
+        values: np.ndarray,
+        severities: np.ndarray,
+    ) -> None:
+        """adds the data fetched for [start, end) to the cache
+
+        Args:
+            pv (str): EPICS PV full name
+            start (float): POSIX timestamp, start of the fetched interval
+            end (float): POSIX timestamp, end of the fetched interval
+            timestamps (np.ndarray): POSIX timestamps of the samples
+            values (np.ndarray): values, one row per sample
+            severities (np.ndarray): EPICS alarm severities, one per sample
+        """
+
+        values = values.reshape(len(values), -1) if len(values) else values
+
+        with self._locked_index():
+            for day in range(int(start // DAY), int(np.ceil(end / DAY))):
+                in_day = (timestamps >= day * DAY) & (timestamps < (day + 1) * DAY)
+                if not np.any(in_day):
+                    continue
+
+                partition = self._partition(pv, day)
+                new = (timestamps[in_day], values[in_day], severities[in_day])
+
+                if partition in self._index["partitions"]:
+                    old = self._load_partition(partition)
+                    if old[1].shape[1] == new[1].shape[1]:
+                        new = tuple(np.concatenate([o, n]) for o, n in zip(old, new))
+                    else:
+                        # the old data is overwritten, e.g. the FFT length changed
+                        self._forget(pv, day)
+
+                # sort by time, keeping a single copy of any sample fetched twice
+                _, order = np.unique(new[0], return_index=True)
+                new = tuple(a[order] for a in new)
+
+                filename = os.path.join(self.path, partition)
+                os.makedirs(os.path.dirname(filename), exist_ok=True)
+                _write_atomic(
+                    filename,
+                    lambda f: np.savez(
+                        f, timestamps=new[0], values=new[1], severities=new[2]
+                    ),
+                    mode="wb",
+                )
+
+                self._index["partitions"][partition] = {
+                    "pv": pv,
+                    "day": day,
+                    "bytes": os.path.getsize(filename),
+                    "width": new[1].shape[1],
+                    "last_used": time.time(),
+                }
+
+            # recent data may still be on its way to the archiver
+            end = min(end, time.time() - self.settle_time)
+            self._index["intervals"][pv] = merge_intervals(
+                self.intervals(pv) + [[start, end]]
+            )
+
+            self._evict()
+
+    def load(self, pv: str, start: float, end: float):
+        """reads the cached data of a PV between start and end
+
+        Args:
+            pv (str): EPICS PV full name
+            start (float): POSIX timestamp, start of data
+            end (float): POSIX timestamp, end of data (included)
+
+        Returns:
+            tuple: timestamps, values and severities arrays
+
+        Raises:
+            ValueError: if the values cached on different days have a different
+                number of columns, e.g. the FFT length changed in between
+        """
+
+        parts = []
+        with self._lock:
+            for day in range(int(start // DAY), int(end // DAY) + 1):
+                partition = self._partition(pv, day)
+                if partition not in self._index["partitions"]:
+                    continue
+                try:
+                    parts.append(self._load_partition(partition))
+                except FileNotFoundError:
+                    # evicted by another process in the meantime
+                    continue
+                self._last_used[partition] = time.time()
+
+        if not parts:
+            return np.zeros(0), np.zeros((0, 1)), np.zeros(0)
+
+        widths = sorted({p[1].shape[1] for p in parts})
+        if len(widths) > 1:
+            raise ValueError(
+                "Cached data of {} has values of different widths {} between {} "
+                "and {}, e.g. the FFT length changed: clear the cache of this PV "
+                "with vib_cache.clear({!r})".format(pv, widths, start, end, pv)
+            )
+
+        timestamps, values, severities = (
+            np.concatenate([p[i] for p in parts]) for i in range(3)
+        )
+        keep = (timestamps >= start) & (timestamps <= end)
+
+        return timestamps[keep], values[keep], severities[keep]
+
+    def clear(self, pv: str = None) -> None:
+        """removes the cached data of a PV, or of all PVs
+
+        Args:
+            pv (str, optional): EPICS PV full name. Defaults to None, all PVs.
+        """
+
+        with self._locked_index():
+            partitions = self._index["partitions"]
+            for partition in [
+                p for p in partitions if pv is None or partitions[p]["pv"] == pv
+            ]:
+                del partitions[partition]
+                try:
+                    os.remove(os.path.join(self.path, partition))
+                except FileNotFoundError:
+                    pass
+
+            if pv is None:
+                self._index["intervals"] = {}
+            else:
+                self._index["intervals"].pop(pv, None)
+
+    def _evict(self) -> None:
+        # removes least recently used partitions until the cache fits in max_bytes
+        partitions = self._index["partitions"]
+        size = self.nbytes
+
+        for partition in sorted(partitions, key=lambda p: partitions[p]["last_used"]):
+            if size <= self.max_bytes:
+                break
+
+            info = partitions.pop(partition)
+            size -= info["bytes"]
+            try:
+                os.remove(os.path.join(self.path, partition))
+            except FileNotFoundError:
+                pass
+
+            self._forget(info["pv"], info["day"])
+            logging.info("Evicted {} from the archiver cache".format(partition))
+
+
+def _write_atomic(filename: str, write, mode: str = "w") -> None:
+    # writes to a temporary file next to filename, then renames it, so that
+    # readers in other processes never see a partly written file
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(filename), suffix=".tmp")
+    try:
+        with os.fdopen(fd, mode) as f:
+            write(f)
+        os.replace(tmp, filename)
+    except BaseException:
+        os.remove(tmp)
+        raise
@@ -0,0 +1,362 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import reduce
+
+import numpy as np
+import pandas as pd
+
+from dlsVibrationTools.vib_alarms import _as_ns
+
+__all__ = ["cross_spectra", "welch_segments"]
+
+
+def welch_segments(
+    data: np.ndarray, fs: float, nperseg: int = 1024, overlap: float = 0.5
+):
+    """windowed FFT of overlapping segments of time series, as in Welch's method
+
+    Args:
+        data (np.ndarray): (channel x sample) time series, sampled simultaneously
+        fs (float): sampling frequency in Hz
+        nperseg (int, optional): samples per segment. Defaults to 1024.
+        overlap (float, optional): overlap between segments, as a fraction of
+            nperseg. Defaults to 0.5.
+
+    Returns:
+        tuple: frequency of each bin in Hz, (channel x segment x frequency)
+            complex spectra, and the scale that turns their products into power
+            spectral densities
+    """
+
+    data = np.atleast_2d(np.asarray(data, dtype=np.float64))
+    step = max(int(nperseg * (1 - overlap)), 1)
+    window = np.hanning(nperseg)
+
+    segments = np.lib.stride_tricks.sliding_window_view(data, nperseg, axis=1)
+    segments = segments[:, ::step]
+    # detrended (mean removed) and windowed
+    spectra = np.fft.rfft(
+        (segments - segments.mean(axis=-1, keepdims=True)) * window, axis=-1
+    )
+
+    # one-sided power spectral density
+    scale = 2.0 / (fs * np.sum(window**2))
+
+    return np.fft.rfftfreq(nperseg, 1 / fs), spectra, scale
+
+
+class cross_spectra:
+    """Auto- and cross-spectra of every pair of channels, accumulated over
+    segments (or FFT PV samples) so that coherence and transmissibility between
+    channels can be calculated, e.g. to see vibration going from the floor through
+    a girder to an optics table.
+
+    For each frequency, the products of all channel pairs are one (channel x
+    segment) @ (segment x channel) matrix product. They are computed for blocks of
+    frequencies in parallel threads and summed, so the statistics can be updated
+    chunk by chunk and merged across processes like spectral_stats.
+
+    With complex spectra (phase=True, e.g. from welch_segments) the estimates are
+    the usual magnitude-squared coherence and H1 transfer function. The archived
+    FFT PVs have no phase: for them, coherence is the squared correlation over
+    time of the spectral amplitudes of the two channels in each frequency bin,
+    and transmissibility the ratio of their RMS amplitudes.
+    """
+
+    def __init__(
+        self, channels: list, freq: np.ndarray, phase: bool = False, scale=1.0
+    ) -> None:
+        """
+        Args:
+            channels (list): channel names, e.g. PVs. Pairs are ordered as
+                (input, output) = (channels[i], channels[j]) with i < j.
+            freq (np.ndarray): frequency of each bin in Hz
+            phase (bool, optional): whether spectra are complex. Defaults to False.
+            scale (float, optional): factor turning mean products into auto- and
+                cross-spectra, e.g. from welch_segments. Defaults to 1.
+        """
+
+        self.channels = list(channels)
+        self.freq = np.asarray(freq, dtype=np.float64)
+        self.phase = phase
+        self.scale = scale
+
+        dtype = np.complex128 if phase else np.float64
+        n, f = len(self.channels), len(self.freq)
+        self.count = 0
+        self._sum = np.zeros((n, f), dtype=dtype)
+        self._products = np.zeros((f, n, n), dtype=dtype)
+
+    def __repr__(self) -> str:
+        return "cross_spectra({} channels, {} frequencies, {} segments)".format(
+            len(self.channels), len(self.freq), self.count
+        )
+
+    @property
+    def pairs(self) -> list:
+        """(input, output) channel names of each pair"""
+        i, j = np.triu_indices(len(self.channels), 1)
+        return [(self.channels[a], self.channels[b]) for a, b in zip(i, j)]
+
+    def update(self, spectra: np.ndarray, max_workers: int = None) -> "cross_spectra":
+        """adds segments to the statistics
+
+        Args:
+            spectra (np.ndarray): (channel x segment x frequency) spectra
+            max_workers (int, optional): number of threads. Defaults to the number
+                of CPUs.
+
+        Returns:
+            cross_spectra: self
+        """
+
+        n, segments, f = spectra.shape
+        if n != len(self.channels) or f != len(self.freq):
+            raise ValueError(
+                "spectra {} do not match {} channels and {} frequencies".format(
+                    spectra.shape, len(self.channels), len(self.freq)
+                )
+            )
+
+        dtype = self._products.dtype
+        self._sum += spectra.sum(axis=1, dtype=dtype)
+
+        def block(frequencies: slice) -> None:
+            # (frequency x channel x segment) @ (frequency x segment x channel)
+            x = np.ascontiguousarray(spectra[:, :, frequencies].transpose(2, 0, 1))
+            x = x.astype(dtype, copy=False)
+            self._products[frequencies] += np.matmul(x.conj(), x.transpose(0, 2, 1))
+
+        workers = max_workers or os.cpu_count() or 1
+        bounds = np.linspace(0, f, min(workers, f) + 1, dtype=int)
+        blocks = [slice(a, b) for a, b in zip(bounds[:-1], bounds[1:])]
+        if len(blocks) == 1:
+            block(blocks[0])
+        else:
+            with ThreadPoolExecutor(workers) as executor:
+                list(executor.map(block, blocks))
+
+        self.count += segments
+        return self
+
+    def merge(self, other: "cross_spectra") -> "cross_spectra":
+        """adds the statistics of other segments of the same channels
+
+        Args:
+            other (cross_spectra): statistics of the same channels and frequencies
+
+        Raises:
+            ValueError: if the channels or frequencies do not match
+
+        Returns:
+            cross_spectra: self
+        """
+
+        if (
+            other.channels != self.channels
+            or other.phase != self.phase
+            or not np.array_equal(other.freq, self.freq)
+        ):
+            raise ValueError("Cross-spectra of different channels cannot be merged")
+
+        self._sum += other._sum
+        self._products += other._products
+        self.count += other.count
+        return self
+
+    @classmethod
+    def from_time_series(
+        cls,
+        data: np.ndarray,
+        fs: float,
+        channels: list = None,
+        nperseg: int = 1024,
+        overlap: float = 0.5,
+        chunk_size: int = 256,
+        max_workers: int = None,
+    ) -> "cross_spectra":
+        """cross-spectra of simultaneously sampled time series, see welch_segments
+
+        Args:
+            data (np.ndarray): (channel x sample) time series
+            fs (float): sampling frequency in Hz
+            channels (list, optional): channel names. Defaults to 0, 1, ...
+            nperseg (int, optional): samples per segment. Defaults to 1024.
+            overlap (float, optional): overlap of segments. Defaults to 0.5.
+            chunk_size (int, optional): number of segments transformed at once.
+                Defaults to 256.
+            max_workers (int, optional): number of threads, see update.
+
+        Raises:
+            ValueError: if there are fewer than nperseg samples
+
+        Returns:
+            cross_spectra: the statistics
+        """
+
+        data = np.atleast_2d(data)
+        if channels is None:
+            channels = list(range(data.shape[0]))
+
+        step = max(int(nperseg * (1 - overlap)), 1)
+        n_segments = (data.shape[1] - nperseg) // step + 1
+        if n_segments < 1:
+            raise ValueError("At least {} samples are needed".format(nperseg))
+
+        result = None
+        for first in range(0, n_segments, chunk_size):
+            last = min(first + chunk_size, n_segments)
+            chunk = data[:, first * step : (last - 1) * step + nperseg]
+            freq, spectra, scale = welch_segments(chunk, fs, nperseg, overlap)
+            if result is None:
+                result = cls(channels, freq, phase=True, scale=scale)
+            result.update(spectra, max_workers)
+
+        return result
+
+    @classmethod
+    def from_spectra(
+        cls,
+        spectra,
+        tolerance=None,
+        chunk_size: int = 1024,
+        max_workers: int = None,
+    ) -> "cross_spectra":
+        """cross-spectra of FFT PVs, e.g. from vib_archive.fetch_fft_spectra or an
+        fft_store. Only the times at which every channel has a spectrum are used.
+
+        Args:
+            spectra (dict or list): fft_spectra of each channel, with the same
+                frequency axis
+            tolerance (timedelta, optional): timestamps are matched after rounding
+                to a multiple of tolerance. Defaults to exact matches.
+            chunk_size (int, optional): number of spectra processed at once.
+                Defaults to 1024.
+            max_workers (int, optional): number of threads, see update.
+
+        Raises:
+            ValueError: if the frequency axes differ
+
+        Returns:
+            cross_spectra: the statistics
+        """
+
+        if isinstance(spectra, dict):
+            spectra = list(spectra.values())
+
+        freq = spectra[0].freq
+        if any(not np.array_equal(s.freq, freq) for s in spectra):
+            raise ValueError("Spectra have different frequency axes")
+
+        times = [_as_ns(s.time) for s in spectra]
+        if tolerance is not None:
+            step = pd.Timedelta(tolerance).value
+            times = [(t + step // 2) // step for t in times]
+
+        common = reduce(np.intersect1d, times)
+        rows = [_index_of(t, common) for t in times]
+
+        result = cls([s.pv for s in spectra], freq)
+        for start in range(0, len(common), chunk_size):
+            chunk = [
+                np.asarray(s.values[r[start : start + chunk_size]])
+                for s, r in zip(spectra, rows)
+            ]
+            result.update(np.stack(chunk), max_workers)
+
+        return result
+
+    def _estimates(self):
+        # auto-spectra of the inputs and outputs and cross-spectra of each pair,
+        # (pair x frequency)
+        i, j = np.triu_indices(len(self.channels), 1)
+        g = self._products / max(self.count, 1)
+        return i, j, g[:, i, i].real.T, g[:, j, j].real.T, g[:, i, j].T
+
+    def auto_spectra(self) -> np.ndarray:
+        """(channel x frequency) auto-spectrum of each channel, e.g. power spectral
+        density for time series"""
+        n = np.arange(len(self.channels))
+        return self.scale * (self._products[:, n, n].real / max(self.count, 1)).T
+
+    def cross_spectra(self) -> np.ndarray:
+        """(pair x frequency) cross-spectrum of each pair, see pairs"""
+        return self.scale * self._estimates()[4]
+
+    def coherence(self) -> np.ndarray:
+        """(pair x frequency) coherence of each pair, between 0 and 1"""
+
+        i, j, gxx, gyy, gxy = self._estimates()
+        if not self.phase:
+            # correlation of the amplitudes
+            mean = self._sum / max(self.count, 1)
+            gxy = gxy - mean[i] * mean[j]
+            gxx = gxx - mean[i] ** 2
+            gyy = gyy - mean[j] ** 2
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.abs(gxy) ** 2 / (gxx * gyy)
+
+    def transfer_function(self) -> np.ndarray:
+        """(pair x frequency) H1 transfer function from the input to the output of
+        each pair, complex spectra only
+
+        Raises:
+            ValueError: if the spectra have no phase
+        """
+
+        if not self.phase:
+            raise ValueError("The transfer function needs complex spectra")
+
+        i, j, gxx, gyy, gxy = self._estimates()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return gxy / gxx
+
+    def transmissibility(self) -> np.ndarray:
+        """(pair x frequency) ratio of the output to the input amplitude of each
+        pair: |H1| for complex spectra, the ratio of RMS amplitudes otherwise"""
+
+        if self.phase:
+            return np.abs(self.transfer_function())
+
+        i, j, gxx, gyy, gxy = self._estimates()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.sqrt(gyy / gxx)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """coherence and transmissibility of every pair as a tidy dataframe
+
+        Returns:
+            pd.DataFrame: one row per pair and frequency, with Input, Output,
+                Frequency, Coherence, Transmissibility and Phase (degrees, NaN
+                without phase) columns
+        """
+
+        pairs = self.pairs
+        n = len(self.freq)
+        phase = np.full((len(pairs), n), np.nan)
+        if self.phase:
+            phase = np.degrees(np.angle(self.transfer_function()))
+
+        return pd.DataFrame(
+            {
+                "Input": pd.Categorical(
+                    np.repeat([p[0] for p in pairs], n), categories=self.channels
+                ),
+                "Output": pd.Categorical(
+                    np.repeat([p[1] for p in pairs], n), categories=self.channels
+                ),
+                "Frequency": np.tile(self.freq, len(pairs)),
+                "Coherence": self.coherence().ravel(),
+                "Transmissibility": self.transmissibility().ravel(),
+                "Phase": phase.ravel(),
+            }
+        )
+
+
+def _index_of(values: np.ndarray, keys: np.ndarray) -> np.ndarray:
+    # position of each key in values, which are usually already sorted
+    if np.all(values[1:] >= values[:-1]):
+        return np.searchsorted(values, keys)
+    order = np.argsort(values, kind="stable")
+    return order[np.searchsorted(values, keys, sorter=order)]
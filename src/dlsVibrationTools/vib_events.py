@@ -0,0 +1,415 @@
+import numpy as np
+import pandas as pd
+
+from dlsVibrationTools.vib_alarms import _as_ns
+from dlsVibrationTools.vib_spectra import fft_spectra
+
+__all__ = ["EVENT_COLUMNS", "spectral_event_detector", "get_spectral_events"]
+
+EVENT_COLUMNS = [
+    "PV",
+    "Start",
+    "End",
+    "Duration",
+    "Low_Freq",
+    "High_Freq",
+    "Peak_Freq",
+    "Peak",
+    "Energy",
+    "Cells",
+]
+
+# MAD and mean absolute deviation to standard deviation, for normal data
+_MAD_TO_STD = 1.4826
+_MEAN_DEV_TO_STD = 1.2533
+# floor of the baseline spread in decades, so that constant bins do not alarm
+_MIN_SCALE = 1e-3
+
+
+class _ewma_baseline:
+    # exponentially weighted mean and mean absolute deviation of each bin
+
+    def __init__(self, n_freq: int, alpha: float) -> None:
+        self.alpha = alpha
+        self.count = 0
+        self.center = np.zeros(n_freq)
+        self.scale = np.zeros(n_freq)
+
+    def learn(self, block: np.ndarray, flagged: np.ndarray = None) -> None:
+        if self.count == 0:
+            # robust start, before the running mean takes over
+            self.center = np.median(block, axis=0)
+            self.scale = _MAD_TO_STD * np.median(np.abs(block - self.center), axis=0)
+
+        # a cumulative mean until 1 / alpha rows have been seen, so the baseline
+        # settles quickly
+        n = self.count + np.arange(1, len(block) + 1)
+        a = np.maximum(self.alpha, 1 / n)
+        # weight of each row after the whole block, and of the previous state
+        keep = np.cumprod((1 - a)[::-1])[::-1]
+        weights = a * np.append(keep[1:], 1.0)
+        previous = keep[0]
+
+        deviation = np.abs(block - self.center)
+        if flagged is not None:
+            # flagged cells leave the baseline as it is
+            block = np.where(flagged, self.center, block)
+            deviation = np.where(flagged, self.scale / _MEAN_DEV_TO_STD, deviation)
+        self.center = previous * self.center + weights @ block
+        self.scale = previous * self.scale + _MEAN_DEV_TO_STD * (weights @ deviation)
+        self.count += len(block)
+
+
+class _median_baseline:
+    # median and MAD of each bin over the last window rows, in a ring buffer. They
+    # are recomputed every window / 10 rows, each a partition of the whole window
+
+    def __init__(self, n_freq: int, window: int) -> None:
+        self.count = 0
+        self._stale = 0
+        # (frequency x time), so each bin is contiguous
+        self.ring = np.empty((n_freq, window), dtype=np.float32)
+        self.center = np.zeros(n_freq)
+        self.scale = np.zeros(n_freq)
+
+    def learn(self, block: np.ndarray, flagged: np.ndarray = None) -> None:
+        if flagged is not None:
+            block = np.where(flagged, self.center, block)
+        window = self.ring.shape[1]
+        block = block[-window:]
+        self.ring[:, (self.count + np.arange(len(block))) % window] = block.T
+        self.count += len(block)
+        self._stale += len(block)
+
+        if self._stale * 10 >= window or self.count <= window // 10:
+            self._stale = 0
+            history = self.ring[:, : min(self.count, window)]
+            self.center = _middle(history).astype(np.float64)
+            self.scale = _MAD_TO_STD * _middle(np.abs(history - self.center[:, None]))
+
+
+def _middle(values: np.ndarray) -> np.ndarray:
+    # median along the last axis, the upper one for an even length
+    k = values.shape[-1] // 2
+    return np.partition(values, k, axis=-1)[..., k]
+
+
+class spectral_event_detector:
+    """Streaming detection of transient events (pumps starting, cranes, traffic)
+    in the spectrograms of FFT PVs.
+
+    Each channel keeps a baseline of every frequency bin, either an exponentially
+    weighted mean and deviation ("ewma") or the median and MAD of a window of
+    recent spectra ("median"), on log amplitudes. Cells of the spectrogram more
+    than threshold standard deviations above the baseline are flagged, and
+    flagged cells that touch in time and frequency (within time_gap spectra and
+    freq_gap bins) are grouped into events. Flagged cells do not update the
+    baseline, so a long event does not become the baseline.
+
+    Spectra are processed in blocks of block_size rows: a block is compared with
+    the baseline learnt up to its start, then learnt, so each block is a few
+    vectorised operations over all its cells. Memory per channel is constant:
+    the baseline (plus the window for "median") and the open events.
+
+    Example:
+
+        detector = spectral_event_detector()
+        for chunk in archive.iter_fft_spectra(start, end, channels):
+            events = detector.update(chunk)
+        events = detector.flush()
+    """
+
+    def __init__(
+        self,
+        threshold: float = 5.0,
+        baseline: str = "ewma",
+        alpha: float = 0.01,
+        window: int = 600,
+        warmup: int = 60,
+        block_size: int = 16,
+        time_gap: int = 1,
+        freq_gap: int = 1,
+        min_cells: int = 3,
+    ) -> None:
+        """
+        Args:
+            threshold (float, optional): number of standard deviations above the
+                baseline of a flagged cell. Defaults to 5.
+            baseline (str, optional): "ewma" or "median". Defaults to "ewma".
+            alpha (float, optional): weight of each new spectrum in the "ewma"
+                baseline. Defaults to 0.01.
+            window (int, optional): number of spectra in the "median" baseline.
+                Defaults to 600.
+            warmup (int, optional): number of spectra learnt before cells are
+                flagged. Defaults to 60.
+            block_size (int, optional): number of spectra processed at once.
+                Defaults to 16.
+            time_gap (int, optional): spectra without flagged cells that still
+                join two parts of an event. Defaults to 1.
+            freq_gap (int, optional): bins without flagged cells that still join
+                two parts of an event. Defaults to 1.
+            min_cells (int, optional): smaller events are ignored. Defaults to 3.
+
+        Raises:
+            ValueError: if baseline is unknown
+        """
+
+        if baseline not in ("ewma", "median"):
+            raise ValueError("Unknown baseline {}".format(baseline))
+
+        self.threshold = threshold
+        self.baseline = baseline
+        self.alpha = alpha
+        self.window = window
+        self.warmup = warmup
+        self.block_size = block_size
+        self.time_gap = time_gap
+        self.freq_gap = freq_gap
+        self.min_cells = min_cells
+
+        # per PV: baseline, frequency axis, number of spectra processed, time
+        # (ns) of the last one, and (log values, flagged) of the spectra of the
+        # current block, not learnt yet
+        self._baselines = {}
+        self._freq = {}
+        self._rows = {}
+        self._last_time = {}
+        self._pending = {}
+        # per PV: open events, each [first row, last row, start (ns), end (ns),
+        # low bin, high bin, peak, peak bin, energy, cells]
+        self._open = {}
+
+    def __repr__(self) -> str:
+        return "spectral_event_detector({} channels, {} open events)".format(
+            len(self._baselines), sum(len(e) for e in self._open.values())
+        )
+
+    @property
+    def open_events(self) -> dict:
+        """number of events still open for each PV"""
+        return {pv: len(events) for pv, events in self._open.items() if events}
+
+    def baseline_of(self, pv: str) -> np.ndarray:
+        """current baseline amplitude spectrum of a PV
+
+        Args:
+            pv (str): PV full name
+
+        Returns:
+            np.ndarray: amplitude of each frequency bin
+        """
+        return 10 ** self._baselines[pv].center
+
+    def update(self, spectra) -> pd.DataFrame:
+        """processes new spectra of one or more PVs. Spectra that are not newer
+        than the last one already processed for the same PV are ignored.
+
+        Args:
+            spectra (fft_spectra or dict): spectra of one PV, or fft_spectra for
+                each PV full name, e.g. a chunk of iter_fft_spectra
+
+        Raises:
+            ValueError: if the frequency axis of a PV changes
+
+        Returns:
+            pd.DataFrame: events that ended, see get_spectral_events
+        """
+
+        if isinstance(spectra, fft_spectra):
+            spectra = {spectra.pv: spectra}
+
+        events = []
+        for pv, s in spectra.items():
+            events += self._update(pv, s)
+
+        return self._events_dataframe(events)
+
+    def flush(self) -> pd.DataFrame:
+        """closes all the open events, e.g. at the end of the data
+
+        Returns:
+            pd.DataFrame: the events that were open, see update
+        """
+
+        events = []
+        for pv, open_events in self._open.items():
+            events += [(pv, e) for e in open_events if e[9] >= self.min_cells]
+        self._open = {}
+
+        return self._events_dataframe(events)
+
+    def _update(self, pv: str, spectra: fft_spectra) -> list:
+        time = _as_ns(spectra.time)
+        new = time > self._last_time.get(pv, np.iinfo(np.int64).min)
+        if not new.any():
+            return []
+        # times only go forward
+        new &= time > np.maximum.accumulate(np.r_[time[:1] - 1, time[:-1]])
+
+        if pv not in self._baselines:
+            n = len(spectra.freq)
+            self._baselines[pv] = (
+                _ewma_baseline(n, self.alpha)
+                if self.baseline == "ewma"
+                else _median_baseline(n, self.window)
+            )
+            self._freq[pv] = spectra.freq
+            self._rows[pv] = 0
+            self._pending[pv] = []
+            self._open[pv] = []
+        elif not np.array_equal(self._freq[pv], spectra.freq):
+            raise ValueError("Frequency axis of {} changed".format(pv))
+
+        # blocks start every block_size spectra of the PV, however the spectra
+        # are split in chunks
+        rows = np.flatnonzero(new)
+        first = (-self._rows[pv]) % self.block_size
+        events = []
+        starts = [0] + list(range(first or self.block_size, len(rows), self.block_size))
+        for a, b in zip(starts, starts[1:] + [len(rows)]):
+            block = rows[a:b]
+            values = np.asarray(spectra.values[block], dtype=np.float64)
+            events += self._block(pv, time[block], values)
+
+        self._last_time[pv] = time[rows[-1]]
+        return events
+
+    def _block(self, pv: str, time: np.ndarray, values: np.ndarray) -> list:
+        # (part of) a block, learnt once the block is complete
+        baseline = self._baselines[pv]
+        log_values = np.log10(np.maximum(values, np.finfo(np.float32).tiny))
+
+        events = []
+        flagged = None
+        if baseline.count >= self.warmup:
+            scale = np.maximum(baseline.scale, _MIN_SCALE)
+            flagged = log_values > baseline.center + self.threshold * scale
+            events = self._group(pv, time, values, flagged)
+
+        self._pending[pv].append((log_values, flagged))
+        self._rows[pv] += len(time)
+        if self._rows[pv] % self.block_size == 0:
+            log_values, flagged = zip(*self._pending.pop(pv))
+            flagged = None if flagged[0] is None else np.concatenate(flagged)
+            baseline.learn(np.concatenate(log_values), flagged)
+            self._pending[pv] = []
+
+        return events
+
+    def _group(self, pv, time, values, flagged) -> list:
+        # runs of flagged bins in each row, bins up to freq_gap apart are one run
+        row, freq_bin = np.nonzero(flagged)
+        open_events = self._open[pv]
+        first_row = self._rows[pv]
+
+        if len(row):
+            center = 10 ** self._baselines[pv].center
+            excess = values[row, freq_bin] ** 2 - center[freq_bin] ** 2
+            peak = values[row, freq_bin]
+
+            new_run = np.ones(len(row), dtype=bool)
+            new_run[1:] = (row[1:] != row[:-1]) | (
+                freq_bin[1:] - freq_bin[:-1] > self.freq_gap + 1
+            )
+            starts = np.flatnonzero(new_run)
+            ends = np.append(starts[1:], len(row)) - 1
+            energy = np.add.reduceat(excess, starts)
+            cells = np.diff(np.append(starts, len(row)))
+            peak_at = starts + np.array(
+                [np.argmax(peak[a : b + 1]) for a, b in zip(starts, ends)], dtype=int
+            )
+
+            for a, b, e, n, p in zip(starts, ends, energy, cells, peak_at):
+                r = first_row + row[a]
+                run = [
+                    r,
+                    r,
+                    time[row[a]],
+                    time[row[a]],
+                    freq_bin[a],
+                    freq_bin[b],
+                    peak[p],
+                    freq_bin[p],
+                    e,
+                    n,
+                ]
+                self._join(open_events, run)
+
+        # events that can no longer grow
+        current = first_row + len(time) - 1
+        done = [e for e in open_events if e[1] < current - self.time_gap]
+        self._open[pv] = [e for e in open_events if e[1] >= current - self.time_gap]
+
+        return [(pv, e) for e in done if e[9] >= self.min_cells]
+
+    def _join(self, open_events: list, run: list) -> None:
+        # merges a run with the open events it touches
+        touching = [
+            e
+            for e in open_events
+            if e[1] >= run[0] - self.time_gap - 1
+            and e[4] <= run[5] + self.freq_gap + 1
+            and e[5] >= run[4] - self.freq_gap - 1
+        ]
+        for e in touching:
+            open_events.remove(e)
+            run[0], run[2] = min(run[0], e[0]), min(run[2], e[2])
+            run[1], run[3] = max(run[1], e[1]), max(run[3], e[3])
+            run[4], run[5] = min(run[4], e[4]), max(run[5], e[5])
+            if e[6] > run[6]:
+                run[6], run[7] = e[6], e[7]
+            run[8] += e[8]
+            run[9] += e[9]
+        open_events.append(run)
+
+    def _events_dataframe(self, events: list) -> pd.DataFrame:
+        pvs = [pv for pv, _ in events]
+        # times (ns) stay int64, float64 would round them to 256 ns
+        t = np.array([event[2:4] for _, event in events], dtype=np.int64)
+        t = t.reshape(-1, 2)
+        e = np.array([event[4:] for _, event in events], dtype=np.float64)
+        e = e.reshape(-1, 6)
+        freq = [self._freq[pv] for pv in pvs]
+
+        start = pd.to_datetime(t[:, 0], utc=True)
+        end = pd.to_datetime(t[:, 1], utc=True)
+        df = pd.DataFrame(
+            {
+                "PV": pvs,
+                "Start": start,
+                "End": end,
+                "Duration": end - start,
+                "Low_Freq": [f[int(i)] for f, i in zip(freq, e[:, 0])],
+                "High_Freq": [f[int(i)] for f, i in zip(freq, e[:, 1])],
+                "Peak_Freq": [f[int(i)] for f, i in zip(freq, e[:, 3])],
+                "Peak": e[:, 2],
+                "Energy": e[:, 4],
+                "Cells": e[:, 5].astype(np.int64),
+            },
+            columns=EVENT_COLUMNS,
+        )
+
+        return df.sort_values(["Start", "PV"], kind="stable", ignore_index=True)
+
+
+def get_spectral_events(spectra, **kwargs) -> pd.DataFrame:
+    """finds transient events in spectrograms, see spectral_event_detector
+
+    Args:
+        spectra (fft_spectra or dict): spectra of one PV, or fft_spectra for each
+            PV full name, e.g. from fetch_fft_spectra
+        **kwargs: see spectral_event_detector
+
+    Returns:
+        pd.DataFrame: one row per event with its PV, Start and End times (of the
+            first and last spectrum), Duration, Low_Freq and High_Freq of its band,
+            Peak amplitude and its Peak_Freq, Energy above the baseline (sum of
+            the squared amplitude minus the squared baseline of each cell) and
+            number of Cells, sorted by Start
+    """
+
+    detector = spectral_event_detector(**kwargs)
+    events = detector.update(spectra)
+    return pd.concat([events, detector.flush()], ignore_index=True).sort_values(
+        ["Start", "PV"], kind="stable", ignore_index=True
+    )
@@ -0,0 +1,241 @@
+import numpy as np
+import pandas as pd
+
+from dlsVibrationTools.vib_spectra import fft_spectra
+
+__all__ = ["lod_series", "lod_spectrogram"]
+
+
+def _bucket_starts(time: np.ndarray, start: int, end: int, n: int):
+    # first sample of each of n equal-width time buckets between start and end,
+    # for the non-empty buckets only
+    edges = np.linspace(start, end, n + 1)
+    idx = np.searchsorted(time, edges)
+    keep = np.diff(idx) > 0
+    return idx[:-1][keep], idx[0], idx[-1], ((edges[:-1] + edges[1:]) / 2)[keep]
+
+
+def _as_ns(time) -> np.ndarray:
+    return pd.DatetimeIndex(time).as_unit("ns").asi8
+
+
+def _sampling_period(time_ns: np.ndarray) -> int:
+    # median time between samples in ns, the width of the finest level buckets
+    steps = np.diff(time_ns)
+    steps = steps[steps > 0]
+    return max(int(np.median(steps)), 1) if len(steps) else 1
+
+
+def _level_starts(time_ns: np.ndarray, width: int) -> np.ndarray:
+    # first sample of each bucket of width ns, aligned to the first sample. A
+    # bucket never spans more than its width, so samples after a gap are not
+    # merged with the ones before it
+    bucket = (time_ns - time_ns[0]) // width
+    return np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+
+
+class lod_series:
+    """Multi-resolution (level-of-detail) pyramid of a time series.
+
+    Each level holds the min, max, sum and count of the samples in time buckets,
+    every level `factor` times wider than the previous one (the finest being the
+    median sampling period). A view of any time range at screen resolution is
+    re-binned from the coarsest level that still has enough buckets in that range,
+    so the cost of a view does not depend on the length of the range.
+    """
+
+    def __init__(self, time, values, factor: int = 4, min_buckets: int = 256):
+        """
+        Args:
+            time (array-like): sorted timestamps of the samples
+            values (array-like): sample values, NaN for missing samples
+            factor (int, optional): ratio of the bucket widths of consecutive
+                levels. Defaults to 4.
+            min_buckets (int, optional): coarsest level size. Defaults to 256.
+        """
+
+        values = np.asarray(values, dtype=np.float64)
+        valid = ~np.isnan(values)
+
+        self.factor = factor
+        self.levels = [
+            (
+                _as_ns(time),
+                values,
+                values,
+                np.where(valid, values, 0.0),
+                valid.astype(np.int64),
+            )
+        ]
+
+        width = _sampling_period(self.levels[0][0])
+        while len(self.levels[-1][0]) > min_buckets * factor:
+            time_ns, vmin, vmax, vsum, count = self.levels[-1]
+            width *= factor
+            starts = _level_starts(time_ns, width)
+            self.levels.append(
+                (
+                    time_ns[starts],
+                    np.fmin.reduceat(vmin, starts),
+                    np.fmax.reduceat(vmax, starts),
+                    np.add.reduceat(vsum, starts),
+                    np.add.reduceat(count, starts),
+                )
+            )
+
+    def __len__(self) -> int:
+        return len(self.levels[0][0])
+
+    @property
+    def time_range(self) -> tuple:
+        """first and last timestamps of the series"""
+        time_ns = self.levels[0][0]
+        return tuple(pd.to_datetime(time_ns[[0, -1]], utc=True))
+
+    def view(self, start=None, end=None, n: int = 1000):
+        """min, max and mean of the series in n equal-width time buckets
+
+        Args:
+            start (datetime, optional): start of the view. Defaults to the first
+                sample.
+            end (datetime, optional): end of the view. Defaults to the last sample.
+            n (int, optional): number of buckets, usually the plot width in
+                pixels. Defaults to 1000.
+
+        Returns:
+            tuple: centre time (datetime64[ns], UTC), min, max and mean of the
+                non-empty buckets
+        """
+
+        if not len(self):
+            return (np.zeros(0, dtype="datetime64[ns]"),) + (np.zeros(0),) * 3
+
+        time_ns = self.levels[0][0]
+        start = time_ns[0] if start is None else pd.Timestamp(start).value
+        end = time_ns[-1] + 1 if end is None else pd.Timestamp(end).value
+
+        # coarsest level with at least 2 buckets per pixel, or the raw samples
+        for time_ns, vmin, vmax, vsum, count in reversed(self.levels):
+            first, last = np.searchsorted(time_ns, [start, end])
+            if last - first >= 2 * n:
+                break
+
+        starts, first, last, centre = _bucket_starts(time_ns, start, end, n)
+        starts = starts - first
+        s = slice(first, last)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.add.reduceat(vsum[s], starts) / np.add.reduceat(count[s], starts)
+
+        return (
+            centre.astype(np.int64).view("datetime64[ns]"),
+            np.fmin.reduceat(vmin[s], starts),
+            np.fmax.reduceat(vmax[s], starts),
+            mean,
+        )
+
+
+class lod_spectrogram:
+    """Multi-resolution (level-of-detail) pyramid of FFT spectra.
+
+    Each level holds the sum of the spectra of the previous level in time buckets
+    `factor` times wider, so that any time range can be averaged down to screen
+    resolution from the coarsest level that still has enough rows in that range.
+    Frequencies are binned to screen resolution when the view is taken.
+    """
+
+    def __init__(
+        self, spectra: fft_spectra, factor: int = 4, min_buckets: int = 256
+    ) -> None:
+        """
+        Args:
+            spectra (fft_spectra): spectra of a single FFT PV. The finest level is
+                a view on its matrix.
+            factor (int, optional): ratio of the bucket widths of consecutive
+                levels. Defaults to 4.
+            min_buckets (int, optional): coarsest level size. Defaults to 256.
+        """
+
+        self.freq = spectra.freq
+        self.pv = spectra.pv
+        self.levels = [
+            (spectra.time.as_unit("ns").asi8, spectra.values, np.ones(len(spectra)))
+        ]
+
+        width = _sampling_period(self.levels[0][0])
+        while len(self.levels[-1][0]) > min_buckets * factor:
+            time_ns, vsum, count = self.levels[-1]
+            width *= factor
+            starts = _level_starts(time_ns, width)
+            self.levels.append(
+                (
+                    time_ns[starts],
+                    np.add.reduceat(vsum, starts, axis=0, dtype=np.float32),
+                    np.add.reduceat(count, starts),
+                )
+            )
+
+    def __len__(self) -> int:
+        return len(self.levels[0][0])
+
+    def view(
+        self,
+        time_range: tuple = None,
+        freq_range: tuple = None,
+        width: int = 1000,
+        height: int = 500,
+    ) -> fft_spectra:
+        """average spectra binned to at most width x height
+
+        Args:
+            time_range (tuple, optional): (start, end) datetimes, end excluded.
+                Defaults to all spectra.
+            freq_range (tuple, optional): (fmin, fmax) in Hz, fmax excluded.
+                Defaults to all frequencies.
+            width (int, optional): number of time bins. Defaults to 1000.
+            height (int, optional): number of frequency bins. Defaults to 500.
+
+        Returns:
+            fft_spectra: the binned spectra, timestamped at the centre of each bin
+                and with the mean frequency of each bin
+        """
+
+        time_ns = self.levels[0][0]
+        if time_range is None:
+            start, end = (time_ns[0], time_ns[-1] + 1) if len(self) else (0, 1)
+        else:
+            start, end = (pd.Timestamp(t).value for t in time_range)
+
+        f = slice(None)
+        if freq_range is not None:
+            f = slice(*np.searchsorted(self.freq, freq_range))
+        freq = self.freq[f]
+
+        for time_ns, vsum, count in reversed(self.levels):
+            first, last = np.searchsorted(time_ns, [start, end])
+            if last - first >= 2 * width:
+                break
+
+        starts, first, last, centre = _bucket_starts(time_ns, start, end, width)
+        starts = starts - first
+        s = slice(first, last)
+
+        if len(starts):
+            values = np.add.reduceat(vsum[s, f], starts, axis=0, dtype=np.float32)
+            values /= np.add.reduceat(count[s], starts)[:, None]
+        else:
+            values = np.zeros((0, len(freq)), dtype=np.float32)
+
+        if len(freq) > height:
+            bins = np.linspace(0, len(freq), height + 1).astype(np.int64)[:-1]
+            values = np.add.reduceat(values, bins, axis=1) / np.diff(
+                np.append(bins, len(freq))
+            )
+            freq = np.add.reduceat(freq, bins) / np.diff(np.append(bins, len(freq)))
+
+        return fft_spectra(
+            pd.DatetimeIndex(centre.astype(np.int64).view("datetime64[ns]"), tz="UTC"),
+            values,
+            freq=freq,
+            pv=self.pv,
+        )
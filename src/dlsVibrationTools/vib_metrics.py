@@ -0,0 +1,347 @@
+import functools
+import json
+import logging
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+__all__ = [
+    "METRICS_LOGGER",
+    "REGISTRY",
+    "stage",
+    "timed_stage",
+    "metrics_enabled",
+    "enable_metrics",
+    "collect_metrics",
+    "log_records",
+    "metrics_registry",
+    "metrics_handler",
+    "json_formatter",
+]
+
+# stage records are logged to this logger, see logging.conf.yml
+METRICS_LOGGER = "dlsVibrationTools.metrics"
+
+logger = logging.getLogger(METRICS_LOGGER)
+
+# stages running in any thread, for the peak memory of each of them
+_active = []
+_active_lock = threading.Lock()
+
+
+def metrics_enabled() -> bool:
+    """whether stages are recorded, i.e. the metrics logger is enabled for INFO"""
+    return logger.isEnabledFor(logging.INFO)
+
+
+def _fold_peak() -> None:
+    # tracemalloc has a single peak, which is reset when a stage starts: keep the
+    # peak seen so far by every running stage before it is lost
+    peak = tracemalloc.get_traced_memory()[1]
+    for record in _active:
+        record["_peak"] = max(record["_peak"], peak)
+
+
+@contextmanager
+def stage(name: str, **labels):
+    """records the wall time of a stage of the fetch -> transform -> plot pipeline,
+    and the peak memory allocated while it ran if tracemalloc is tracing. The body
+    can add row and byte counts to the yielded record, e.g.
+
+        with stage("archiver.request", pv=pv) as record:
+            ...
+            record["bytes"] = len(response.content)
+
+    The record is logged to the metrics logger when the stage ends, also if it
+    raised. Nothing is measured if the logger is disabled.
+
+    Args:
+        name (str): stage name
+        **labels: labels of the stage, e.g. pv
+
+    Yields:
+        dict: the record of the stage
+    """
+
+    record = {"stage": name, **labels}
+    if not metrics_enabled():
+        yield record
+        return
+
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        with _active_lock:
+            _fold_peak()
+            tracemalloc.reset_peak()
+            current = tracemalloc.get_traced_memory()[0]
+            record["_peak"] = current
+            _active.append(record)
+
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["seconds"] = time.perf_counter() - start
+        if tracing:
+            with _active_lock:
+                _fold_peak()
+                _active.remove(record)
+            record["peak_memory"] = record.pop("_peak") - current
+        logger.info("%s", name, extra={"metrics": record})
+
+
+def timed_stage(name: str):
+    """decorator recording every call of a function as a stage, see stage. If the
+    first argument has a length, it is recorded as the number of rows.
+
+    Args:
+        name (str): stage name
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage(name) as record:
+                if args and hasattr(args[0], "__len__"):
+                    record["rows"] = len(args[0])
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+class metrics_registry:
+    """Totals of the stage records, by stage and labels, exportable as JSON or in
+    the Prometheus text exposition format.
+    """
+
+    fields = ("rows", "bytes")
+
+    def __init__(self) -> None:
+        self._totals = {}
+        self._lock = threading.Lock()
+
+    def add(self, record: dict) -> None:
+        """adds a stage record to the totals"""
+
+        labels = tuple((k, str(record[k])) for k in _labels(record))
+        with self._lock:
+            totals = self._totals.setdefault(
+                (record["stage"], labels),
+                {"calls": 0, "seconds": 0.0, "max_seconds": 0.0},
+            )
+            totals["calls"] += 1
+            totals["seconds"] += record.get("seconds", 0.0)
+            totals["max_seconds"] = max(totals["max_seconds"], record.get("seconds", 0))
+            for field in self.fields:
+                if field in record:
+                    totals[field] = totals.get(field, 0) + record[field]
+            if "peak_memory" in record:
+                totals["peak_memory"] = max(
+                    totals.get("peak_memory", 0), record["peak_memory"]
+                )
+
+    def reset(self) -> None:
+        """forgets every record"""
+        with self._lock:
+            self._totals.clear()
+
+    def to_list(self) -> list:
+        """totals of each stage and labels, as a list of dicts"""
+        with self._lock:
+            return [
+                {"stage": name, **dict(labels), **totals}
+                for (name, labels), totals in sorted(self._totals.items())
+            ]
+
+    def to_json(self) -> str:
+        """totals of each stage and labels, as JSON"""
+        return json.dumps(self.to_list(), indent=1)
+
+    def to_prometheus(self, prefix: str = "dls_vibration_stage") -> str:
+        """totals of each stage and labels, in the Prometheus text format
+
+        Args:
+            prefix (str, optional): prefix of the metric names. Defaults to
+                "dls_vibration_stage".
+
+        Returns:
+            str: the metrics
+        """
+
+        metrics = (
+            ("calls", "counter", "Number of times the stage ran"),
+            ("seconds", "counter", "Wall time spent in the stage"),
+            ("max_seconds", "gauge", "Longest run of the stage"),
+            ("rows", "counter", "Rows processed by the stage"),
+            ("bytes", "counter", "Bytes transferred or built by the stage"),
+            ("peak_memory", "gauge", "Peak memory allocated by the stage in bytes"),
+        )
+
+        totals = self.to_list()
+        lines = []
+        for field, kind, description in metrics:
+            samples = [t for t in totals if field in t]
+            if not samples:
+                continue
+            metric = "{}_{}{}".format(
+                prefix, field, "_total" if kind == "counter" else ""
+            )
+            lines.append("# HELP {} {}".format(metric, description))
+            lines.append("# TYPE {} {}".format(metric, kind))
+            for t in samples:
+                labels = ",".join(
+                    '{}="{}"'.format(k, _escape(t[k])) for k in ["stage"] + _labels(t)
+                )
+                lines.append("{}{{{}}} {}".format(metric, labels, t[field]))
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, filename: str) -> None:
+        """writes the totals to a file, in the Prometheus text format if its name
+        ends with .prom and as JSON otherwise
+
+        Args:
+            filename (str): path of the file
+        """
+
+        with open(filename, "w") as f:
+            f.write(
+                self.to_prometheus() if filename.endswith(".prom") else self.to_json()
+            )
+
+
+_fields = {"stage", "seconds", "max_seconds", "calls", "rows", "bytes", "peak_memory"}
+
+
+def _labels(record: dict) -> list:
+    return sorted(k for k in record if k not in _fields and not k.startswith("_"))
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# totals of the records logged in this process, see metrics_handler
+REGISTRY = metrics_registry()
+
+
+class metrics_handler(logging.Handler):
+    """Logging handler adding the stage records to a metrics_registry, e.g. in
+    logging.conf.yml:
+
+        handlers:
+          metrics:
+            (): dlsVibrationTools.vib_metrics.metrics_handler
+            trace_memory: true
+    """
+
+    def __init__(
+        self,
+        level=logging.NOTSET,
+        trace_memory: bool = False,
+        registry: metrics_registry = None,
+    ) -> None:
+        """
+        Args:
+            level (optional): handler level. Defaults to logging.NOTSET.
+            trace_memory (bool, optional): start tracemalloc, to record the peak
+                memory of each stage. This slows every allocation down. Defaults to
+                False.
+            registry (metrics_registry, optional): where records are added.
+                Defaults to REGISTRY.
+        """
+
+        super().__init__(level)
+        self.registry = REGISTRY if registry is None else registry
+        if trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if hasattr(record, "metrics"):
+            self.registry.add(record.metrics)
+
+
+class json_formatter(logging.Formatter):
+    """Formats stage records as one JSON object per line"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps(
+            {"time": record.created, **getattr(record, "metrics", {})}, default=str
+        )
+
+
+def enable_metrics(trace_memory: bool = False) -> None:
+    """enables the metrics logger and adds a metrics_handler to it, unless
+    logging.conf.yml already did
+
+    Args:
+        trace_memory (bool, optional): see metrics_handler. Defaults to False.
+    """
+
+    if logger.level == logging.NOTSET or logger.level > logging.INFO:
+        logger.setLevel(logging.INFO)
+    if not any(isinstance(h, metrics_handler) for h in logger.handlers):
+        logger.addHandler(metrics_handler(trace_memory=trace_memory))
+    elif trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+class _list_handler(logging.Handler):
+    def __init__(self) -> None:
+        super().__init__()
+        self.records = []
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if hasattr(record, "metrics"):
+            self.records.append(record.metrics)
+
+
+@contextmanager
+def collect_metrics(enabled: bool = True, trace_memory: bool = False):
+    """collects the stage records logged inside the block, e.g. in a worker
+    process, so that they can be sent back to the parent (see log_records)
+
+    Args:
+        enabled (bool, optional): if False, nothing is collected. Defaults to True.
+        trace_memory (bool, optional): trace memory inside the block. Defaults to
+            False.
+
+    Yields:
+        list: the stage records, filled when the block exits
+    """
+
+    if not enabled:
+        yield []
+        return
+
+    handler = _list_handler()
+    level, propagate = logger.level, logger.propagate
+    started = trace_memory and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    try:
+        yield handler.records
+    finally:
+        logger.removeHandler(handler)
+        logger.setLevel(level)
+        logger.propagate = propagate
+        if started:
+            tracemalloc.stop()
+
+
+def log_records(records: list) -> None:
+    """logs stage records collected elsewhere (see collect_metrics) to the metrics
+    logger
+
+    Args:
+        records (list): stage records
+    """
+
+    for record in records:
+        logger.info("%s", record["stage"], extra={"metrics": record})
@@ -1,9 +1,13 @@
 import numpy as np
 import pandas as pd
-import seaborn as sns
+from matplotlib import dates as mdates
 from matplotlib import pyplot as plt
 
 from dlsVibrationTools.vc_curves import VC_LABELS, VC_UPPER_LIMIT
+from dlsVibrationTools.vib_lod import lod_series, lod_spectrogram
+from dlsVibrationTools.vib_metrics import timed_stage
+from dlsVibrationTools.vib_spectra import fft_spectra
+from dlsVibrationTools.vib_stats import spectral_stats, vc_stats
 
 # if this line isn't here, seaborn explodes. Not sure why. Worked it out from:
 # https://medium.com/@darektidwell1980/typeerror-float-argument-must-be-a-string-
@@ -14,13 +18,46 @@ pd.plotting.register_matplotlib_converters()
 # TODO: turn this into a library so it can store the dataframes etc
 
 
-def plot_vc_timeseries(data: pd.DataFrame, vc_gridlines: list = [3, 10]) -> None:
+def _rebin_on_zoom(ax, redraw) -> None:
+    """calls redraw(start, end, width) now and whenever the x axis is zoomed or
+    panned, so that plots only ever hold about one point per pixel"""
+
+    busy = []
+    ax.get_xlim()  # settles any pending autoscaling before connecting
+
+    def on_xlim_changed(ax):
+        # redrawing may autoscale and change the limits again
+        if busy:
+            return
+        busy.append(True)
+        try:
+            start, end = mdates.num2date(ax.get_xlim())
+            redraw(start, end, max(int(ax.bbox.width), 1))
+        finally:
+            busy.pop()
+
+    ax.callbacks.connect("xlim_changed", on_xlim_changed)
+
+
+@timed_stage("plot.vc_timeseries")
+def plot_vc_timeseries(
+    data: pd.DataFrame, vc_gridlines: list = [3, 10], show: bool = True
+):
     """generates a timeseries plot of the VC level with appropriate labels.
-    Mostly a shortcut for a seaborn plot with some decoration.
+
+    Each PV is drawn as its mean with a min/max envelope at screen resolution,
+    from a level-of-detail pyramid (see vib_lod.lod_series) rather than every
+    sample. Zooming or panning re-bins the visible range, so spikes stay visible
+    at any zoom level.
 
     Args:
         data (pandas.DataFrame): vibration dataframe from fetch_pv_to_dataframe
         vc_gridlines (list, optional): reference VC lines to show. Defaults to [3,10].
+        show (bool, optional): show the plot window with plt.show(). Set it to
+            False to only return the figure, e.g. to save it. Defaults to True.
+
+    Returns:
+        matplotlib.figure.Figure: the figure
     """
 
     # TODO: maybe do all the preliminary stuff as a decorator
@@ -28,8 +65,31 @@ def plot_vc_timeseries(data: pd.DataFrame, vc_gridlines: list = [3, 10]) -> None
     # sns.set_theme(style="ticks")
 
     fg = plt.figure()
-
-    ax = sns.lineplot(data=data, x="Time", y="VC_Peak", hue="PV")
+    ax = fg.gca()
+
+    # min/max envelope and mean of each PV at screen resolution, rather than
+    # every sample
+    series = {
+        pv: lod_series(group["Time"], group["VC_Peak"])
+        for pv, group in data.groupby("PV", observed=True, sort=True)
+    }
+    lines = {}
+    envelopes = {}
+
+    def redraw(start, end, width):
+        for pv, lod in series.items():
+            time, vmin, vmax, vmean = lod.view(start, end, width)
+            if pv in lines:
+                lines[pv].set_data(time, vmean)
+                envelopes[pv].remove()
+            else:
+                (lines[pv],) = ax.plot(time, vmean, label=pv)
+            envelopes[pv] = ax.fill_between(
+                time, vmin, vmax, color=lines[pv].get_color(), alpha=0.3, lw=0
+            )
+
+    redraw(None, None, max(int(ax.bbox.width), 1))
+    ax.legend(title="PV")
 
     # VC reference lines
     end_date = data["Time"].max()
@@ -44,50 +104,177 @@ def plot_vc_timeseries(data: pd.DataFrame, vc_gridlines: list = [3, 10]) -> None
     ax.set(ylabel="Peak 1/3 octave velocity (m/s)", yscale="log")
 
     fg.figure.autofmt_xdate()
+    _rebin_on_zoom(ax, redraw)
 
-    plt.show()
+    if show:
+        plt.show()
 
+    return fg
 
-def plot_vc_histograms(data: pd.DataFrame) -> None:
-    plt.figure()
 
-    ax = sns.displot(data=data, x="VC_Peak", hue="PV", kde=True, fill=True)
-    ax.set(xlabel="Peak 1/3 octave velocity (m/s)", xscale="log")
+@timed_stage("plot.vc_histograms")
+def plot_vc_histograms(data, vc_gridlines: list = [3, 10], show: bool = True):
+    """plots the distribution of VC peak velocities of each PV, from log-binned
+    histograms rather than every sample
 
-    plt.show()
+    Args:
+        data (pandas.DataFrame or vc_stats): vibration dataframe from
+            fetch_pv_to_dataframe, or statistics accumulated with vib_stats.vc_stats
+        vc_gridlines (list, optional): reference VC lines to show. Defaults to [3,10].
+        show (bool, optional): show the plot window. Defaults to True.
+
+    Returns:
+        matplotlib.figure.Figure: the figure
+    """
+
+    stats = data if isinstance(data, vc_stats) else vc_stats.from_dataframe(data)
+
+    fg = plt.figure()
+    ax = fg.gca()
 
-    # FIXME: these seem to open an extra plot window for some reason
+    # values outside the edges are left out
+    counts = stats.histogram[:, 1:-1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        percent = 100 * counts / stats.samples[:, None]
+    for pv, p in zip(stats.pvs, percent):
+        ax.stairs(p, stats.edges, fill=True, alpha=0.3, label=pv)
 
-    # TODO: add VC reference gridlines
+    # VC reference lines
+    for (limit, label) in zip(
+        VC_UPPER_LIMIT[vc_gridlines[0] : vc_gridlines[1]],
+        VC_LABELS[vc_gridlines[0] : vc_gridlines[1]],
+    ):
+        ax.axvline(limit, linestyle="dotted", color=[0.5, 0.5, 0.5])
+        ax.text(x=limit, y=1, s="VC-" + label, transform=ax.get_xaxis_transform())
+
+    occupied = np.flatnonzero(counts.sum(axis=0))
+    if len(occupied):
+        ax.set_xlim(stats.edges[occupied[0]], stats.edges[occupied[-1] + 1])
+    ax.set(
+        xlabel="Peak 1/3 octave velocity (m/s)",
+        ylabel="Samples (%)",
+        xscale="log",
+    )
+    ax.legend(title="PV")
+
+    if show:
+        plt.show()
+
+    return fg
+
+
+@timed_stage("plot.alarm_table")
+def plot_alarm_table(alarms: pd.DataFrame, show: bool = True):
+    """renders an alarm table from get_vib_alarms as a figure
+
+    Args:
+        alarms (pandas.DataFrame): alarms from get_vib_alarms
+        show (bool, optional): show the plot window. Defaults to True.
+
+    Returns:
+        matplotlib.figure.Figure: the figure
+    """
 
+    cells = alarms.astype(str).to_numpy() if len(alarms) else [["-"] * alarms.shape[1]]
 
-def plot_spectrogram(data: pd.DataFrame, freq_range: list = [2, 400]) -> None:
+    fg = plt.figure(figsize=(12, 1 + 0.25 * len(cells)))
+    ax = fg.gca()
+    ax.axis("off")
+    ax.table(cellText=cells, colLabels=list(alarms.columns), loc="upper center")
+    ax.set_title("{} alarms".format(len(alarms)))
+
+    if show:
+        plt.show()
+
+    return fg
+
+
+@timed_stage("plot.coverage")
+def plot_coverage(coverage: pd.DataFrame, show: bool = True):
+    """plots the coverage of each PV over time as a heatmap, so that dropouts stand
+    out from quiet periods
+
+    Args:
+        coverage (pandas.DataFrame): coverage from vib_quality.get_coverage
+        show (bool, optional): show the plot window. Defaults to True.
+
+    Returns:
+        matplotlib.figure.Figure: the figure
+    """
+
+    # seaborn takes a while to import and is only used here
+    import seaborn as sns
+
+    table = coverage.pivot(index="PV", columns="Start", values="Coverage")
+    table.columns = table.columns.strftime("%Y-%m-%d %H:%M")
+
+    fg = plt.figure(figsize=(12, 2 + 0.3 * len(table)))
+    ax = sns.heatmap(table, vmin=0, vmax=100, cmap="RdYlGn", ax=fg.gca())
+    ax.set(xlabel="Time", ylabel="", title="Coverage (%)")
+
+    if show:
+        plt.show()
+
+    return fg
+
+
+@timed_stage("plot.spectrogram")
+def plot_spectrogram(data, freq_range: list = [2, 400], show: bool = True):
+    """plots the spectrogram of an FFT PV next to its average and max-hold spectra
+
+    Args:
+        data (fft_spectra or pandas.DataFrame): spectra from fetch_fft_spectra, or a
+            single-PV FFT dataframe from fetch_pv_to_dataframe
+        freq_range (list, optional): frequency range to plot in Hz, upper limit
+            excluded. Defaults to [2, 400].
+        show (bool, optional): show the plot window. Defaults to True.
+
+    Returns:
+        matplotlib.figure.Figure: the figure
+    """
 
     # TODO: this is assuming a single channel
+    if isinstance(data, pd.DataFrame):
+        data = fft_spectra.from_dataframe(data)
+
     fig, (ax_spec, ax_fft) = plt.subplots(1, 2)
-    v = np.stack(data["FFT"].to_numpy())
-    v = v[:, freq_range[0] : freq_range[1]]
-
-    vmax = np.max(v, 0)
-    vmean = np.mean(v, 0)
-
-    time = data["Time"]
-    freq = np.arange(freq_range[0], freq_range[1], 1)
-
-    # FIXME: RuntimeWarning: divide by zero encountered in log10
-    # 10.0 * np.log10(np.transpose(v)),
-    ax_spec.pcolormesh(
-        time,
-        freq,
-        10.0 * np.log10(np.transpose(v)),
-        rasterized=True,
-    )
+
+    # views on the spectra, nothing is copied
+    spectra = data.sel(freq_range=freq_range)
+
+    # chunk by chunk, memory-mapped spectra are not read into memory at once
+    stats = spectral_stats.from_spectra(spectra, edges=None)
+    vmax = stats.max_hold()
+    vmean = stats.mean()
+
+    freq = spectra.freq
+
+    # spectra averaged down to screen resolution, re-binned on zoom
+    lod = lod_spectrogram(spectra)
+    meshes = []
+
+    def redraw(start, end, width):
+        time_range = None if start is None else (start, end)
+        binned = lod.view(time_range, width=width, height=int(ax_spec.bbox.height))
+        if meshes:
+            meshes.pop().remove()
+
+        # FIXME: RuntimeWarning: divide by zero encountered in log10
+        # 10.0 * np.log10(np.transpose(v)),
+        meshes.append(
+            ax_spec.pcolormesh(
+                binned.time,
+                binned.freq,
+                10.0 * np.log10(np.transpose(binned.values)),
+                rasterized=True,
+            )
+        )
+
+    redraw(None, None, max(int(ax_spec.bbox.width), 1))
 
     ax_spec.set_xlabel("Time")
     ax_spec.set_ylabel("Frequency (Hz)")
 
-    # TODO: remove hardcoded frequency limits
-
     # TODO: add average FFT and VC time series
 
     ax_spec.figure.autofmt_xdate()
@@ -97,7 +284,9 @@ def plot_spectrogram(data: pd.DataFrame, freq_range: list = [2, 400]) -> None:
     ax_fft.plot(vmean, freq)
     ax_fft.plot(vmax, freq)
     ax_fft.set_xscale("log")
+    _rebin_on_zoom(ax_spec, redraw)
 
-    plt.show()
+    if show:
+        plt.show()
 
-    #
+    return fig
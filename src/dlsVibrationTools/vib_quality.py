@@ -0,0 +1,313 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+from dlsVibrationTools.vib_alarms import (
+    _as_ns,
+    _group_start,
+    alarm_episodes,
+    episode_peaks,
+)
+
+__all__ = [
+    "GAP_FACTOR",
+    "ISSUE_COLUMNS",
+    "COVERAGE_COLUMNS",
+    "sampling_periods",
+    "gap_threshold",
+    "get_sampling_issues",
+    "get_coverage",
+]
+
+# samples further apart than GAP_FACTOR sampling periods are a gap
+GAP_FACTOR = 3.0
+
+ISSUE_COLUMNS = ["PV", "Issue", "Start", "End", "Duration", "Samples"]
+COVERAGE_COLUMNS = ["PV", "Start", "Samples", "Expected", "Coverage"]
+
+
+class _sampling:
+    """time arrays of a dataframe grouped by PV, in arrival order within each PV,
+    with the step of each sample past the newest previous sample of the same PV
+    (negative if out of order) and the sampling period of each PV
+    """
+
+    def __init__(self, data: pd.DataFrame, period: timedelta = None) -> None:
+        pv = data["PV"]
+        if not isinstance(pv.dtype, pd.CategoricalDtype):
+            pv = pv.astype("category")
+
+        self.categories = pv.cat.categories
+        codes = pv.cat.codes.to_numpy()
+        time = _as_ns(data["Time"])
+
+        # stable, so samples of a PV stay in arrival order
+        self.order = None
+        if np.any(np.diff(codes) < 0):
+            self.order = np.argsort(codes, kind="stable")
+            codes, time = codes[self.order], time[self.order]
+
+        self.codes, self.time = codes, time
+        self.group_start = _group_start(codes)
+        self.bounds = np.searchsorted(codes, np.arange(len(self.categories) + 1))
+
+        # newest time so far of each PV, one accumulate per PV
+        self.newest = np.empty_like(time)
+        for a, b in zip(self.bounds[:-1], self.bounds[1:]):
+            np.maximum.accumulate(time[a:b], out=self.newest[a:b])
+
+        self.step = np.zeros(len(time), dtype=np.int64)
+        np.subtract(time[1:], self.newest[:-1], out=self.step[1:])
+        self.step[self.group_start] = 0
+
+        if period is not None:
+            self.period = np.full(
+                len(self.categories), float(pd.Timedelta(period).value)
+            )
+        else:
+            # median step of each PV, robust to gaps and duplicates
+            self.period = np.full(len(self.categories), np.nan)
+            for i, (a, b) in enumerate(zip(self.bounds[:-1], self.bounds[1:])):
+                steps = self.step[a + 1 : b]
+                steps = steps[steps > 0]
+                if len(steps):
+                    self.period[i] = np.median(steps)
+
+    def values(self, data: pd.DataFrame, column: str) -> np.ndarray:
+        values = data[column].to_numpy()
+        return values if self.order is None else values[self.order]
+
+    def timestamps(self, ns: np.ndarray) -> pd.DatetimeIndex:
+        return pd.DatetimeIndex(
+            np.asarray(ns, dtype=np.int64).view("datetime64[ns]"),
+            dtype=pd.DatetimeTZDtype("ns", "UTC"),
+        )
+
+
+def sampling_periods(data: pd.DataFrame) -> pd.Series:
+    """sampling period of each PV, the median time between its samples
+
+    Args:
+        data (pd.DataFrame): dataframe from fetch_pv_to_dataframe
+
+    Returns:
+        pd.Series: Timedelta for each PV, NaT if it has less than two samples
+    """
+
+    s = _sampling(data)
+    return pd.Series(pd.to_timedelta(s.period, unit="ns"), index=s.categories)
+
+
+def gap_threshold(data: pd.DataFrame, gap_factor: float = GAP_FACTOR):
+    """time between samples above which there is a gap in the data, e.g. for the
+    max_gap of get_vib_alarms
+
+    Args:
+        data (pd.DataFrame): dataframe from fetch_pv_to_dataframe
+        gap_factor (float, optional): multiple of the slowest sampling period.
+            Defaults to GAP_FACTOR.
+
+    Returns:
+        pd.Timedelta: the threshold, None if no PV has two samples
+    """
+
+    period = sampling_periods(data).max()
+    return None if pd.isna(period) else gap_factor * period
+
+
+def get_sampling_issues(
+    data: pd.DataFrame,
+    start_date: datetime = None,
+    end_date: datetime = None,
+    period: timedelta = None,
+    gap_factor: float = GAP_FACTOR,
+    min_stall: int = 10,
+) -> pd.DataFrame:
+    """finds sampling problems of every PV in one vectorised pass over the time
+    (and VC_Peak) arrays:
+
+    - gap: consecutive samples further apart than gap_factor sampling periods,
+      e.g. an IOC dropout or a clock jumping forward. Also at the start and end of
+      the data if start_date and end_date are given, and over the whole range for
+      PVs without any sample.
+    - duplicate: samples with the same timestamp as the newest previous one
+    - out_of_order: samples older than the newest previous one, e.g. after a clock
+      jumped back
+    - stall: at least min_stall consecutive samples with the same VC_Peak value,
+      e.g. a stuck IOC
+
+    Consecutive duplicate or out of order samples are one issue.
+
+    Args:
+        data (pd.DataFrame): dataframe from fetch_pv_to_dataframe, in arrival order
+        start_date (datetime, optional): start of the requested data
+        end_date (datetime, optional): end of the requested data
+        period (timedelta, optional): expected sampling period. Defaults to the
+            median time between the samples of each PV.
+        gap_factor (float, optional): see above. Defaults to GAP_FACTOR.
+        min_stall (int, optional): see above. Defaults to 10.
+
+    Returns:
+        pd.DataFrame: one row per issue with its PV, Issue type, Start and End
+            times, Duration and number of Samples (missing samples for gaps),
+            sorted by PV and Start
+    """
+
+    s = _sampling(data, period)
+    not_first = ~s.group_start
+
+    pvs, issues, starts, ends, samples = [], [], [], [], []
+
+    def add(issue, codes, start, end, count):
+        pvs.append(codes)
+        issues.append(np.full(len(codes), issue, dtype=object))
+        starts.append(start)
+        ends.append(end)
+        samples.append(count)
+
+    # gaps between samples
+    with np.errstate(invalid="ignore"):
+        i = np.flatnonzero(not_first & (s.step > gap_factor * s.period[s.codes]))
+    missing = np.rint(s.step[i] / s.period[s.codes[i]]) - 1
+    add("gap", s.codes[i], s.newest[i - 1], s.time[i], missing)
+
+    # gaps at the edges of the requested range, PVs without data are one gap
+    first, last = s.bounds[:-1], s.bounds[1:] - 1
+    has_data = last >= first
+    pv_period = s.period
+    if np.isfinite(s.period).any():
+        pv_period = np.where(np.isnan(s.period), np.nanmedian(s.period), s.period)
+    with np.errstate(invalid="ignore"):
+        if start_date is not None and end_date is not None:
+            c = np.flatnonzero(~has_data)
+            start_ns, end_ns = _as_ns([start_date, end_date])
+            add(
+                "gap",
+                c,
+                np.full(len(c), start_ns),
+                np.full(len(c), end_ns),
+                (end_ns - start_ns) / pv_period[c],
+            )
+        c = np.flatnonzero(has_data)
+        if start_date is not None:
+            start_ns = _as_ns([start_date])[0]
+            oldest = np.minimum.reduceat(s.time, first[c]) if len(c) else first[c]
+            keep = oldest - start_ns > gap_factor * pv_period[c]
+            c0, oldest = c[keep], oldest[keep]
+            add(
+                "gap",
+                c0,
+                np.full(len(c0), start_ns),
+                oldest,
+                (oldest - start_ns) / pv_period[c0],
+            )
+        if end_date is not None:
+            end_ns = _as_ns([end_date])[0]
+            newest = np.maximum.reduceat(s.time, first[c]) if len(c) else first[c]
+            keep = end_ns - newest > gap_factor * pv_period[c]
+            c1, newest = c[keep], newest[keep]
+            add(
+                "gap",
+                c1,
+                newest,
+                np.full(len(c1), end_ns),
+                (end_ns - newest) / pv_period[c1],
+            )
+
+    # runs of duplicate and out of order samples
+    a, b = alarm_episodes((s.step == 0) & not_first, s.group_start)
+    add("duplicate", s.codes[a], s.time[a], s.time[b], b - a + 1)
+    # from the oldest sample of the run to the newest one before it
+    a, b = alarm_episodes((s.step < 0) & not_first, s.group_start)
+    oldest = -episode_peaks(-s.time, a, b).astype(np.int64)
+    add("out_of_order", s.codes[a], oldest, s.newest[a - 1], b - a + 1)
+
+    # runs of identical values
+    if "VC_Peak" in data and min_stall > 1:
+        values = s.values(data, "VC_Peak")
+        same = np.zeros(len(values), dtype=bool)
+        same[1:] = values[1:] == values[:-1]
+        a, b = alarm_episodes(same & not_first, s.group_start)
+        keep = b - a + 2 >= min_stall
+        a, b = a[keep], b[keep]
+        t0, t1 = s.time[a - 1], s.time[b]
+        add("stall", s.codes[a], np.minimum(t0, t1), np.maximum(t0, t1), b - a + 2)
+
+    codes = np.concatenate(pvs)
+    start = s.timestamps(np.concatenate(starts))
+    end = s.timestamps(np.concatenate(ends))
+    issues = pd.DataFrame(
+        {
+            "PV": pd.Categorical.from_codes(codes, categories=s.categories),
+            "Issue": np.concatenate(issues).astype(str),
+            "Start": start,
+            "End": end,
+            "Duration": end - start,
+            "Samples": np.nan_to_num(np.concatenate(samples)).astype(np.int64),
+        },
+        columns=ISSUE_COLUMNS,
+    )
+
+    return issues.sort_values(["PV", "Start"], kind="stable", ignore_index=True)
+
+
+def get_coverage(
+    data: pd.DataFrame,
+    start_date: datetime,
+    end_date: datetime,
+    bucket: timedelta = None,
+    period: timedelta = None,
+) -> pd.DataFrame:
+    """coverage of each PV and time bucket: the percentage of the expected samples
+    that were received, counting each timestamp once and ignoring out of order
+    samples. A quiet period has full coverage, a dropout does not.
+
+    Args:
+        data (pd.DataFrame): dataframe from fetch_pv_to_dataframe
+        start_date (datetime): start of the requested data
+        end_date (datetime): end of the requested data
+        bucket (timedelta, optional): width of the time buckets. Defaults to a
+            single bucket over the whole range.
+        period (timedelta, optional): expected sampling period. Defaults to the
+            median time between the samples of each PV (or of all PVs, for PVs
+            with less than two samples).
+
+    Returns:
+        pd.DataFrame: one row per PV and bucket with the PV, bucket Start, number
+            of Samples received and Expected, and Coverage in %
+    """
+
+    s = _sampling(data, period)
+    start_ns, end_ns = _as_ns([start_date, end_date])
+    width = end_ns - start_ns if bucket is None else pd.Timedelta(bucket).value
+    n_buckets = max(int(np.ceil((end_ns - start_ns) / width)), 1)
+    n_pvs = len(s.categories)
+
+    valid = (s.step > 0) | s.group_start
+    valid &= (s.time >= start_ns) & (s.time < end_ns)
+    b = (s.time[valid] - start_ns) // width
+    received = np.bincount(
+        s.codes[valid].astype(np.int64) * n_buckets + b, minlength=n_pvs * n_buckets
+    ).reshape(n_pvs, n_buckets)
+
+    bucket_start = start_ns + np.arange(n_buckets) * width
+    duration = np.minimum(bucket_start + width, end_ns) - bucket_start
+
+    pv_period = np.full(n_pvs, np.inf)
+    if np.isfinite(s.period).any():
+        pv_period = np.where(np.isnan(s.period), np.nanmedian(s.period), s.period)
+    expected = np.maximum(np.floor(duration[None, :] / pv_period[:, None]), 1)
+
+    return pd.DataFrame(
+        {
+            "PV": pd.Categorical.from_codes(
+                np.repeat(np.arange(n_pvs), n_buckets), categories=s.categories
+            ),
+            "Start": s.timestamps(np.tile(bucket_start, n_pvs)),
+            "Samples": received.ravel(),
+            "Expected": expected.ravel().astype(np.int64),
+            "Coverage": np.minimum(100 * received / expected, 100).ravel(),
+        },
+        columns=COVERAGE_COLUMNS,
+    )
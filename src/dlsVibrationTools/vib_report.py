@@ -0,0 +1,396 @@
+import html
+import logging
+import multiprocessing
+import os
+import re
+import tempfile
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import TYPE_CHECKING
+
+from dlsVibrationTools.vib_metrics import collect_metrics, log_records, metrics_enabled
+
+# numpy, pandas, matplotlib and the archiver client are imported where they are
+# used, so that the command line starts without them
+if TYPE_CHECKING:
+    import pandas as pd
+
+    from dlsVibrationTools.vib_archive import vib_archive
+
+__all__ = [
+    "generate_report",
+    "fetch_report_data",
+    "PLOT_VARIABLES",
+    "save_frame",
+    "load_frame",
+    "REPORT_PLOTS",
+    "REPORT_FORMATS",
+]
+
+REPORT_PLOTS = ("timeseries", "histogram", "alarms", "quality", "spectrogram")
+REPORT_FORMATS = ("png", "pdf", "html")
+
+# number of time buckets of the coverage heatmap
+QUALITY_BUCKETS = 48
+
+# archiver variable each plot is made from
+PLOT_VARIABLES = {
+    "timeseries": "VC_PEAK",
+    "histogram": "VC_PEAK",
+    "alarms": "VC_PEAK",
+    "quality": "VC_PEAK",
+    "spectrogram": "FFT",
+}
+
+
+def fetch_report_data(
+    archive: "vib_archive",
+    start_date: datetime,
+    end_date: datetime,
+    plots: tuple,
+    beamline: str,
+    channels: list = [1],
+    ids: list = [1],
+):
+    """fetches the data of all plots of a beamline in one batch of concurrent
+    requests, each PV once however many plots use it
+
+    Args:
+        archive (vib_archive): archiver to fetch the data from
+        start_date (datetime): start of data
+        end_date (datetime): end of data
+        plots (tuple): plots to make, see REPORT_PLOTS
+        beamline (str): beamline
+        channels (list, optional): list of channels. Defaults to [1].
+        ids (list, optional): list of vibration IOC ids. Defaults to [1].
+
+    Returns:
+        tuple: the VC_PEAK dataframe (None if no plot needs it) and a dict of
+            fft_spectra for each FFT PV (empty if no plot needs them)
+    """
+
+    variables = [PLOT_VARIABLES[plot] for plot in plots]
+    results = archive.fetch_variables(
+        variables, start_date, end_date, channels, ids, [beamline]
+    )
+
+    return results.get("VC_PEAK"), results.get("FFT", {})
+
+
+def save_frame(data: "pd.DataFrame", filename: str) -> None:
+    """saves the Time, PV and VC_Peak columns of a VC_PEAK dataframe to an .npz
+    file, to hand it over to worker processes without pickling it
+
+    Args:
+        data (pd.DataFrame): VC_PEAK dataframe from fetch_pv_to_dataframe
+        filename (str): .npz file name
+    """
+
+    import numpy as np
+
+    pv = data["PV"].astype("category")
+    np.savez(
+        filename,
+        time=data["Time"].to_numpy(dtype="datetime64[ns]").view(np.int64),
+        codes=pv.cat.codes.to_numpy(),
+        categories=pv.cat.categories.to_numpy(dtype=str),
+        vc_peak=data["VC_Peak"].to_numpy(dtype=np.float64),
+    )
+
+
+def load_frame(filename: str) -> "pd.DataFrame":
+    """loads a dataframe saved by save_frame
+
+    Args:
+        filename (str): .npz file name
+
+    Returns:
+        pd.DataFrame: dataframe with Time, PV and VC_Peak columns
+    """
+
+    import numpy as np
+    import pandas as pd
+
+    with np.load(filename) as f:
+        return pd.DataFrame(
+            {
+                "Time": pd.DatetimeIndex(
+                    f["time"].view("datetime64[ns]"),
+                    dtype=pd.DatetimeTZDtype("ns", "UTC"),
+                ),
+                "PV": pd.Categorical.from_codes(f["codes"], f["categories"]),
+                "VC_Peak": f["vc_peak"],
+            },
+            copy=False,
+        )
+
+
+def _safe_name(name: str) -> str:
+    return re.sub(r"[^A-Za-z0-9_.-]+", "_", name)
+
+
+def _init_worker() -> None:
+    # workers never open a window
+    import matplotlib
+
+    matplotlib.use("Agg")
+
+
+def _render(
+    kind: str,
+    data_file: str,
+    stem: str,
+    formats: tuple,
+    vc_threshold: str,
+    freq_range: list,
+    time_range: tuple,
+    metrics: tuple = (False, False),
+) -> tuple:
+    """renders one plot of the report in a worker process
+
+    Returns:
+        tuple: names of the files written, and the stage records if metrics (a
+            (enabled, trace_memory) tuple, see vib_metrics.collect_metrics) is
+            enabled
+    """
+
+    with collect_metrics(*metrics) as records:
+        written = _render_plot(
+            kind, data_file, stem, formats, vc_threshold, freq_range, time_range
+        )
+
+    return written, records
+
+
+def _write_table(table: "pd.DataFrame", stem: str, formats: tuple) -> list:
+    # csv, and html for the index
+    table.to_csv(stem + ".csv", index=False)
+    if "html" not in formats:
+        return [stem + ".csv"]
+    table.to_html(stem + ".html", index=False)
+    return [stem + ".csv", stem + ".html"]
+
+
+def _render_plot(
+    kind, data_file, stem, formats, vc_threshold, freq_range, time_range
+) -> list:
+    # _render without the metrics
+
+    from matplotlib import pyplot as plt
+
+    from dlsVibrationTools.vib_alarms import get_vib_alarms
+    from dlsVibrationTools.vib_plots import (
+        plot_alarm_table,
+        plot_coverage,
+        plot_spectrogram,
+        plot_vc_histograms,
+        plot_vc_timeseries,
+    )
+    from dlsVibrationTools.vib_quality import (
+        gap_threshold,
+        get_coverage,
+        get_sampling_issues,
+    )
+    from dlsVibrationTools.vib_spectra import fft_spectra
+
+    written = []
+
+    if kind == "spectrogram":
+        fig = plot_spectrogram(
+            fft_spectra.load(data_file), freq_range=freq_range, show=False
+        )
+    else:
+        data = load_frame(data_file)
+        if kind == "timeseries":
+            fig = plot_vc_timeseries(data, show=False)
+        elif kind == "histogram":
+            fig = plot_vc_histograms(data, show=False)
+        elif kind == "alarms":
+            # dropouts are not alarm time
+            alarms = get_vib_alarms(data, vc_threshold, max_gap=gap_threshold(data))
+            written += _write_table(alarms, stem, formats)
+            fig = plot_alarm_table(alarms, show=False)
+        elif kind == "quality":
+            written += _write_table(
+                get_sampling_issues(data, *time_range), stem, formats
+            )
+            start, end = time_range
+            coverage = get_coverage(
+                data, start, end, bucket=(end - start) / QUALITY_BUCKETS
+            )
+            fig = plot_coverage(coverage, show=False)
+        else:
+            raise NotImplementedError(kind)
+
+    # the html index embeds the png figures
+    for ext in ("png", "pdf"):
+        if ext in formats or (ext == "png" and "html" in formats):
+            fig.savefig("{}.{}".format(stem, ext), bbox_inches="tight")
+            written.append("{}.{}".format(stem, ext))
+
+    plt.close(fig)
+
+    return written
+
+
+def _write_index(
+    output_dir: str, sections: dict, start_date: datetime, end_date: datetime
+) -> str:
+    # html page with every figure and alarm table, one section per beamline
+    body = [
+        "<h1>Vibration report</h1>",
+        "<p>{} to {}</p>".format(
+            html.escape(str(start_date)), html.escape(str(end_date))
+        ),
+    ]
+
+    for beamline, items in sections.items():
+        body.append("<h2>{}</h2>".format(html.escape(beamline)))
+        for title, stem in items:
+            name = os.path.basename(stem)
+            body.append("<h3>{}</h3>".format(html.escape(title)))
+            if os.path.exists(stem + ".csv"):
+                with open(stem + ".html", "r") as f:
+                    body.append(f.read())
+            else:
+                body.append('<img src="{}.png" alt="{}">'.format(name, name))
+
+    filename = os.path.join(output_dir, "index.html")
+    with open(filename, "w") as f:
+        f.write(
+            "<!DOCTYPE html>\n<html><body>\n{}\n</body></html>\n".format(
+                "\n".join(body)
+            )
+        )
+
+    return filename
+
+
+def generate_report(
+    archive: "vib_archive",
+    start_date: datetime,
+    end_date: datetime,
+    output_dir: str,
+    beamlines: list = None,
+    channels: list = [1],
+    ids: list = [1],
+    plots: tuple = REPORT_PLOTS,
+    formats: tuple = ("png",),
+    vc_threshold: str = "G",
+    freq_range: list = [2, 400],
+    max_workers: int = None,
+) -> list:
+    """renders a report of every beamline to files, without a display
+
+    Data is fetched once per beamline (see fetch_report_data) and written to a
+    temporary directory, from which a pool of worker processes renders the plots:
+    workers only receive file names, and FFT spectra are memory-mapped rather than
+    read. Plots of a beamline are rendered while the data of the next one is being
+    fetched. If the archive has a cache (see vib_cache), repeated reports only
+    fetch the data that is not cached yet.
+
+    Args:
+        archive (vib_archive): archiver to fetch the data from
+        start_date (datetime): start of data
+        end_date (datetime): end of data
+        output_dir (str): directory the report is written to, created if needed
+        beamlines (list, optional): list of beamlines. Defaults to
+            [archive.beamline].
+        channels (list, optional): list of channels. Defaults to [1].
+        ids (list, optional): list of vibration IOC ids. Defaults to [1].
+        plots (tuple, optional): plots to render, see REPORT_PLOTS. Defaults to
+            all.
+        formats (tuple, optional): output formats, see REPORT_FORMATS. "html"
+            writes an index.html with all figures, alarm and data quality
+            tables. Defaults to ("png",).
+        vc_threshold (str, optional): threshold of the alarm tables. Defaults to
+            "G".
+        freq_range (list, optional): frequency range of the spectrograms in Hz.
+            Defaults to [2, 400].
+        max_workers (int, optional): number of worker processes. Defaults to the
+            number of CPUs.
+
+    Raises:
+        NotImplementedError: for unknown plots or formats
+
+    Returns:
+        list: paths of the files written
+    """
+
+    for plot in plots:
+        if plot not in REPORT_PLOTS:
+            raise NotImplementedError("Unknown plot: {}".format(plot))
+    for fmt in formats:
+        if fmt not in REPORT_FORMATS:
+            raise NotImplementedError("Unknown format: {}".format(fmt))
+
+    if beamlines is None:
+        beamlines = [archive.beamline]
+
+    os.makedirs(output_dir, exist_ok=True)
+
+    futures = []
+    sections = {}
+    metrics = (metrics_enabled(), tracemalloc.is_tracing())
+
+    with tempfile.TemporaryDirectory() as workdir, ProcessPoolExecutor(
+        max_workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_worker,
+    ) as pool:
+
+        def submit(kind, data_file, title, stem):
+            stem = os.path.join(output_dir, _safe_name(stem))
+            sections.setdefault(beamline, []).append((title, stem))
+            futures.append(
+                pool.submit(
+                    _render,
+                    kind,
+                    data_file,
+                    stem,
+                    formats,
+                    vc_threshold,
+                    freq_range,
+                    (start_date, end_date),
+                    metrics,
+                )
+            )
+
+        for beamline in beamlines:
+            logging.info("Fetching report data for {}".format(beamline))
+
+            data, spectra = fetch_report_data(
+                archive, start_date, end_date, plots, beamline, channels, ids
+            )
+
+            if data is not None:
+                data_file = os.path.join(workdir, _safe_name(beamline) + ".npz")
+                save_frame(data, data_file)
+                del data
+
+                for plot in plots:
+                    if PLOT_VARIABLES[plot] == "VC_PEAK":
+                        submit(plot, data_file, plot, "{}_{}".format(beamline, plot))
+
+            for pv, s in spectra.items():
+                data_file = os.path.join(workdir, _safe_name(pv))
+                s.save(data_file)
+                submit("spectrogram", data_file, pv, "spectrogram_" + pv)
+            del spectra
+
+        if archive.cache is not None:
+            archive.cache.flush()
+
+        written = []
+        for future in futures:
+            files, records = future.result()
+            written += files
+            log_records(records)
+
+    if "html" in formats:
+        written.append(_write_index(output_dir, sections, start_date, end_date))
+
+    logging.info("Report written to {}".format(output_dir))
+
+    return written
@@ -0,0 +1,237 @@
+import sys
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+import pandas as pd
+
+from dlsVibrationTools.vib_spectra import fft_spectra
+
+__all__ = [
+    "shared_arrays",
+    "share_dataframe",
+    "dataframe_from_shared",
+    "share_spectra",
+    "spectra_from_shared",
+]
+
+_ALIGNMENT = 64  # bytes, start of each array in the shared block
+
+
+class _shared_memory(shared_memory.SharedMemory):
+    def __del__(self) -> None:
+        try:
+            self.close()
+        except BufferError:
+            # views of the block are still alive, it is unmapped with them
+            pass
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    # before Python 3.13 the resource tracker of the attaching process unlinks the
+    # block when that process exits, which is the owner's job
+    if sys.version_info >= (3, 13):
+        return _shared_memory(name, track=False)
+
+    shm = _shared_memory(name)
+    resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+class shared_arrays:
+    """Named numpy arrays stored in a single multiprocessing.shared_memory block.
+
+    Pickling only sends the name and layout of the block, so passing this object
+    to another process (e.g. as a multiprocessing.Process argument) does not copy
+    the data: the receiving process attaches to the block and gets read-only
+    views of the arrays. The creating process owns the block and unlinks it in
+    close, or when leaving a with statement.
+    """
+
+    def __init__(self, arrays: dict, meta: dict = None) -> None:
+        """
+        Args:
+            arrays (dict): numpy arrays to share, by name. They are copied once
+                into the shared block.
+            meta (dict, optional): small picklable metadata sent along with the
+                block (e.g. column names). Defaults to {}.
+        """
+
+        arrays = {key: np.ascontiguousarray(a) for key, a in arrays.items()}
+
+        self.layout = {}
+        size = 0
+        for key, a in arrays.items():
+            self.layout[key] = (a.dtype.str, a.shape, size)
+            size += -(-a.nbytes // _ALIGNMENT) * _ALIGNMENT
+
+        self.meta = meta or {}
+        self._shm = _shared_memory(create=True, size=max(size, 1))
+        self._owner = True
+
+        for key, a in arrays.items():
+            view = self._view(key)
+            view.setflags(write=True)
+            view[...] = a
+
+    def __getstate__(self) -> dict:
+        return {"name": self._shm.name, "layout": self.layout, "meta": self.meta}
+
+    def __setstate__(self, state: dict) -> None:
+        self.layout = state["layout"]
+        self.meta = state["meta"]
+        self._shm = _attach(state["name"])
+        self._owner = False
+
+    def __enter__(self) -> "shared_arrays":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def __getitem__(self, key: str) -> np.ndarray:
+        return self._view(key)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self.layout
+
+    @property
+    def nbytes(self) -> int:
+        return self._shm.size
+
+    def _view(self, key: str) -> np.ndarray:
+        dtype, shape, offset = self.layout[key]
+        # frombuffer keeps the buffer exported, so that the block cannot be
+        # unmapped while any view is alive
+        view = np.frombuffer(
+            self._shm.buf, dtype=dtype, count=int(np.prod(shape)), offset=offset
+        ).reshape(shape)
+        view.setflags(write=False)
+        return view
+
+    def close(self) -> None:
+        """detaches from the block, and frees it if this process created it. Views
+        of the arrays must not be used afterwards."""
+
+        try:
+            self._shm.close()
+        except BufferError:
+            # views are still alive, the block is unmapped with them
+            pass
+        if self._owner:
+            self._shm.unlink()
+            self._owner = False
+
+
+def share_dataframe(data: pd.DataFrame) -> shared_arrays:
+    """places the columns of a dataframe in shared memory
+
+    Supports numeric, boolean, datetime and categorical columns, i.e. everything
+    fetch_pv_to_dataframe returns except the FFT column (see share_spectra).
+
+    Args:
+        data (pd.DataFrame): dataframe to share
+
+    Raises:
+        TypeError: for columns of any other dtype
+
+    Returns:
+        shared_arrays: the shared columns, see dataframe_from_shared
+    """
+
+    arrays = {}
+    columns = []
+
+    for i, (name, column) in enumerate(data.items()):
+        key = str(i)
+        dtype = column.dtype
+
+        if isinstance(dtype, pd.CategoricalDtype):
+            arrays[key] = column.cat.codes.to_numpy()
+            kind = ("category", list(dtype.categories), dtype.ordered)
+        elif isinstance(dtype, pd.DatetimeTZDtype) or np.issubdtype(
+            dtype, np.datetime64
+        ):
+            arrays[key] = column.to_numpy(dtype="datetime64[ns]").view(np.int64)
+            kind = ("datetime", str(getattr(dtype, "tz", "") or ""))
+        elif np.issubdtype(dtype, np.number) or np.issubdtype(dtype, np.bool_):
+            arrays[key] = column.to_numpy()
+            kind = ("numpy",)
+        else:
+            raise TypeError(
+                "Column {} of dtype {} cannot be shared".format(name, dtype)
+            )
+
+        columns.append((name, key, kind))
+
+    return shared_arrays(arrays, {"columns": columns})
+
+
+def dataframe_from_shared(shared: shared_arrays) -> pd.DataFrame:
+    """builds a dataframe on the shared columns. Numeric and datetime columns are
+    read-only views of the shared block, categorical columns share their codes.
+
+    Args:
+        shared (shared_arrays): columns from share_dataframe
+
+    Returns:
+        pd.DataFrame: the dataframe
+    """
+
+    columns = {}
+    for name, key, kind in shared.meta["columns"]:
+        values = shared[key]
+        if kind[0] == "category":
+            columns[name] = pd.Categorical.from_codes(
+                values, dtype=pd.CategoricalDtype(kind[1], ordered=kind[2])
+            )
+        elif kind[0] == "datetime":
+            dtype = pd.DatetimeTZDtype("ns", kind[1]) if kind[1] else None
+            columns[name] = pd.DatetimeIndex(
+                values.view("datetime64[ns]"), dtype=dtype, copy=False
+            )
+        else:
+            columns[name] = values
+
+    return pd.DataFrame(columns, copy=False)
+
+
+def share_spectra(spectra: fft_spectra) -> shared_arrays:
+    """places the matrix and axes of FFT spectra in shared memory
+
+    Args:
+        spectra (fft_spectra): spectra to share
+
+    Returns:
+        shared_arrays: the shared spectra, see spectra_from_shared
+    """
+
+    return shared_arrays(
+        {
+            "time": spectra.time.as_unit("ns").asi8,
+            "values": spectra.values,
+            "freq": spectra.freq,
+        },
+        {"pv": spectra.pv, "tz": str(spectra.time.tz or "")},
+    )
+
+
+def spectra_from_shared(shared: shared_arrays) -> fft_spectra:
+    """builds fft_spectra on a read-only view of the shared matrix
+
+    Args:
+        shared (shared_arrays): spectra from share_spectra
+
+    Returns:
+        fft_spectra: the spectra
+    """
+
+    tz = shared.meta["tz"]
+    time = pd.DatetimeIndex(
+        shared["time"].view("datetime64[ns]"),
+        dtype=pd.DatetimeTZDtype("ns", tz) if tz else None,
+        copy=False,
+    )
+
+    return fft_spectra(
+        time, shared["values"], freq=shared["freq"], pv=shared.meta["pv"]
+    )
@@ -0,0 +1,245 @@
+import numpy as np
+import pandas as pd
+
+from dlsVibrationTools.vc_curves import vc_band_velocities, vc_peak_from_fft
+
+__all__ = ["fft_spectra"]
+
+
+class fft_spectra:
+    """(time x frequency) spectra of a single FFT PV, stored as one contiguous
+    float32 matrix with the time and frequency axes attached.
+
+    Selections (see sel) return views on the same matrix, so spectrograms,
+    averages and max-hold can be computed on slices without copying the data.
+    """
+
+    def __init__(
+        self,
+        time,
+        values: np.ndarray,
+        freq: np.ndarray = None,
+        pv: str = "",
+        freq_resolution: float = 1.0,
+    ) -> None:
+        """
+        Args:
+            time (array-like): timestamps of the spectra, one per row of values
+            values (np.ndarray): (time x frequency) spectra. Converted to float32
+                unless it already is.
+            freq (np.ndarray, optional): frequency of each column of values in Hz.
+                Defaults to freq_resolution * column index.
+            pv (str, optional): EPICS PV full name. Defaults to "".
+            freq_resolution (float, optional): frequency bin width in Hz, only used
+                if freq is not given. Defaults to 1.
+        """
+
+        values = np.asarray(values, dtype=np.float32)
+        if values.ndim == 1:
+            values = values.reshape(len(values), -1)
+
+        if freq is None:
+            freq = np.arange(values.shape[1]) * freq_resolution
+
+        self.time = pd.DatetimeIndex(time)
+        self.values = values
+        self.freq = np.asarray(freq, dtype=np.float64)
+        self.pv = pv
+
+        if len(self.time) != values.shape[0] or len(self.freq) != values.shape[1]:
+            raise ValueError(
+                "values {} do not match {} timestamps and {} frequencies".format(
+                    values.shape, len(self.time), len(self.freq)
+                )
+            )
+
+    @classmethod
+    def from_dataframe(
+        cls, data: pd.DataFrame, freq: np.ndarray = None, freq_resolution: float = 1.0
+    ) -> "fft_spectra":
+        """builds spectra from a single-PV FFT dataframe from fetch_pv_to_dataframe.
+        This copies the FFT column into a new matrix.
+
+        Args:
+            data (pd.DataFrame): FFT dataframe with Time, PV and FFT columns
+            freq (np.ndarray, optional): frequency axis in Hz
+            freq_resolution (float, optional): frequency bin width in Hz, if freq is
+                not given. Defaults to 1.
+
+        Returns:
+            fft_spectra: the spectra
+        """
+
+        pvs = data["PV"].unique()
+        if len(pvs) > 1:
+            raise ValueError("from_dataframe only supports a single PV")
+
+        values = np.stack(data["FFT"].to_numpy()) if len(data) else np.zeros((0, 0))
+
+        return cls(
+            data["Time"],
+            values,
+            freq=freq,
+            pv=str(pvs[0]) if len(pvs) else "",
+            freq_resolution=freq_resolution,
+        )
+
+    @classmethod
+    def concatenate(cls, spectra: list) -> "fft_spectra":
+        """joins spectra of the same PV along the time axis
+
+        Args:
+            spectra (list): fft_spectra objects, in time order
+
+        Returns:
+            fft_spectra: the joined spectra
+        """
+
+        return cls(
+            spectra[0].time.append([s.time for s in spectra[1:]]),
+            np.concatenate([s.values for s in spectra]),
+            freq=spectra[0].freq,
+            pv=spectra[0].pv,
+        )
+
+    def save(self, filename: str) -> None:
+        """saves the spectra matrix to filename.npy and the time and frequency axes
+        to filename.npz, so that they can be loaded memory-mapped
+
+        Args:
+            filename (str): path of the files, without extension
+        """
+
+        np.save(filename + ".npy", self.values)
+        np.savez(
+            filename + ".npz",
+            time=self.time.as_unit("ns").asi8,
+            tz=str(self.time.tz or ""),
+            freq=self.freq,
+            pv=self.pv,
+        )
+
+    @classmethod
+    def load(cls, filename: str, mmap_mode: str = "r") -> "fft_spectra":
+        """loads spectra saved by save
+
+        Args:
+            filename (str): path of the files, without extension
+            mmap_mode (str, optional): see numpy.load. Defaults to "r", the matrix
+                is memory-mapped read-only rather than read into memory.
+
+        Returns:
+            fft_spectra: the spectra
+        """
+
+        with np.load(filename + ".npz") as f:
+            time = pd.DatetimeIndex(f["time"].view("datetime64[ns]"))
+            tz, freq, pv = str(f["tz"]), f["freq"], str(f["pv"])
+
+        return cls(
+            time.tz_localize(tz) if tz else time,
+            np.load(filename + ".npy", mmap_mode=mmap_mode),
+            freq=freq,
+            pv=pv,
+        )
+
+    def __len__(self) -> int:
+        return len(self.time)
+
+    def __repr__(self) -> str:
+        return "fft_spectra({}: {} spectra x {} frequencies)".format(
+            self.pv, *self.values.shape
+        )
+
+    @property
+    def nbytes(self) -> int:
+        return self.values.nbytes + self.time.nbytes + self.freq.nbytes
+
+    def sel(self, time_range: tuple = None, freq_range: tuple = None) -> "fft_spectra":
+        """selects a time and/or frequency range. The result is a view on the same
+        data, nothing is copied.
+
+        Args:
+            time_range (tuple, optional): (start, end) datetimes, end excluded
+            freq_range (tuple, optional): (fmin, fmax) in Hz, fmax excluded
+
+        Returns:
+            fft_spectra: the selected spectra
+        """
+
+        t = slice(None)
+        f = slice(None)
+
+        if time_range is not None:
+            t = slice(
+                self.time.searchsorted(pd.Timestamp(time_range[0])),
+                self.time.searchsorted(pd.Timestamp(time_range[1])),
+            )
+        if freq_range is not None:
+            f = slice(*np.searchsorted(self.freq, freq_range))
+
+        return fft_spectra(self.time[t], self.values[t, f], self.freq[f], self.pv)
+
+    def mean(self) -> np.ndarray:
+        """average spectrum over time"""
+        return self.values.mean(axis=0, dtype=np.float64)
+
+    def max_hold(self) -> np.ndarray:
+        """max-hold spectrum over time"""
+        return self.values.max(axis=0)
+
+    def vc_bands(self, quantity: str = "velocity") -> np.ndarray:
+        """RMS velocity in each 1/3 octave band, see vc_curves.vc_band_velocities
+
+        Args:
+            quantity (str, optional): "velocity" or "acceleration" spectra.
+                Defaults to "velocity".
+
+        Returns:
+            np.ndarray: (time x bands) RMS velocities in m/s
+        """
+        return vc_band_velocities(self.values, self.freq, quantity)
+
+    def vc_peak(self, quantity: str = "velocity") -> np.ndarray:
+        """VC peak velocity of each spectrum, see vc_curves.vc_peak_from_fft
+
+        Args:
+            quantity (str, optional): "velocity" or "acceleration" spectra.
+                Defaults to "velocity".
+
+        Returns:
+            np.ndarray: VC peak velocity in m/s, one per spectrum
+        """
+        return vc_peak_from_fft(self.values, self.freq, quantity)
+
+    def to_dataframe(self) -> pd.DataFrame:
+        """converts the spectra to the fetch_pv_to_dataframe format. Each FFT row is
+        a view on the spectra matrix.
+
+        Returns:
+            pd.DataFrame: dataframe with Time, PV and FFT columns
+        """
+
+        return pd.DataFrame(
+            {
+                "Time": self.time,
+                "PV": pd.Categorical([self.pv] * len(self)),
+                "FFT": fft_row_views(self.values),
+            }
+        )
+
+
+def fft_row_views(values: np.ndarray) -> np.ndarray:
+    """returns an object array holding a view of each row of values, for storing a
+    spectra matrix in a dataframe column without copying it
+
+    Args:
+        values (np.ndarray): (time x frequency) spectra
+
+    Returns:
+        np.ndarray: object array of 1-D row views
+    """
+
+    rows = np.empty(len(values), dtype=object)
+    rows[:] = list(values)
+    return rows
@@ -0,0 +1,737 @@
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+
+from dlsVibrationTools.vc_curves import VC_CATEGORIES, vc_get_level_codes
+from dlsVibrationTools.vib_alarms import _as_ns
+from dlsVibrationTools.vib_spectra import fft_spectra
+from dlsVibrationTools.vib_store import fft_store
+
+__all__ = [
+    "HISTOGRAM_EDGES",
+    "VC_HISTOGRAM_EDGES",
+    "spectral_stats",
+    "vc_stats",
+    "accumulate_spectra",
+    "accumulate_vc",
+    "store_stats",
+]
+
+# log-spaced histogram bin edges used for percentiles, 20 bins per decade
+HISTOGRAM_EDGES = np.logspace(-12, 0, 12 * 20 + 1)
+# histogram bin edges of VC peak velocities in m/s, 50 bins per decade
+VC_HISTOGRAM_EDGES = np.logspace(-10, -3, 7 * 50 + 1)
+
+
+class spectral_stats:
+    """Streaming statistics of spectra over time, one value per frequency bin.
+
+    Spectra are added chunk by chunk (see update) and only the running statistics
+    are kept, so the memory used does not depend on the length of the time range:
+    mean and variance (Chan et al. parallel algorithm), min and max-hold, and a
+    histogram per frequency bin for approximate percentiles. Statistics of
+    different chunks, channels or processes can be combined with merge, and pickle
+    to a few MB.
+
+    Example:
+
+        stats = spectral_stats(freq)
+        for chunk in chunks:
+            stats.update(chunk)
+        p95 = stats.percentile(95)
+    """
+
+    def __init__(self, freq: np.ndarray, edges: np.ndarray = HISTOGRAM_EDGES) -> None:
+        """
+        Args:
+            freq (np.ndarray): frequency of each bin in Hz
+            edges (np.ndarray, optional): increasing histogram bin edges for the
+                percentiles, values outside them are still counted. None disables
+                the histogram and percentiles. Defaults to HISTOGRAM_EDGES.
+        """
+
+        self.freq = np.asarray(freq, dtype=np.float64)
+        self.edges = None if edges is None else np.asarray(edges, dtype=np.float64)
+        self.time_range = ()
+
+        self.count = 0
+        n = len(self.freq)
+        self._mean = np.zeros(n)
+        self._m2 = np.zeros(n)
+        self._min = np.full(n, np.inf)
+        self._max = np.full(n, -np.inf)
+        self.histogram = None
+        if self.edges is not None:
+            self.histogram = np.zeros((n, len(self.edges) + 1), dtype=np.int64)
+
+    def __repr__(self) -> str:
+        return "spectral_stats({} spectra x {} frequencies)".format(
+            self.count, len(self.freq)
+        )
+
+    @classmethod
+    def from_spectra(
+        cls, spectra: fft_spectra, edges: np.ndarray = HISTOGRAM_EDGES, **kwargs
+    ) -> "spectral_stats":
+        """statistics of some spectra, see update
+
+        Args:
+            spectra (fft_spectra): the spectra
+            edges (np.ndarray, optional): see spectral_stats.
+
+        Returns:
+            spectral_stats: the statistics
+        """
+        return cls(spectra.freq, edges).update(spectra, **kwargs)
+
+    def update(self, spectra: fft_spectra, chunk_size: int = 1024) -> "spectral_stats":
+        """adds spectra to the statistics, chunk_size rows at a time so that
+        memory-mapped spectra are never read in full
+
+        Args:
+            spectra (fft_spectra): spectra with the same frequency axis
+            chunk_size (int, optional): number of spectra processed at once.
+                Defaults to 1024.
+
+        Raises:
+            ValueError: if the frequency axis does not match
+
+        Returns:
+            spectral_stats: self
+        """
+
+        self._check(spectra.freq)
+        if len(spectra) == 0:
+            return self
+
+        for start in range(0, len(spectra), chunk_size):
+            self._update(np.asarray(spectra.values[start : start + chunk_size]))
+
+        self._extend_time_range((spectra.time[0], spectra.time[-1]))
+        return self
+
+    def _update(self, values: np.ndarray) -> None:
+        n = len(values)
+        mean = values.mean(axis=0, dtype=np.float64)
+        m2 = np.square(values - mean).sum(axis=0)
+        self._combine(n, mean, m2, values.min(axis=0), values.max(axis=0))
+
+        if self.histogram is not None:
+            nb = self.histogram.shape[1]
+            bins = np.searchsorted(self.edges, values, side="right")
+            bins += np.arange(values.shape[1]) * nb
+            self.histogram += np.bincount(
+                bins.ravel(), minlength=self.histogram.size
+            ).reshape(self.histogram.shape)
+
+    def _combine(self, n, mean, m2, vmin, vmax) -> None:
+        # Chan et al., "Updating formulae and a pairwise algorithm for computing
+        # sample variances" (1979)
+        total = self.count + n
+        delta = mean - self._mean
+        self._mean += delta * (n / total)
+        self._m2 += m2 + np.square(delta) * (self.count * n / total)
+        self.count = total
+        np.minimum(self._min, vmin, out=self._min)
+        np.maximum(self._max, vmax, out=self._max)
+
+    def _check(self, freq: np.ndarray) -> None:
+        if len(freq) != len(self.freq) or not np.allclose(freq, self.freq):
+            raise ValueError("Frequency axis does not match the statistics")
+
+    def _extend_time_range(self, time_range: tuple) -> None:
+        if not time_range:
+            return
+        if not self.time_range:
+            self.time_range = tuple(time_range)
+        else:
+            self.time_range = (
+                min(self.time_range[0], time_range[0]),
+                max(self.time_range[1], time_range[1]),
+            )
+
+    def merge(self, other: "spectral_stats") -> "spectral_stats":
+        """adds the statistics of other spectra, e.g. of another time range or
+        channel, as if they had been added with update
+
+        Args:
+            other (spectral_stats): statistics with the same frequency axis and
+                histogram edges
+
+        Raises:
+            ValueError: if the frequency axis or histogram edges do not match
+
+        Returns:
+            spectral_stats: self
+        """
+
+        self._check(other.freq)
+        if (self.edges is None) != (other.edges is None) or (
+            self.edges is not None and not np.array_equal(self.edges, other.edges)
+        ):
+            raise ValueError("Histogram edges do not match")
+        if other.count == 0:
+            return self
+
+        self._combine(other.count, other._mean, other._m2, other._min, other._max)
+        if self.histogram is not None:
+            self.histogram += other.histogram
+        self._extend_time_range(other.time_range)
+
+        return self
+
+    @classmethod
+    def combine(cls, stats: list) -> "spectral_stats":
+        """merges a list of statistics into new statistics
+
+        Args:
+            stats (list): spectral_stats with the same frequency axis
+
+        Returns:
+            spectral_stats: the merged statistics
+        """
+
+        result = cls(stats[0].freq, stats[0].edges)
+        for s in stats:
+            result.merge(s)
+        return result
+
+    def _empty(self) -> np.ndarray:
+        return np.full(len(self.freq), np.nan)
+
+    def mean(self) -> np.ndarray:
+        """average spectrum"""
+        return self._mean.copy() if self.count else self._empty()
+
+    def variance(self, ddof: int = 0) -> np.ndarray:
+        """variance of each frequency bin
+
+        Args:
+            ddof (int, optional): delta degrees of freedom, see numpy.var.
+                Defaults to 0.
+        """
+        if self.count <= ddof:
+            return self._empty()
+        return self._m2 / (self.count - ddof)
+
+    def std(self, ddof: int = 0) -> np.ndarray:
+        """standard deviation of each frequency bin, see variance"""
+        return np.sqrt(self.variance(ddof))
+
+    def min_hold(self) -> np.ndarray:
+        """min-hold spectrum"""
+        return self._min.copy() if self.count else self._empty()
+
+    def max_hold(self) -> np.ndarray:
+        """max-hold spectrum"""
+        return self._max.copy() if self.count else self._empty()
+
+    def percentile(self, q) -> np.ndarray:
+        """approximate percentiles of each frequency bin, interpolated
+        geometrically within the histogram bins. The error is at most the width of
+        a histogram bin (12% with HISTOGRAM_EDGES).
+
+        Args:
+            q (float or array-like): percentiles between 0 and 100
+
+        Raises:
+            ValueError: if the histogram is disabled
+
+        Returns:
+            np.ndarray: spectrum of each percentile, (len(q) x frequency) if q is
+                array-like
+        """
+
+        if self.histogram is None:
+            raise ValueError("Percentiles need histogram edges")
+
+        qs = np.atleast_1d(np.asarray(q, dtype=np.float64))
+        if not self.count:
+            result = np.full((len(qs), len(self.freq)), np.nan)
+            return result if np.ndim(q) else result[0]
+
+        cumulative = np.cumsum(self.histogram, axis=1)
+        rows = np.arange(len(self.freq))
+        # edges of each histogram bin, the outer ones bounded by min and max
+        lower_edges = np.concatenate([[-np.inf], self.edges])
+        upper_edges = np.concatenate([self.edges, [np.inf]])
+
+        result = np.empty((len(qs), len(self.freq)))
+        for i, target in enumerate(qs / 100 * self.count):
+            k = np.minimum((cumulative < target).sum(axis=1), cumulative.shape[1] - 1)
+            in_bin = self.histogram[rows, k]
+            below = cumulative[rows, k] - in_bin
+            fraction = np.clip((target - below) / np.maximum(in_bin, 1), 0, 1)
+
+            lower = np.maximum(lower_edges[k], self._min)
+            upper = np.minimum(upper_edges[k], self._max)
+            with np.errstate(divide="ignore", invalid="ignore"):
+                result[i] = np.where(
+                    lower > 0,
+                    lower * (upper / lower) ** fraction,
+                    lower + (upper - lower) * fraction,
+                )
+
+        return result if np.ndim(q) else result[0]
+
+
+def accumulate_spectra(chunks, edges: np.ndarray = HISTOGRAM_EDGES) -> dict:
+    """statistics of each PV over a stream of spectra, e.g. from
+    vib_archive.iter_fft_spectra, keeping one chunk in memory at a time
+
+    Args:
+        chunks (iterable): dicts of fft_spectra for each PV full name
+        edges (np.ndarray, optional): see spectral_stats.
+
+    Returns:
+        dict: spectral_stats for each PV full name
+    """
+
+    stats = {}
+    for chunk in chunks:
+        for pv, spectra in chunk.items():
+            if pv not in stats:
+                stats[pv] = spectral_stats(spectra.freq, edges)
+            stats[pv].update(spectra)
+
+    return stats
+
+
+def _store_part_stats(path: str, pv: str, time_range: tuple, edges) -> tuple:
+    # runs in a worker process
+    return pv, spectral_stats.from_spectra(fft_store(path).open(pv, time_range), edges)
+
+
+def store_stats(
+    store: fft_store,
+    pvs: list = None,
+    time_range: tuple = None,
+    edges: np.ndarray = HISTOGRAM_EDGES,
+    parts: int = 1,
+    max_workers: int = None,
+) -> dict:
+    """statistics of each PV of an fft_store, computed in parallel: the time
+    range of every PV is split in parts, each reduced by a worker process reading
+    its own slice of the memory-mapped store, and the results are merged.
+
+    Args:
+        store (fft_store): the store
+        pvs (list, optional): PV full names. Defaults to all of them.
+        time_range (tuple, optional): (start, end) datetimes, end excluded.
+            Defaults to everything stored.
+        edges (np.ndarray, optional): see spectral_stats.
+        parts (int, optional): number of parts each PV is split in. Defaults to 1.
+        max_workers (int, optional): number of worker processes. Defaults to the
+            number of CPUs.
+
+    Returns:
+        dict: spectral_stats for each PV full name
+    """
+
+    jobs = []
+    for pv in pvs or store.pvs:
+        time = store.open(pv, time_range).time
+        if len(time) == 0:
+            jobs.append((pv, time_range))
+            continue
+        bounds = list(time[np.linspace(0, len(time), parts + 1, dtype=int)[:-1]])
+        bounds.append(time[-1] + np.timedelta64(1, "ns"))
+        jobs += [(pv, (a, b)) for a, b in zip(bounds[:-1], bounds[1:]) if a < b]
+
+    logging.info("Computing statistics of {} parts".format(len(jobs)))
+
+    results = {}
+    with ProcessPoolExecutor(
+        max_workers, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        futures = [
+            executor.submit(_store_part_stats, store.path, pv, part, edges)
+            for pv, part in jobs
+        ]
+        for future in futures:
+            pv, stats = future.result()
+            if pv in results:
+                results[pv].merge(stats)
+            else:
+                results[pv] = stats
+
+    return results
+
+
+class vc_stats:
+    """Streaming VC statistics of each PV: a log-binned histogram of VC_Peak and
+    the number of samples and time spent at each VC level.
+
+    Dataframes from fetch_pv_to_dataframe (or iter_pv_to_dataframe chunks) are
+    added with update and only the statistics are kept, so a year of data never
+    needs to be in memory. Statistics of different days merge in any order, e.g.
+    to build monthly or yearly distributions from daily partials saved with save.
+
+    As for dT in fetch_pv_to_dataframe, each sample lasts until the next sample
+    of the same PV, at most max_gap so that dropouts are not counted as time at
+    the level before them. The last sample of a partial lasts until the first
+    sample of the next one, so splitting the data in chunks does not change the
+    result; the very last sample of each PV is not counted.
+
+    Example:
+
+        stats = vc_stats()
+        for chunk in archive.iter_pv_to_dataframe("VC_PEAK", start, end, [1, 2]):
+            stats.update(chunk)
+        stats.time_at_level(cumulative=True)
+    """
+
+    def __init__(
+        self,
+        edges: np.ndarray = VC_HISTOGRAM_EDGES,
+        max_gap: timedelta = timedelta(minutes=1),
+    ) -> None:
+        """
+        Args:
+            edges (np.ndarray, optional): increasing histogram bin edges in m/s,
+                values outside them are still counted. Defaults to
+                VC_HISTOGRAM_EDGES.
+            max_gap (timedelta, optional): longest time a sample is counted for.
+                Defaults to 1 minute.
+        """
+
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.max_gap = pd.Timedelta(max_gap)
+        self.pvs = []
+
+        n_levels = len(VC_CATEGORIES)
+        self.histogram = np.zeros((0, len(self.edges) + 1), dtype=np.int64)
+        self.level_samples = np.zeros((0, n_levels), dtype=np.int64)
+        self._seconds = np.zeros((0, n_levels))
+        # (row, first time, last time, level of the last sample) of each run of
+        # samples whose last sample does not know its duration yet
+        self._segments = np.zeros((0, 4), dtype=np.int64)
+
+    def __repr__(self) -> str:
+        return "vc_stats({} PVs, {} samples)".format(
+            len(self.pvs), int(self.samples.sum())
+        )
+
+    def _rows(self, pvs: list) -> np.ndarray:
+        # row of each PV, added if new
+        rows = {pv: i for i, pv in enumerate(self.pvs)}
+        new = [pv for pv in pvs if pv not in rows]
+        if new:
+            rows.update({pv: len(self.pvs) + i for i, pv in enumerate(new)})
+            self.pvs += new
+            grow = ((0, len(new)), (0, 0))
+            self.histogram = np.pad(self.histogram, grow)
+            self.level_samples = np.pad(self.level_samples, grow)
+            self._seconds = np.pad(self._seconds, grow)
+        return np.array([rows[pv] for pv in pvs], dtype=np.int64)
+
+    @property
+    def samples(self) -> np.ndarray:
+        """number of samples of each PV, NaN values excluded"""
+        return self.level_samples.sum(axis=1)
+
+    @property
+    def level_seconds(self) -> np.ndarray:
+        """(PV x level) time in seconds spent at each level in VC_CATEGORIES"""
+
+        # the last sample of each segment lasts until the next segment
+        seg = self._segments[np.lexsort(self._segments[:, 1::-1].T)]
+        duration = seg[1:, 1] - seg[:-1, 2]
+        counted = (seg[1:, 0] == seg[:-1, 0]) & (duration > 0) & (seg[:-1, 3] >= 0)
+
+        n_pvs, n_levels = self._seconds.shape
+        seconds = np.minimum(duration[counted], self.max_gap.value) / 1e9
+        return self._seconds + np.bincount(
+            seg[:-1][counted, 0] * n_levels + seg[:-1][counted, 3],
+            weights=seconds,
+            minlength=n_pvs * n_levels,
+        ).reshape(n_pvs, n_levels)
+
+    @property
+    def time_range(self) -> tuple:
+        """first and last sample time of all PVs, () if there are none"""
+        if not len(self._segments):
+            return ()
+        first, last = self._segments[:, 1].min(), self._segments[:, 2].max()
+        return tuple(pd.to_datetime([first, last], utc=True))
+
+    @classmethod
+    def from_dataframe(cls, data: pd.DataFrame, **kwargs) -> "vc_stats":
+        """statistics of a dataframe, see update
+
+        Args:
+            data (pd.DataFrame): dataframe from fetch_pv_to_dataframe with Time, PV
+                and VC_Peak columns
+            **kwargs: see vc_stats
+
+        Returns:
+            vc_stats: the statistics
+        """
+        return cls(**kwargs).update(data)
+
+    def update(self, data: pd.DataFrame) -> "vc_stats":
+        """adds samples to the statistics, in one vectorised pass
+
+        Args:
+            data (pd.DataFrame): dataframe from fetch_pv_to_dataframe with Time, PV
+                and VC_Peak columns
+
+        Returns:
+            vc_stats: self
+        """
+
+        if len(data) == 0:
+            return self
+
+        pv = data["PV"]
+        if not isinstance(pv.dtype, pd.CategoricalDtype):
+            pv = pv.astype("category")
+        codes = pv.cat.codes.to_numpy().astype(np.int64)
+        time = _as_ns(data["Time"])
+        values = data["VC_Peak"].to_numpy(dtype=np.float64)
+
+        # by PV, then time
+        if np.any(np.diff(codes) < 0) or np.any(
+            (np.diff(time) < 0) & (np.diff(codes) == 0)
+        ):
+            order = np.lexsort((time, codes))
+            codes, time, values = codes[order], time[order], values[order]
+
+        n_pvs, n_levels = len(pv.cat.categories), len(VC_CATEGORIES)
+        n_bins = len(self.edges) + 1
+        rows = self._rows(list(pv.cat.categories))
+
+        levels = vc_get_level_codes(values)
+        valid = levels >= 0
+        bins = np.searchsorted(self.edges, values[valid], side="right")
+        self.histogram[rows] += np.bincount(
+            codes[valid] * n_bins + bins, minlength=n_pvs * n_bins
+        ).reshape(n_pvs, n_bins)
+        self.level_samples[rows] += np.bincount(
+            codes[valid] * n_levels + levels[valid], minlength=n_pvs * n_levels
+        ).reshape(n_pvs, n_levels)
+
+        # each sample lasts until the next one of the same PV
+        following = valid[:-1] & (codes[1:] == codes[:-1])
+        seconds = np.minimum(np.diff(time), self.max_gap.value)[following] / 1e9
+        self._seconds[rows] += np.bincount(
+            codes[:-1][following] * n_levels + levels[:-1][following],
+            weights=seconds,
+            minlength=n_pvs * n_levels,
+        ).reshape(n_pvs, n_levels)
+
+        bounds = np.searchsorted(codes, np.arange(n_pvs + 1))
+        has = np.flatnonzero(bounds[1:] > bounds[:-1])
+        last = bounds[1:][has] - 1
+        self._add_segments(
+            np.column_stack(
+                [rows[has], time[bounds[:-1][has]], time[last], levels[last]]
+            ),
+            join=True,
+        )
+
+        return self
+
+    def _add_segments(self, segments: np.ndarray, join: bool) -> None:
+        if join:
+            # a segment later than all the others of its PV continues the latest
+            # one, whose last sample now lasts until its first sample
+            for i, (row, first, last, tail) in enumerate(segments):
+                mine = np.flatnonzero(self._segments[:, 0] == row)
+                if not len(mine):
+                    continue
+                k = mine[np.argmax(self._segments[mine, 2])]
+                _, first_k, last_k, tail_k = self._segments[k]
+                if last_k >= first:
+                    continue
+                if tail_k >= 0:
+                    gap = min(first - last_k, self.max_gap.value)
+                    self._seconds[row, tail_k] += gap / 1e9
+                segments[i, 1] = first_k
+                self._segments = np.delete(self._segments, k, axis=0)
+
+        self._segments = np.concatenate([self._segments, segments])
+
+    def merge(self, other: "vc_stats") -> "vc_stats":
+        """adds the statistics of other samples, e.g. of another day, as if they had
+        been added with update. Partials merge exactly in any order, as long as
+        the samples of each PV in different partials do not overlap in time.
+
+        Args:
+            other (vc_stats): statistics with the same histogram edges and max_gap
+
+        Raises:
+            ValueError: if the histogram edges or max_gap do not match
+
+        Returns:
+            vc_stats: self
+        """
+
+        if not np.array_equal(self.edges, other.edges) or self.max_gap != other.max_gap:
+            raise ValueError("Histogram edges or max_gap do not match")
+
+        rows = self._rows(other.pvs)
+        self.histogram[rows] += other.histogram
+        self.level_samples[rows] += other.level_samples
+        self._seconds[rows] += other._seconds
+
+        segments = other._segments.copy()
+        segments[:, 0] = rows[segments[:, 0]]
+        self._add_segments(segments, join=False)
+
+        return self
+
+    @classmethod
+    def combine(cls, stats: list) -> "vc_stats":
+        """merges a list of statistics, e.g. daily partials, into new statistics
+
+        Args:
+            stats (list): vc_stats with the same histogram edges and max_gap
+
+        Returns:
+            vc_stats: the merged statistics
+        """
+
+        result = cls(stats[0].edges, stats[0].max_gap)
+        for s in stats:
+            result.merge(s)
+        return result
+
+    def save(self, filename: str) -> None:
+        """saves the statistics to an npz file, e.g. as a daily partial
+
+        Args:
+            filename (str): path of the file
+        """
+
+        np.savez(
+            filename,
+            pvs=np.array(self.pvs, dtype=str),
+            edges=self.edges,
+            max_gap=self.max_gap.value,
+            histogram=self.histogram,
+            level_samples=self.level_samples,
+            seconds=self._seconds,
+            segments=self._segments,
+        )
+
+    @classmethod
+    def load(cls, filename: str) -> "vc_stats":
+        """loads statistics saved by save
+
+        Args:
+            filename (str): path of the file
+
+        Returns:
+            vc_stats: the statistics
+        """
+
+        with np.load(filename) as f:
+            stats = cls(f["edges"], pd.Timedelta(int(f["max_gap"]), unit="ns"))
+            stats.pvs = [str(pv) for pv in f["pvs"]]
+            stats.histogram = f["histogram"]
+            stats.level_samples = f["level_samples"]
+            stats._seconds = f["seconds"]
+            stats._segments = f["segments"]
+
+        return stats
+
+    def histogram_frame(self) -> pd.DataFrame:
+        """histogram of each PV as a dataframe
+
+        Returns:
+            pd.DataFrame: one row per PV and bin with the PV, Lower and Upper bin
+                edges in m/s and number of Samples. The first and last bins count
+                the values outside the edges.
+        """
+
+        n_pvs, n_bins = self.histogram.shape
+        lower = np.concatenate([[0.0], self.edges])
+        upper = np.concatenate([self.edges, [np.inf]])
+        return pd.DataFrame(
+            {
+                "PV": pd.Categorical(np.repeat(self.pvs, n_bins), categories=self.pvs),
+                "Lower": np.tile(lower, n_pvs),
+                "Upper": np.tile(upper, n_pvs),
+                "Samples": self.histogram.ravel(),
+            }
+        )
+
+    def exceedance(self) -> pd.DataFrame:
+        """cumulative exceedance curve of each PV: the percentage of samples at or
+        above each histogram edge
+
+        Returns:
+            pd.DataFrame: one row per PV and histogram edge with the PV, VC_Peak
+                edge in m/s and Exceedance in %
+        """
+
+        # samples in bins above each edge
+        above = np.cumsum(self.histogram[:, ::-1], axis=1)[:, ::-1][:, 1:]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            percent = 100 * above / self.samples[:, None]
+
+        return pd.DataFrame(
+            {
+                "PV": pd.Categorical(
+                    np.repeat(self.pvs, len(self.edges)), categories=self.pvs
+                ),
+                "VC_Peak": np.tile(self.edges, len(self.pvs)),
+                "Exceedance": percent.ravel(),
+            }
+        )
+
+    def time_at_level(
+        self, percent: bool = True, cumulative: bool = False
+    ) -> pd.DataFrame:
+        """time spent at each VC level by each PV
+
+        Args:
+            percent (bool, optional): as a percentage of the time counted for the
+                PV, rather than in seconds. Defaults to True.
+            cumulative (bool, optional): time within each level, i.e. at that level
+                or a more stringent one. Defaults to False.
+
+        Returns:
+            pd.DataFrame: one row per PV and one column per level in VC_CATEGORIES
+        """
+
+        seconds = self.level_seconds
+        if cumulative:
+            seconds = np.cumsum(seconds, axis=1)
+        if percent:
+            with np.errstate(divide="ignore", invalid="ignore"):
+                seconds = 100 * seconds / self.level_seconds.sum(axis=1)[:, None]
+
+        return pd.DataFrame(
+            seconds, index=pd.Index(self.pvs, name="PV"), columns=VC_CATEGORIES
+        )
+
+
+def accumulate_vc(
+    chunks,
+    edges: np.ndarray = VC_HISTOGRAM_EDGES,
+    max_gap: timedelta = timedelta(minutes=1),
+) -> vc_stats:
+    """VC statistics of a stream of dataframes, e.g. from
+    vib_archive.iter_pv_to_dataframe("VC_PEAK", ...), keeping one chunk in memory at
+    a time
+
+    Args:
+        chunks (iterable): dataframes with Time, PV and VC_Peak columns
+        edges (np.ndarray, optional): see vc_stats.
+        max_gap (timedelta, optional): see vc_stats.
+
+    Returns:
+        vc_stats: statistics of every PV
+    """
+
+    stats = vc_stats(edges, max_gap)
+    for chunk in chunks:
+        stats.update(chunk)
+
+    return stats
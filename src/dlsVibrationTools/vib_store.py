@@ -0,0 +1,228 @@
+import json
+import logging
+import os
+from urllib.parse import quote, unquote
+
+import numpy as np
+import pandas as pd
+
+from dlsVibrationTools.vib_archive import arrays_to_dataframe
+from dlsVibrationTools.vib_spectra import fft_spectra
+
+__all__ = ["fft_store"]
+
+
+class fft_store:
+    """Append-only, memory-mapped on-disk store of FFT spectra.
+
+    Each PV has its own directory holding three files:
+
+    - values.f32: the (time x frequency) float32 spectra, one row after the other
+    - time.i64: the timestamp of each row in ns since the epoch (UTC), increasing
+    - meta.json: the PV name and frequency axis
+
+    Both data files are raw little-endian arrays, so any time range can be opened
+    as a numpy view on a memory map: the time index is binary searched and only
+    the pages of the selected rows are ever read from disk. Rows are appended to
+    values.f32 before their timestamps, which makes the time index the commit
+    record: rows beyond it (e.g. after a crash) are ignored and overwritten by the
+    next append. A store has a single writer, but can have any number of readers.
+    """
+
+    def __init__(self, path: str) -> None:
+        """
+        Args:
+            path (str): directory of the store, created if needed
+        """
+
+        self.path = os.path.expanduser(path)
+        os.makedirs(self.path, exist_ok=True)
+
+    def __repr__(self) -> str:
+        return "fft_store({}: {} PVs)".format(self.path, len(self.pvs))
+
+    def _dir(self, pv: str) -> str:
+        return os.path.join(self.path, quote(pv, safe="-_."))
+
+    @property
+    def pvs(self) -> list:
+        """PV full names in the store"""
+        return sorted(
+            unquote(d)
+            for d in os.listdir(self.path)
+            if os.path.exists(os.path.join(self.path, d, "meta.json"))
+        )
+
+    def _meta(self, pv: str) -> dict:
+        with open(os.path.join(self._dir(pv), "meta.json"), "r") as f:
+            return json.load(f)
+
+    def _time(self, pv: str) -> np.ndarray:
+        filename = os.path.join(self._dir(pv), "time.i64")
+        if os.path.getsize(filename) == 0:
+            return np.zeros(0, dtype="<i8")
+        return np.memmap(filename, dtype="<i8", mode="r")
+
+    def __len__(self) -> int:
+        return sum(self.count(pv) for pv in self.pvs)
+
+    def count(self, pv: str) -> int:
+        """number of spectra stored for a PV"""
+        return os.path.getsize(os.path.join(self._dir(pv), "time.i64")) // 8
+
+    def time_range(self, pv: str) -> tuple:
+        """first and last timestamps stored for a PV"""
+        time = self._time(pv)
+        return tuple(pd.to_datetime(time[[0, -1]], utc=True)) if len(time) else ()
+
+    def append(self, spectra: fft_spectra) -> int:
+        """appends spectra to the store. Spectra that are not newer than the last
+        stored one are skipped, so overlapping ranges can be ingested again.
+
+        Args:
+            spectra (fft_spectra): spectra of a single PV, in time order
+
+        Raises:
+            ValueError: if the frequency axis does not match the stored one
+
+        Returns:
+            int: number of spectra appended
+        """
+
+        if len(spectra) == 0:
+            return 0
+
+        directory = self._dir(spectra.pv)
+        os.makedirs(directory, exist_ok=True)
+        values_file = os.path.join(directory, "values.f32")
+        time_file = os.path.join(directory, "time.i64")
+
+        if os.path.exists(os.path.join(directory, "meta.json")):
+            freq = np.asarray(self._meta(spectra.pv)["freq"])
+            if len(freq) != len(spectra.freq) or not np.allclose(freq, spectra.freq):
+                raise ValueError(
+                    "Frequency axis of {} does not match the store".format(spectra.pv)
+                )
+        else:
+            open(values_file, "wb").close()
+            open(time_file, "wb").close()
+            with open(os.path.join(directory, "meta.json"), "w") as f:
+                json.dump({"pv": spectra.pv, "freq": spectra.freq.tolist()}, f)
+
+        time_ns = spectra.time.as_unit("ns").asi8
+        stored = self._time(spectra.pv)
+        n = len(stored)
+        first = np.searchsorted(time_ns, stored[-1], side="right") if n else 0
+        if first == len(time_ns):
+            return 0
+
+        row_bytes = 4 * len(spectra.freq)
+        with open(values_file, "r+b") as f:
+            # drops rows left over by an interrupted append
+            f.truncate(n * row_bytes)
+            f.seek(0, os.SEEK_END)
+            f.write(np.ascontiguousarray(spectra.values[first:], dtype="<f4").data)
+            f.flush()
+            os.fsync(f.fileno())
+        with open(time_file, "ab") as f:
+            f.write(np.ascontiguousarray(time_ns[first:], dtype="<i8").data)
+
+        logging.info("Stored {} spectra of {}".format(len(time_ns) - first, spectra.pv))
+        return len(time_ns) - first
+
+    def ingest(self, data, freq_resolution: float = 1.0) -> int:
+        """appends fetched FFT data to the store
+
+        Args:
+            data (pd.DataFrame or dict): FFT dataframe from fetch_pv_to_dataframe,
+                or dict of fft_spectra from fetch_fft_spectra
+            freq_resolution (float, optional): frequency bin width in Hz of a
+                dataframe, see vib_archive.fft_resolution. Defaults to 1.
+
+        Returns:
+            int: number of spectra appended
+        """
+
+        if isinstance(data, pd.DataFrame):
+            data = {
+                pv: fft_spectra.from_dataframe(group, freq_resolution=freq_resolution)
+                for pv, group in data.groupby("PV", observed=True, sort=False)
+            }
+
+        return sum(self.append(spectra) for spectra in data.values())
+
+    def open(self, pv: str, time_range: tuple = None) -> fft_spectra:
+        """opens the stored spectra of a PV, or a time range of them, as a
+        read-only view on a memory map. Nothing is read until it is used.
+
+        Args:
+            pv (str): EPICS PV full name
+            time_range (tuple, optional): (start, end) datetimes, end excluded.
+                Defaults to everything stored.
+
+        Raises:
+            KeyError: if the PV is not in the store
+
+        Returns:
+            fft_spectra: the spectra
+        """
+
+        if not os.path.exists(os.path.join(self._dir(pv), "meta.json")):
+            raise KeyError(pv)
+
+        freq = np.asarray(self._meta(pv)["freq"], dtype=np.float64)
+        time = self._time(pv)
+        n = len(time)
+
+        t = slice(0, n)
+        if time_range is not None:
+            t = slice(
+                *np.searchsorted(time, [pd.Timestamp(x).value for x in time_range])
+            )
+
+        if n == 0 or t.start == t.stop:
+            values = np.zeros((0, len(freq)), dtype=np.float32)
+        else:
+            values = np.memmap(
+                os.path.join(self._dir(pv), "values.f32"),
+                dtype="<f4",
+                mode="r",
+                offset=4 * len(freq) * t.start,
+                shape=(t.stop - t.start, len(freq)),
+            )
+
+        return fft_spectra(
+            pd.DatetimeIndex(
+                np.asarray(time[t]).view("datetime64[ns]"),
+                dtype=pd.DatetimeTZDtype("ns", "UTC"),
+            ),
+            values,
+            freq=freq,
+            pv=pv,
+        )
+
+    def to_dataframe(
+        self, pvs: list = None, time_range: tuple = None, derive_vc: bool = False
+    ) -> pd.DataFrame:
+        """exports stored spectra to a fetch_pv_to_dataframe FFT dataframe
+
+        Args:
+            pvs (list, optional): PV full names. Defaults to all of them.
+            time_range (tuple, optional): (start, end) datetimes, end excluded.
+                Defaults to everything stored.
+            derive_vc (bool, optional): also compute VC_Peak and VC_Level from the
+                spectra, see fetch_pv_to_dataframe. Defaults to False.
+
+        Returns:
+            pd.DataFrame: same as vib_archive.fetch_pv_to_dataframe
+        """
+
+        spectra = [self.open(pv, time_range) for pv in pvs or self.pvs]
+
+        return arrays_to_dataframe(
+            "FFT",
+            [s.pv for s in spectra],
+            [s.time.as_unit("ns").asi8.view("datetime64[ns]") for s in spectra],
+            [s.values for s in spectra],
+            fft_freq=spectra[0].freq if derive_vc and spectra else None,
+        )
@@ -0,0 +1,190 @@
+import json
+import re
+import threading
+import time
+from datetime import datetime
+from fnmatch import fnmatchcase
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import matplotlib
+import numpy as np
+import pytest
+
+# plots are rendered off-screen, plt.show() is a no-op
+matplotlib.use("Agg")
+
+
+class FakeAppliance:
+    """Local stand-in for the archiver appliance retrieval service.
+
+    Serves /retrieval/data/getData.json with synthetic data: one sample every
+    `period` seconds for any PV. VC_PEAK PVs return a scalar velocity, FFT PVs a
+    waveform of `fft_length` bins. `delay` slows every response down and
+    `failures` makes the first N requests fail with a 503. The client address of
+    each connection is recorded in `connections`.
+
+    /retrieval/bpl/getMatchingPVs lists the PVs in `archived` matching a glob.
+    PVs in `empty` have no samples at all, like an IOC that was down.
+
+    Post-processed PVs such as mean_600(PV) are binned like the real appliance
+    does for the operators in `postprocessors`, other operators fail with a 400.
+    If `postprocessing` is False, the operator is ignored and raw data is sent.
+    PVs in `missing` are not archived and fail with a 404.
+    """
+
+    def __init__(self, period: float = 1.0, fft_length: int = 16) -> None:
+        self.period = period
+        self.fft_length = fft_length
+        self.delay = 0.0
+        self.failures = 0
+        self.requests = []
+        self.connections = set()
+        self.postprocessors = ("mean", "max", "count")
+        self.postprocessing = True
+        self.missing = set()
+        self.empty = set()
+        self.archived = [
+            "BL20I-DI-ACCEL-{:02}:DATA:CH{:02}:{}".format(id, chan, var)
+            for id in (1, 2)
+            for chan in (1, 2, 3)
+            for var in ("VC_PEAK", "FFT")
+        ]
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def parse_time(s: str) -> float:
+        return datetime.strptime(s + "+0000", "%Y-%m-%dT%H:%M:%SZ%z").timestamp()
+
+    def values(self, pv: str, timestamps: np.ndarray) -> np.ndarray:
+        if pv.endswith(":FFT"):
+            freq = np.arange(self.fft_length)
+            return 1e-7 * (1 + np.sin(timestamps[:, None] / 60 + freq[None, :]) ** 2)
+        return 1e-7 * (1 + np.sin(timestamps / 60) ** 2)
+
+    def events(self, pv: str, start: float, end: float) -> list:
+        first = np.ceil(start / self.period) * self.period
+        timestamps = np.arange(first, end, self.period)
+
+        postprocessor = re.fullmatch(r"(\w+)_(\d+)\((.+)\)", pv)
+        if postprocessor is not None:
+            op, bin_size, pv = postprocessor.groups()
+
+        timestamps = timestamps[: 0 if pv in self.empty else None]
+        values = self.values(pv, timestamps)
+        if postprocessor is not None and self.postprocessing:
+            bin_size = int(bin_size)
+            bins = np.floor(timestamps / bin_size) * bin_size
+            timestamps, index, counts = np.unique(
+                bins, return_index=True, return_counts=True
+            )
+            values = {
+                "mean": np.add.reduceat(values, index, axis=0) / counts,
+                "max": np.maximum.reduceat(values, index, axis=0),
+                "count": counts,
+            }[op]
+        return [
+            {
+                "secs": int(ts),
+                "nanos": int(round((ts - int(ts)) * 1e9)),
+                "val": val.tolist(),
+                "severity": 0,
+            }
+            for ts, val in zip(timestamps, values)
+        ]
+
+    def handle(self, handler: BaseHTTPRequestHandler) -> None:
+        url = urlparse(handler.path)
+        query = parse_qs(url.query)
+
+        with self._lock:
+            self.requests.append(query)
+            self.connections.add(handler.client_address)
+            fail = self.failures > 0
+            self.failures -= 1 if fail else 0
+
+        time.sleep(self.delay)
+
+        if url.path == "/retrieval/bpl/getMatchingPVs" and not fail:
+            glob = query["pv"][0]
+            body = json.dumps([pv for pv in self.archived if fnmatchcase(pv, glob)])
+            self.send(handler, body.encode())
+            return
+
+        if fail or url.path != "/retrieval/data/getData.json":
+            self.send_error(handler, 503 if fail else 404)
+            return
+
+        pv = query["pv"][0]
+        postprocessor = re.fullmatch(r"(\w+)_(\d+)\((.+)\)", pv)
+        raw_pv = pv if postprocessor is None else postprocessor.group(3)
+        if raw_pv in self.missing:
+            self.send_error(handler, 404)
+            return
+        if postprocessor is not None and postprocessor.group(1) not in (
+            self.postprocessors
+        ):
+            self.send_error(handler, 400)
+            return
+
+        start = self.parse_time(query["from"][0])
+        end = self.parse_time(query["to"][0])
+
+        body = json.dumps(
+            [{"meta": {"name": pv}, "data": self.events(pv, start, end)}]
+        ).encode()
+        self.send(handler, body)
+
+    def send_error(self, handler: BaseHTTPRequestHandler, code: int) -> None:
+        handler.send_response(code)
+        handler.send_header("Content-Length", "0")
+        handler.end_headers()
+
+    def send(self, handler: BaseHTTPRequestHandler, body: bytes) -> None:
+        try:
+            handler.send_response(200)
+            handler.send_header("Content-Type", "application/json")
+            handler.send_header("Content-Length", str(len(body)))
+            handler.end_headers()
+            handler.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # client gave up waiting (e.g. timeout tests)
+            pass
+
+
+@pytest.fixture
+def appliance():
+    fake = FakeAppliance()
+
+    class Handler(BaseHTTPRequestHandler):
+        # keeps connections alive, like the real appliance
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            fake.handle(self)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    fake.host, fake.port = server.server_address
+    yield fake
+
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def archive(appliance):
+    from dlsVibrationTools.vib_archive import vib_archive
+
+    return vib_archive(
+        appliance_url=appliance.host,
+        appliance_port=appliance.port,
+        beamline="BL20I",
+        backoff=0.01,
+    )
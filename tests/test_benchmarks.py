@@ -0,0 +1,310 @@
+"""Benchmarks for the data processing paths.
+
+The default sizes run as part of the test suite. Set BENCHMARK_FULL=1 to also run
+the larger sizes, or run this file directly to print a table of timings.
+"""
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from dlsVibrationTools.vc_curves import (
+    vc_get_level,
+    vc_get_level_codes,
+    vc_get_levels,
+    vc_peak_from_fft,
+)
+from dlsVibrationTools.vib_alarms import get_vib_alarms
+from dlsVibrationTools.vib_archive import arrays_to_dataframe
+from dlsVibrationTools.vib_coherence import cross_spectra
+from dlsVibrationTools.vib_events import spectral_event_detector
+from dlsVibrationTools.vib_lod import lod_series
+from dlsVibrationTools.vib_quality import get_sampling_issues
+from dlsVibrationTools.vib_spectra import fft_spectra
+from dlsVibrationTools.vib_stats import vc_stats
+
+FULL = os.environ.get("BENCHMARK_FULL", "0") == "1"
+
+
+def sizes(*full_sizes):
+    return [
+        pytest.param(n, marks=pytest.mark.skipif(not FULL, reason="BENCHMARK_FULL"))
+        for n in full_sizes
+    ]
+
+
+def timed(f, *args):
+    t0 = time.perf_counter()
+    f(*args)
+    return time.perf_counter() - t0
+
+
+def vc_frame(n: int) -> pd.DataFrame:
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame()
+    df["Time"] = pd.date_range("2022-05-04", periods=n, freq="s", tz="UTC")
+    df["VC_Peak"] = 10 ** rng.uniform(-8.5, -4, n)
+    return df
+
+
+def derive_rowwise(df: pd.DataFrame) -> None:
+    dT = df["Time"].shift(-1) - df["Time"]
+    dT.to_frame("dT").apply(lambda x: x["dT"].total_seconds(), axis=1)
+    df.apply(lambda x: vc_get_level(x["VC_Peak"]), axis=1).astype("category")
+
+
+def derive_vectorised(df: pd.DataFrame) -> None:
+    dT = df["Time"].shift(-1) - df["Time"]
+    dT.dt.total_seconds()
+    vc_get_levels(df["VC_Peak"])
+
+
+@pytest.mark.parametrize("n", [10**5] + sizes(10**6, 10**7))
+def test_benchmark_derived_columns(n: int) -> None:
+    df = vc_frame(n)
+
+    t_vectorised = timed(derive_vectorised, df)
+    t_rowwise = timed(derive_rowwise, df)
+
+    print(
+        "{:>9} rows: row-wise {:.3f}s, vectorised {:.4f}s ({:.0f}x)".format(
+            n, t_rowwise, t_vectorised, t_rowwise / t_vectorised
+        )
+    )
+    assert t_vectorised * 10 < t_rowwise
+
+
+@pytest.mark.parametrize("n", [10**6] + sizes(10**8))
+def test_benchmark_vc_level_codes(n: int) -> None:
+    vals = 10 ** np.random.default_rng(0).uniform(-8.5, -4, n)
+
+    t = timed(vc_get_level_codes, vals)
+
+    print("{:>9} samples: VC level codes in {:.3f}s".format(n, t))
+    assert t / n < 20e-9
+
+
+@pytest.mark.parametrize("n", [2000] + sizes(20000))
+def test_benchmark_vc_peak_from_fft(n: int) -> None:
+    freq = np.arange(2048) * 0.25
+    spectra = np.random.default_rng(0).uniform(0, 1e-7, (n, len(freq)))
+    spectra = spectra.astype(np.float32)
+    vc_peak_from_fft(spectra[:1], freq)  # weights are computed once
+
+    t = timed(vc_peak_from_fft, spectra, freq)
+
+    print("{:>9} spectra: VC peak at {:.0f} spectra/s".format(n, n / t))
+    assert n / t > 2000
+
+
+@pytest.mark.parametrize("n", [10**5, 10**6] + sizes(10**7))
+def test_benchmark_lod_view(n: int) -> None:
+    df = vc_frame(n)
+    lod = lod_series(df["Time"], df["VC_Peak"])
+    start, end = lod.time_range
+
+    t = timed(lod.view, start, end, 2000)
+    t_zoom = timed(lod.view, start, start + (end - start) / 100, 2000)
+
+    print(
+        "{:>9} samples: full view {:.2f} ms, zoomed view {:.2f} ms".format(
+            n, 1e3 * t, 1e3 * t_zoom
+        )
+    )
+    # independent of the length of the series
+    assert max(t, t_zoom) < 0.02
+
+
+def peak_memory(f, *args):
+    tracemalloc.start()
+    result = f(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, peak
+
+
+def assemble_concat(pvs, timestamps, values) -> pd.DataFrame:
+    # the per-PV pd.concat accumulation that arrays_to_dataframe replaces
+    df = pd.DataFrame()
+    for pv, ts, v in zip(pvs, timestamps, values):
+        this_pv_df = pd.DataFrame()
+        this_pv_df["Time"] = pd.to_datetime(ts, unit="s", utc=True)
+        this_pv_df["dT"] = this_pv_df["Time"].shift(-1) - this_pv_df["Time"]
+        this_pv_df["dT_Seconds"] = this_pv_df["dT"].dt.total_seconds()
+        this_pv_df["PV"] = pv
+        this_pv_df["VC_Peak"] = v[:, 0]
+        this_pv_df["VC_Level"] = vc_get_levels(this_pv_df["VC_Peak"])
+        df = pd.concat([df, this_pv_df], axis=0).reset_index(drop=True)
+    df["PV"] = df["PV"].astype("category")
+    return df
+
+
+@pytest.mark.parametrize("samples", [20_000] + sizes(86_400))
+def test_benchmark_assembly_memory_64_channels(samples: int) -> None:
+    rng = np.random.default_rng(0)
+    pvs = ["BL20I-DI-ACCEL-01:DATA:CH{:02}:VC_PEAK".format(c) for c in range(64)]
+    timestamps = [1.65e9 + np.arange(samples, dtype=float) for _ in pvs]
+    values = [10 ** rng.uniform(-8.5, -4, (samples, 1)) for _ in pvs]
+
+    df, peak = peak_memory(arrays_to_dataframe, "VC_PEAK", pvs, timestamps, values)
+    t_columnar = timed(arrays_to_dataframe, "VC_PEAK", pvs, timestamps, values)
+    _, peak_concat = peak_memory(assemble_concat, pvs, timestamps, values)
+    t_concat = timed(assemble_concat, pvs, timestamps, values)
+
+    frame_size = df.memory_usage(index=False).sum()
+    print(
+        "64 x {} samples: frame {:.0f} MB, peak columnar {:.0f} MB ({:.3f}s), "
+        "peak concat {:.0f} MB ({:.3f}s)".format(
+            samples,
+            frame_size / 1e6,
+            peak / 1e6,
+            t_columnar,
+            peak_concat / 1e6,
+            t_concat,
+        )
+    )
+    assert peak < 1.5 * frame_size
+    assert peak < peak_concat
+
+
+@pytest.mark.parametrize("n", [10**6] + sizes(10**7))
+def test_benchmark_alarms_64_channels(n: int) -> None:
+    pvs = ["BL20I-DI-ACCEL-01:DATA:CH{:02}:VC_PEAK".format(c) for c in range(64)]
+    per_pv = n // len(pvs)
+    df = vc_frame(per_pv * len(pvs))
+    df["PV"] = pd.Categorical.from_codes(np.repeat(np.arange(64), per_pv), pvs)
+    # quiet floor with ~0.1% of samples above VC-G
+    df["VC_Peak"] = 10 ** np.random.default_rng(0).normal(-7, 0.3, len(df))
+
+    t = timed(get_vib_alarms, df, "G")
+
+    print("{:>9} rows, 64 PVs: alarms in {:.3f}s".format(n, t))
+    assert t < 1.0
+
+
+@pytest.mark.parametrize("n", [10**6] + sizes(10**7))
+def test_benchmark_sampling_issues_64_channels(n: int) -> None:
+    pvs = ["BL20I-DI-ACCEL-01:DATA:CH{:02}:VC_PEAK".format(c) for c in range(64)]
+    per_pv = n // len(pvs)
+    df = vc_frame(per_pv * len(pvs))
+    df["PV"] = pd.Categorical.from_codes(np.repeat(np.arange(64), per_pv), pvs)
+    # dropouts, duplicates and clock jumps
+    rng = np.random.default_rng(0)
+    jumps = np.zeros(len(df))
+    jumps[rng.integers(0, len(df), 1000)] = 10
+    df["Time"] -= pd.to_timedelta(jumps, unit="s")
+    df = df.drop(index=rng.integers(0, len(df), 1000))
+
+    t = timed(get_sampling_issues, df, df["Time"].min(), df["Time"].max())
+
+    print("{:>9} rows, 64 PVs: sampling issues in {:.3f}s".format(n, t))
+    assert t < 2.0
+
+
+@pytest.mark.parametrize("n", [2**20] + sizes(2**23))
+def test_benchmark_coherence_16_channels(n: int) -> None:
+    # 16 accelerometers sampled at 2048 Hz, all 120 pairs
+    data = np.random.default_rng(0).normal(size=(16, n))
+
+    t0 = time.perf_counter()
+    stats = cross_spectra.from_time_series(data, 2048.0, nperseg=2048)
+    stats.to_dataframe()
+    t = time.perf_counter() - t0
+
+    print("{:>9} samples x 16 channels: 120 pairs in {:.3f}s".format(n, t))
+    assert len(stats.pairs) == 120
+    assert t < 10.0
+
+
+@pytest.mark.parametrize("days", [30] + sizes(365))
+def test_benchmark_vc_stats_daily_partials(days: int) -> None:
+    # a day of 64 PVs at one sample per 10s, used as every daily partial
+    pvs = ["BL20I-DI-ACCEL-01:DATA:CH{:02}:VC_PEAK".format(c) for c in range(64)]
+    df = vc_frame(8640 * len(pvs))
+    df["PV"] = pd.Categorical.from_codes(np.repeat(np.arange(64), 8640), pvs)
+    df["Time"] = np.tile(
+        pd.date_range("2022-05-04", periods=8640, freq="10s", tz="UTC"), 64
+    )
+
+    t_update = timed(vc_stats.from_dataframe, df)
+    partials = [vc_stats.from_dataframe(df)] * days
+
+    def query():
+        stats = vc_stats.combine(partials)
+        stats.time_at_level(cumulative=True)
+        stats.exceedance()
+
+    t_query = timed(query)
+
+    print(
+        "{:>4} days x 64 PVs: update {:.3f}s per day, merge and query {:.3f}s".format(
+            days, t_update, t_query
+        )
+    )
+    assert t_query < 2.0
+
+
+@pytest.mark.parametrize("baseline", ["ewma", "median"])
+@pytest.mark.parametrize("channels", [16] + sizes(64))
+def test_benchmark_spectral_events(channels: int, baseline: str) -> None:
+    # 10 minutes of 2048-bin spectra at 1 Hz per channel, fed in 10s chunks as
+    # they would arrive from the IOC
+    rng = np.random.default_rng(0)
+    time = pd.date_range("2022-05-04", periods=600, freq="s", tz="UTC")
+    values = (1e-7 * rng.lognormal(sigma=0.3, size=(600, 2048))).astype(np.float32)
+    spectra = {
+        "CH{:02}:FFT".format(c): fft_spectra(time, values, pv="CH{:02}:FFT".format(c))
+        for c in range(channels)
+    }
+    detector = spectral_event_detector(baseline=baseline)
+
+    def stream():
+        for i in range(0, 600, 10):
+            chunk = (time[i], time[min(i + 10, 599)])
+            detector.update({pv: s.sel(chunk) for pv, s in spectra.items()})
+
+    t = timed(stream)
+
+    print(
+        "{:>3} channels, {} baseline: {:.0f}x real time".format(
+            channels, baseline, 600 / t
+        )
+    )
+    assert 600 / t > 10
+
+
+@pytest.mark.parametrize("option", ["--version", "--help"])
+def test_benchmark_cli_startup(option: str) -> None:
+    # best of 3, so a busy machine does not fail the budget
+    command = [sys.executable, "-m", "dlsVibrationTools", option]
+
+    def run():
+        subprocess.run(command, capture_output=True, check=True)
+
+    t = min(timed(run) for _ in range(3))
+
+    print("vibration-report {}: {:.3f}s".format(option, t))
+    assert t < 0.5
+
+
+if __name__ == "__main__":
+    for n in (10**5, 10**6, 10**7):
+        test_benchmark_derived_columns(n)
+    test_benchmark_vc_level_codes(10**8)
+    test_benchmark_vc_peak_from_fft(20000)
+    for n in (10**5, 10**6, 10**7):
+        test_benchmark_lod_view(n)
+    test_benchmark_assembly_memory_64_channels(86_400)
+    test_benchmark_alarms_64_channels(10**7)
+    test_benchmark_sampling_issues_64_channels(10**7)
+    test_benchmark_coherence_16_channels(2**23)
+    test_benchmark_vc_stats_daily_partials(365)
+    for baseline in ("ewma", "median"):
+        test_benchmark_spectral_events(64, baseline)
+    for option in ("--version", "--help"):
+        test_benchmark_cli_startup(option)
@@ -0,0 +1,188 @@
+import logging
+import os
+import subprocess
+import sys
+import tracemalloc
+
+import pytest
+
+from dlsVibrationTools import __main__, vib_metrics
+
+TIMES = ["--start", "2022-05-04 12:00:00+00:00", "--end", "2022-05-04 12:10:00+00:00"]
+
+
+@pytest.fixture
+def cli(appliance, monkeypatch):
+    # logging.conf.yml writes to logs/ in the working directory
+    monkeypatch.setattr(__main__, "logging_setup", lambda: None)
+
+    def run(*args):
+        __main__.main(
+            ["--appliance", appliance.host, "--port", str(appliance.port)]
+            + TIMES
+            + list(args)
+        )
+
+    return run
+
+
+def test_report_fetches_each_pv_once(cli, appliance, tmp_path) -> None:
+    cli(*"-b BL20I BL20J -c 1 2 --format png html --report".split(), str(tmp_path))
+
+    pvs = sorted(q["pv"][0] for q in appliance.requests)
+    assert len(pvs) == len(set(pvs)) == 2 * 2 * 2
+    assert "BL20J-DI-ACCEL-01:DATA:CH02:FFT" in pvs
+
+    files = os.listdir(tmp_path)
+    assert "index.html" in files
+    assert "BL20J_alarms.csv" in files
+    assert "spectrogram_BL20I-DI-ACCEL-01_DATA_CH01_FFT.png" in files
+
+
+def test_variable_selects_plots(cli, appliance, tmp_path) -> None:
+    cli("--id", "2", "--variable", "VC_PEAK", "--report", str(tmp_path))
+
+    assert [q["pv"][0] for q in appliance.requests] == [
+        "BL20I-DI-ACCEL-02:DATA:CH01:VC_PEAK"
+    ]
+    assert sorted(os.listdir(tmp_path)) == [
+        "BL20I_alarms.csv",
+        "BL20I_alarms.png",
+        "BL20I_histogram.png",
+        "BL20I_quality.csv",
+        "BL20I_quality.png",
+        "BL20I_timeseries.png",
+    ]
+
+
+def test_report_cache(cli, appliance, tmp_path) -> None:
+    cache = str(tmp_path / "cache")
+    cli("--cache", cache, "--report", str(tmp_path / "first"))
+    fetched = len(appliance.requests)
+
+    # the same report again only reads the cache
+    cli("--cache", cache, "--report", str(tmp_path / "second"))
+
+    assert fetched == 2
+    assert len(appliance.requests) == fetched
+    assert sorted(os.listdir(tmp_path / "first")) == sorted(
+        os.listdir(tmp_path / "second")
+    )
+
+
+def test_show_plots(cli, appliance) -> None:
+    cli("-b", "BL20I", "--plot", "timeseries", "alarms", "--threshold", "A")
+
+    assert [q["pv"][0] for q in appliance.requests] == [
+        "BL20I-DI-ACCEL-01:DATA:CH01:VC_PEAK"
+    ]
+
+
+def test_rejects_bad_arguments(cli) -> None:
+    with pytest.raises(SystemExit):
+        cli("--threshold", "Z")
+    with pytest.raises(SystemExit):
+        cli("--start", "2022-05-05 00:00:00+00:00")
+    with pytest.raises(SystemExit):
+        cli("--variable", "FFT", "--plot", "histogram")
+
+
+def test_metrics(cli, tmp_path) -> None:
+    logger = logging.getLogger(vib_metrics.METRICS_LOGGER)
+    try:
+        cli("--metrics", str(tmp_path / "metrics.prom"), "--report", str(tmp_path))
+    finally:
+        logger.handlers.clear()
+        logger.setLevel(logging.NOTSET)
+        tracemalloc.stop()
+        vib_metrics.REGISTRY.reset()
+
+    with open(tmp_path / "metrics.prom") as f:
+        prom = f.read()
+
+    assert 'stage="archiver.request"' in prom
+    # rendered by the report workers
+    assert 'dls_vibration_stage_calls_total{stage="plot.spectrogram"} 1' in prom
+    assert "dls_vibration_stage_peak_memory{" in prom
+
+
+def test_startup_does_not_import_heavy_dependencies() -> None:
+    heavy = ["numpy", "pandas", "matplotlib", "seaborn", "aa", "yaml", "requests"]
+    code = "import sys, dlsVibrationTools.__main__; print(*sys.modules)"
+
+    loaded = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    ).stdout.split()
+
+    assert [m for m in heavy if m in loaded] == []
+
+
+@pytest.fixture
+def root_logger():
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    yield root
+    for handler in root.handlers:
+        if handler not in handlers:
+            handler.close()
+    root.handlers[:] = handlers
+    root.setLevel(level)
+
+
+def test_logging_setup(root_logger, tmp_path, monkeypatch, capsys) -> None:
+    config = tmp_path / "logging.yml"
+    config.write_text(
+        "version: 1\n"
+        "disable_existing_loggers: false\n"
+        "handlers:\n"
+        "  file:\n"
+        "    class: logging.FileHandler\n"
+        "    filename: {}\n"
+        "root:\n"
+        "  handlers: [file]\n"
+        "  level: INFO\n".format(tmp_path / "logs" / "vibration.log")
+    )
+    monkeypatch.setenv("VIBRATION_LOGGING_CONFIG", str(config))
+
+    __main__.logging_setup()
+    logging.info("configured")
+
+    with open(tmp_path / "logs" / "vibration.log") as f:
+        assert f.read() == "configured\n"
+    # the configuration is not printed
+    assert capsys.readouterr().out == ""
+
+
+def test_default_logging_config_disables_metrics(
+    root_logger, tmp_path, monkeypatch
+) -> None:
+    config = os.path.join(os.path.dirname(__file__), "..", "logging.conf.yml")
+    monkeypatch.chdir(tmp_path)
+    loggers = [logging.getLogger(vib_metrics.METRICS_LOGGER)]
+    loggers.append(logging.getLogger(__main__.__name__))
+    try:
+        __main__.logging_setup(config)
+        assert not vib_metrics.metrics_enabled()
+
+        vib_metrics.enable_metrics()
+        assert vib_metrics.metrics_enabled()
+    finally:
+        for logger in loggers:
+            for handler in logger.handlers:
+                handler.close()
+            logger.handlers.clear()
+            logger.setLevel(logging.NOTSET)
+            logger.propagate = True
+
+    assert not tracemalloc.is_tracing()
+    assert not os.path.exists(tmp_path / "logs" / "metrics.jsonl")
+
+
+def test_logging_setup_falls_back(root_logger, tmp_path, caplog) -> None:
+    __main__.logging_setup(str(tmp_path / "missing.yml"))
+
+    broken = tmp_path / "broken.yml"
+    broken.write_text("version: 1\nhandlers:\n  x:\n    class: no.such.Handler\n")
+    __main__.logging_setup(str(broken))
+
+    assert "Could not configure logging" in caplog.text
@@ -0,0 +1,118 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from dlsVibrationTools.vc_curves import (
+    VC_CATEGORIES,
+    VC_UPPER_LIMIT,
+    third_octave_bands,
+    third_octave_weights,
+    vc_band_velocities,
+    vc_count_above,
+    vc_get_level,
+    vc_get_level_codes,
+    vc_get_levels,
+    vc_get_threshold,
+    vc_get_thresholds,
+    vc_level_counts,
+    vc_peak_from_fft,
+    vc_time_at_level,
+)
+
+
+def test_vc_get_levels_matches_vc_get_level() -> None:
+    vals = np.concatenate([VC_UPPER_LIMIT, VC_UPPER_LIMIT * 1.01, [1e-9, 1e-3]])
+
+    levels = vc_get_levels(vals)
+
+    assert list(levels) == [vc_get_level(v) for v in vals]
+    assert list(levels.categories) == VC_CATEGORIES
+    assert levels.ordered
+
+
+def test_vc_get_levels_nan_is_missing() -> None:
+    levels = vc_get_levels([np.nan, 1e-9])
+
+    assert levels.isna().tolist() == [True, False]
+
+
+def test_vc_get_level_codes() -> None:
+    vals = np.array([[1e-9, np.nan], [1e-3, 0.5e-6]])
+
+    codes = vc_get_level_codes(vals)
+
+    assert codes.dtype == np.int8
+    assert codes.tolist() == [[0, -1], [13, VC_CATEGORIES.index("G")]]
+    assert vc_get_level_codes(pd.Series(vals[0])).tolist() == [0, -1]
+
+
+def test_vc_level_counts_and_time_at_level() -> None:
+    vals = [1e-9, 1e-9, 0.5e-6, np.nan, 1e-3]
+
+    counts = vc_level_counts(vals)
+    assert counts["M"] == 2 and counts["G"] == 1 and counts["ISO"] == 1
+    assert counts.sum() == 4
+
+    seconds = vc_time_at_level(vals, [1, 2, 3, 4, np.nan])
+    assert seconds["M"] == 3 and seconds["G"] == 3 and seconds["ISO"] == 0
+
+
+def test_thresholds_for_several_levels() -> None:
+    labels = ["G", "E", "A"]
+    vals = 10 ** np.random.default_rng(0).uniform(-9, -3, 1000)
+
+    thresholds = vc_get_thresholds(labels)
+    assert thresholds.tolist() == [vc_get_threshold(label) for label in labels]
+
+    above = vc_count_above(vals, labels)
+    assert above.tolist() == [np.sum(vals > t) for t in thresholds]
+
+
+def test_vc_get_level_codes_edge_cases() -> None:
+    vals = np.concatenate(
+        [
+            VC_UPPER_LIMIT,
+            np.nextafter(VC_UPPER_LIMIT, 0),
+            np.nextafter(VC_UPPER_LIMIT, 1),
+            [0.0, -0.0, -1.0, np.inf, -np.inf, 1e300, 1e-300],
+            10 ** np.random.default_rng(0).uniform(-9, -3, 10000),
+        ]
+    )
+
+    expected = np.searchsorted(VC_UPPER_LIMIT, vals)
+    np.testing.assert_array_equal(vc_get_level_codes(vals), expected)
+    assert vc_get_level_codes([np.nan, -np.nan]).tolist() == [-1, -1]
+
+
+def test_third_octave_bands() -> None:
+    centre, lower, upper = third_octave_bands()
+
+    assert len(centre) == 20
+    assert centre[0] == pytest.approx(1) and centre[-1] == pytest.approx(79.43, 1e-3)
+    np.testing.assert_allclose(upper / lower, 10**0.1)
+
+
+def test_vc_band_velocities() -> None:
+    freq = np.arange(512) * 0.5
+    spectra = np.zeros((2, 512))
+    spectra[0, freq == 10] = 1e-6  # tone in the 10 Hz band
+    spectra[1] = 1e-7  # flat spectrum
+
+    bands = vc_band_velocities(spectra, freq)
+    centre, lower, upper = third_octave_bands()
+
+    assert bands.shape == (2, 20)
+    assert bands[0, centre == 10] == pytest.approx(1e-6)
+    assert bands[0, centre != 10].max() == 0
+    np.testing.assert_allclose(bands[1], 1e-7 * np.sqrt((upper - lower) / 0.5), 1e-5)
+
+    np.testing.assert_allclose(vc_peak_from_fft(spectra, freq), bands.max(axis=1))
+    accel = vc_peak_from_fft(spectra * 2 * np.pi * 10, freq, "acceleration")
+    assert accel[0] == pytest.approx(1e-6)
+
+
+def test_third_octave_weights_are_cached() -> None:
+    freq = np.arange(1024) * 0.25
+
+    assert third_octave_weights(freq) is third_octave_weights(freq.copy())
+    assert not third_octave_weights(freq).flags.writeable
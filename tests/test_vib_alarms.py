@@ -0,0 +1,140 @@
+from datetime import timedelta
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from dlsVibrationTools.vc_curves import vc_get_threshold
+from dlsVibrationTools.vib_alarms import get_vib_alarms, vc_alarm_detector
+
+G = vc_get_threshold("G")
+
+
+def vc_frame(values: dict) -> pd.DataFrame:
+    frames = [
+        pd.DataFrame(
+            {
+                "Time": pd.date_range("2022-05-04", periods=len(v), freq="s", tz="UTC"),
+                "PV": pv,
+                "VC_Peak": np.asarray(v, dtype=float) * G,
+            }
+        )
+        for pv, v in values.items()
+    ]
+    df = pd.concat(frames, ignore_index=True)
+    df["PV"] = df["PV"].astype("category")
+    return df
+
+
+def test_alarms_per_pv() -> None:
+    df = vc_frame({"A": [0, 2, 3, 0, 0, 1], "B": [5, 5, 0, 0, 0, 0]})
+    before = df.copy()
+
+    alarms = get_vib_alarms(df, "G")
+
+    pd.testing.assert_frame_equal(df, before)
+    assert alarms["PV"].tolist() == ["A", "A", "B"]
+    assert alarms["Samples"].tolist() == [2, 1, 2]
+    assert alarms["Duration"].tolist() == [pd.Timedelta(seconds=s) for s in (1, 0, 1)]
+    np.testing.assert_allclose(alarms["Peak"], np.array([3, 1, 5]) * G)
+    assert alarms["Start"].iloc[1] == df["Time"].iloc[5]
+
+
+def test_alarms_unsorted_input() -> None:
+    df = vc_frame({"A": [0, 2, 3, 0, 0, 1], "B": [5, 5, 0, 0, 0, 0]})
+
+    shuffled = df.sample(frac=1, random_state=0)
+
+    pd.testing.assert_frame_equal(get_vib_alarms(shuffled), get_vib_alarms(df))
+
+
+def test_alarms_hysteresis_and_min_duration() -> None:
+    df = vc_frame({"A": [2, 0.95, 2, 0.5, 2, 0]})
+
+    assert len(get_vib_alarms(df)) == 3
+
+    alarms = get_vib_alarms(df, hysteresis=0.1)
+    assert alarms["Samples"].tolist() == [3, 1]
+
+    alarms = get_vib_alarms(df, hysteresis=0.1, min_duration=timedelta(seconds=1))
+    assert alarms["Samples"].tolist() == [3]
+
+
+def test_alarms_exclusions() -> None:
+    df = vc_frame({"A": [2, 2, 2, 2, 2, 0]})
+
+    alarms = get_vib_alarms(df, exclusions=[(df["Time"].iloc[1], df["Time"].iloc[3])])
+
+    assert alarms["Samples"].tolist() == [1, 2]
+
+
+def test_alarms_end_at_gaps() -> None:
+    df = vc_frame({"A": [2, 2, 2, 2, 2, 0], "B": [2, 2, 2, 2, 2, 2]})
+    # A drops out for an hour in the middle of the alarm
+    df.loc[3:5, "Time"] += pd.Timedelta(hours=1)
+
+    assert get_vib_alarms(df)["Samples"].tolist() == [5, 6]
+
+    alarms = get_vib_alarms(df, max_gap=timedelta(seconds=3))
+    assert alarms["Samples"].tolist() == [3, 2, 6]
+    assert alarms["Duration"].max() == pd.Timedelta(seconds=5)
+
+
+def test_no_alarms() -> None:
+    assert get_vib_alarms(vc_frame({"A": [0, 0]})).empty
+    assert get_vib_alarms(vc_frame({"A": []})).empty
+
+
+@pytest.mark.parametrize(
+    "hysteresis, min_duration, max_gap", [(0, 0, None), (0.2, 3, None), (0.2, 0, 3)]
+)
+def test_detector_matches_batch(
+    hysteresis: float, min_duration: int, max_gap: int
+) -> None:
+    rng = np.random.default_rng(0)
+    df = vc_frame({pv: rng.uniform(0, 2, 500) for pv in "ABC"})
+    # dropouts of a few seconds, some longer than max_gap
+    df["Time"] += pd.to_timedelta(
+        np.cumsum(rng.choice([0, 0, 0, 0, 0, 0, 0, 2, 5], len(df))), unit="s"
+    )
+    kwargs = dict(
+        vc_threshold="G",
+        hysteresis=hysteresis,
+        min_duration=timedelta(seconds=min_duration),
+        max_gap=None if max_gap is None else timedelta(seconds=max_gap),
+    )
+    alarms = get_vib_alarms(df, **kwargs)
+
+    # live data arrives interleaved between PVs, in batches of random size
+    live = df.sort_values("Time", kind="stable")
+    bounds = [0, *np.sort(rng.choice(len(live), 40, replace=False)), len(live)]
+    detector = vc_alarm_detector(**kwargs)
+    events = pd.concat(
+        [detector.update(live.iloc[a:b]) for a, b in zip(bounds[:-1], bounds[1:])]
+        + [detector.flush()]
+    )
+
+    ends = events[events["Event"] == "end"].sort_values(["PV", "Start"])
+    assert len(ends) == len(alarms)
+    assert ends["PV"].tolist() == alarms["PV"].tolist()
+    np.testing.assert_array_equal(ends["Start"], alarms["Start"])
+    np.testing.assert_array_equal(ends["End"], alarms["End"])
+    np.testing.assert_array_equal(ends["Peak"], alarms["Peak"])
+    np.testing.assert_array_equal(ends["Samples"], alarms["Samples"])
+    assert (events["Event"] == "start").sum() == len(alarms)
+
+
+def test_detector_ignores_old_samples() -> None:
+    df = vc_frame({"A": [0, 2, 2, 2]})
+    detector = vc_alarm_detector()
+
+    events = detector.update(df.iloc[:3])
+    assert events["Event"].tolist() == ["start"]
+    assert detector.open_alarms == ["A"]
+
+    # overlapping batch: only the last sample is new
+    assert detector.update(df).empty
+
+    events = detector.update(vc_frame({"A": [2, 2, 2, 2, 0]}).iloc[4:])
+    assert events["Event"].tolist() == ["end"]
+    assert events["Samples"].tolist() == [3]
@@ -0,0 +1,353 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pandas as pd
+import pytest
+import requests
+from aa.data import ArchiveData
+
+from dlsVibrationTools.vc_curves import VC_CATEGORIES
+from dlsVibrationTools.vib_archive import bin_archive_data, canonical_beamline
+from dlsVibrationTools.vib_cache import vib_cache
+from dlsVibrationTools.vib_quality import get_sampling_issues
+
+START = datetime(2022, 5, 4, 12, 0, 0, tzinfo=timezone.utc)
+END = datetime(2022, 5, 4, 12, 1, 0, tzinfo=timezone.utc)
+
+
+def test_fetch_vc_peak_multiple_pvs(archive) -> None:
+    df = archive.fetch_pv_to_dataframe(
+        "VC_PEAK", START, END, channels=[1, 2, 3], ids=[1, 2]
+    )
+
+    assert len(df) == 6 * 60
+    assert list(df["PV"].cat.categories) == sorted(
+        "BL20I-DI-ACCEL-{:02}:DATA:CH{:02}:VC_PEAK".format(id, chan)
+        for id in (1, 2)
+        for chan in (1, 2, 3)
+    )
+    assert df["dT_Seconds"].iloc[0] == pytest.approx(1.0)
+    assert list(df["VC_Level"].cat.categories) == VC_CATEGORIES
+
+
+def test_fetch_pv_without_data(appliance, archive) -> None:
+    empty = "BL20I-DI-ACCEL-01:DATA:CH02:VC_PEAK"
+    appliance.empty = {empty}
+
+    df = archive.fetch_pv_to_dataframe("VC_PEAK", START, END, channels=[1, 2, 3])
+
+    assert len(df) == 2 * 60
+    assert empty in df["PV"].cat.categories
+    assert not (df["PV"] == empty).any()
+    assert df["VC_Peak"].notna().all()
+
+    # still a category, so that it is reported as a gap
+    gaps = get_sampling_issues(df, START, END)
+    assert gaps["PV"].tolist() == [empty]
+
+    chunks = archive.iter_pv_to_dataframe(
+        "VC_PEAK", START, END, channels=[1, 2], chunk=timedelta(seconds=20)
+    )
+    assert sum(len(chunk) for chunk in chunks) == 60
+
+
+def test_fetch_fft_pvs_without_data(appliance, archive) -> None:
+    # the first PV is empty, so the frequency axis comes from the others
+    empty = "BL20I-DI-ACCEL-01:DATA:CH01:FFT"
+    appliance.empty = {empty}
+
+    df = archive.fetch_pv_to_dataframe(
+        "FFT", START, END, channels=[1, 2], derive_vc=True
+    )
+    spectra = archive.fetch_fft_spectra(START, END, channels=[1, 2])
+
+    assert len(df) == 60
+    assert len(df["FFT"].iloc[0]) == appliance.fft_length
+    assert df["VC_Peak"].notna().all()
+    assert spectra[empty].values.shape == (0, appliance.fft_length)
+    np.testing.assert_array_equal(
+        spectra[empty].freq, spectra["BL20I-DI-ACCEL-01:DATA:CH02:FFT"].freq
+    )
+
+    # and without any data at all
+    appliance.empty = {empty, "BL20I-DI-ACCEL-01:DATA:CH02:FFT"}
+    df = archive.fetch_pv_to_dataframe(
+        "FFT", START, END, channels=[1, 2], derive_vc=True
+    )
+    assert df.empty
+    assert {"VC_Peak", "VC_Level"} <= set(df.columns)
+
+
+def test_fetch_is_concurrent(appliance, archive) -> None:
+    appliance.delay = 0.2
+
+    t0 = time.perf_counter()
+    archive.fetch_pv_to_dataframe("VC_PEAK", START, END, channels=list(range(1, 9)))
+
+    assert len(appliance.requests) == 8
+    assert time.perf_counter() - t0 < 8 * 0.2
+
+
+def test_fetch_retries_failed_requests(appliance, archive) -> None:
+    appliance.failures = 2
+
+    df = archive.fetch_pv_to_dataframe("VC_PEAK", START, END, channels=[1])
+
+    assert len(appliance.requests) == 3
+    assert len(df) == 60
+
+
+def test_fetch_gives_up_after_retries(appliance, archive) -> None:
+    appliance.failures = archive.retries + 1
+
+    with pytest.raises(requests.HTTPError):
+        archive.fetch_pv_to_dataframe("VC_PEAK", START, END, channels=[1])
+
+
+def test_client_errors_are_not_retried(appliance, archive) -> None:
+    appliance.missing = {"BL20I-DI-ACCEL-01:DATA:CH01:VC_PEAK"}
+
+    with pytest.raises(requests.HTTPError) as e:
+        archive.fetch_pv_to_dataframe("VC_PEAK", START, END, channels=[1])
+
+    assert e.value.response.status_code == 404
+    assert len(appliance.requests) == 1
+
+
+def test_fetch_times_out(appliance, archive) -> None:
+    appliance.delay = 0.5
+    archive.timeout = 0.1
+    archive.retries = 0
+
+    with pytest.raises(requests.Timeout):
+        archive.fetch_pv_to_dataframe("VC_PEAK", START, END, channels=[1])
+
+
+def test_iter_pv_to_dataframe_matches_single_fetch(appliance, archive) -> None:
+    end = START + timedelta(minutes=10)
+    whole = archive.fetch_pv_to_dataframe("VC_PEAK", START, end, channels=[1, 2])
+
+    chunks = list(
+        archive.iter_pv_to_dataframe(
+            "VC_PEAK", START, end, channels=[1, 2], chunk=timedelta(minutes=3)
+        )
+    )
+
+    assert len(chunks) == 4
+    streamed = pd.concat(chunks).sort_values(["PV", "Time"], kind="stable")
+    np.testing.assert_array_equal(streamed["VC_Peak"], whole["VC_Peak"])
+    np.testing.assert_array_equal(streamed["Time"], whole["Time"])
+
+
+def test_iter_fft_spectra_prefetches(appliance, archive) -> None:
+    chunks = archive.iter_fft_spectra(
+        START, START + timedelta(minutes=10), channels=[1], chunk=timedelta(minutes=1)
+    )
+
+    first = next(chunks)
+    (spectra,) = first.values()
+    assert spectra.values.shape == (60, appliance.fft_length)
+
+    # the next two chunks are already on their way
+    time.sleep(0.2)
+    assert len(appliance.requests) == 3
+
+    chunks.close()
+
+
+def test_pv_catalogue(appliance, archive) -> None:
+    catalogue = archive.pv_catalogue(
+        channels=[1, 2, 3], ids=[1, 2], beamlines=["BL20I", "j20", "i20"]
+    )
+
+    assert list(catalogue.columns) == [
+        "Beamline",
+        "ID",
+        "Channel",
+        "Variable",
+        "PV",
+        "Archived",
+    ]
+    assert len(catalogue) == 2 * 2 * 3 * 2
+    assert list(catalogue["Beamline"].cat.categories) == ["BL20I", "BL20J"]
+    assert catalogue["PV"].iloc[-1] == "BL20J-DI-ACCEL-02:DATA:CH03:FFT"
+
+    archived = catalogue["Beamline"] == "BL20I"
+    assert catalogue["Archived"].tolist() == archived.tolist()
+
+    # one request per beamline, then cached
+    globs = sorted(q["pv"][0] for q in appliance.requests)
+    assert globs == ["BL20I-DI-ACCEL-*:DATA:CH*:*", "BL20J-DI-ACCEL-*:DATA:CH*:*"]
+    archive.pv_catalogue(channels=[4], beamlines=["BL20I"])
+    assert len(appliance.requests) == 2
+
+    appliance.archived.append("BL20I-DI-ACCEL-01:DATA:CH04:FFT")
+    assert "BL20I-DI-ACCEL-01:DATA:CH04:FFT" in archive.archived_pvs(
+        "i20", refresh=True
+    )
+
+
+def test_expand_pv_names_order(archive) -> None:
+    assert archive.expand_pv_names("VC_PEAK", [1, 2], ids=[1, 2]) == [
+        "BL20I-DI-ACCEL-01:DATA:CH01:VC_PEAK",
+        "BL20I-DI-ACCEL-01:DATA:CH02:VC_PEAK",
+        "BL20I-DI-ACCEL-02:DATA:CH01:VC_PEAK",
+        "BL20I-DI-ACCEL-02:DATA:CH02:VC_PEAK",
+    ]
+    with pytest.raises(NotImplementedError):
+        archive.expand_pv_names("RMS", [1])
+
+
+def test_canonical_beamline() -> None:
+    assert canonical_beamline("i20") == "BL20I"
+    assert canonical_beamline("k11") == "BL11K"
+    assert canonical_beamline("BL20J") == "BL20J"
+    with pytest.raises(NotImplementedError):
+        canonical_beamline("b21")
+
+
+def test_fetch_reduced_server_side(appliance, archive) -> None:
+    end = START + timedelta(hours=1)
+    raw = archive.fetch_pv_to_dataframe("VC_PEAK", START, end, channels=[1, 2])
+    df = archive.fetch_pv_to_dataframe(
+        "VC_PEAK", START, end, channels=[1, 2], reduce="max", bin_size=600
+    )
+
+    assert sorted(q["pv"][0] for q in appliance.requests[2:]) == [
+        "max_600(BL20I-DI-ACCEL-01:DATA:CH01:VC_PEAK)",
+        "max_600(BL20I-DI-ACCEL-01:DATA:CH02:VC_PEAK)",
+    ]
+    assert len(df) == 2 * 6
+    assert list(df["PV"].cat.categories) == list(raw["PV"].cat.categories)
+    assert (df["Time"].dt.minute % 10 == 0).all()
+
+    expected = raw.groupby(["PV", raw["Time"].dt.floor("600s")], observed=True)
+    np.testing.assert_allclose(df["VC_Peak"], expected["VC_Peak"].max())
+
+
+def test_fetch_reduced_falls_back_to_client_side(appliance, archive) -> None:
+    end = START + timedelta(hours=1)
+    expected = archive.fetch_pv_to_dataframe(
+        "VC_PEAK", START, end, channels=[1], reduce="mean", bin_size=300
+    )
+
+    appliance.postprocessors = ("max",)
+    n = len(appliance.requests)
+    df = archive.fetch_pv_to_dataframe(
+        "VC_PEAK", START, end, channels=[1], reduce="mean", bin_size=300
+    )
+    pd.testing.assert_frame_equal(df, expected)
+    # the rejected request is not retried
+    assert [q["pv"][0] for q in appliance.requests[n:]] == [
+        "mean_300(BL20I-DI-ACCEL-01:DATA:CH01:VC_PEAK)",
+        "BL20I-DI-ACCEL-01:DATA:CH01:VC_PEAK",
+    ]
+
+    # the appliance is not asked again
+    n = len(appliance.requests)
+    archive.fetch_pv_to_dataframe(
+        "VC_PEAK", START, end, channels=[1], reduce="mean", bin_size=300
+    )
+    assert [q["pv"][0] for q in appliance.requests[n:]] == [
+        "BL20I-DI-ACCEL-01:DATA:CH01:VC_PEAK"
+    ]
+    # other operators still are
+    archive.fetch_pv_to_dataframe(
+        "VC_PEAK", START, end, channels=[1], reduce="max", bin_size=300
+    )
+    assert appliance.requests[-1]["pv"] == [
+        "max_300(BL20I-DI-ACCEL-01:DATA:CH01:VC_PEAK)"
+    ]
+
+
+def test_fetch_reduced_errors_do_not_disable_server_side(appliance, archive) -> None:
+    end = START + timedelta(hours=1)
+    missing = "BL20I-DI-ACCEL-01:DATA:CH02:VC_PEAK"
+    appliance.missing = {missing}
+
+    # a PV that is not archived, and an appliance that is down
+    with pytest.raises(requests.HTTPError):
+        archive.fetch_pv_reduced(missing, START, end, "max", 600)
+    appliance.failures = archive.retries + 1
+    with pytest.raises(requests.HTTPError):
+        archive.fetch_pv_to_dataframe(
+            "VC_PEAK", START, end, channels=[1], reduce="max", bin_size=600
+        )
+
+    df = archive.fetch_pv_to_dataframe(
+        "VC_PEAK", START, end, channels=[1], reduce="max", bin_size=600
+    )
+    assert appliance.requests[-1]["pv"] == [
+        "max_600(BL20I-DI-ACCEL-01:DATA:CH01:VC_PEAK)"
+    ]
+    assert len(df) == 6
+
+
+def test_fetch_reduced_with_cache(appliance, archive, tmp_path) -> None:
+    archive.cache = vib_cache(str(tmp_path))
+    pv = "BL20I-DI-ACCEL-01:DATA:CH01:VC_PEAK"
+
+    # the 12:00 bin is only partly in the first range
+    archive.fetch_pv_reduced(pv, START, START + timedelta(minutes=5), "count", 600)
+    data = archive.fetch_pv_reduced(pv, START, START + timedelta(hours=1), "count", 600)
+
+    assert data.values.ravel().tolist() == [600] * 6
+    assert archive.cache.intervals("count_600({})".format(pv)) == []
+
+    # client-side binning of cached raw data
+    appliance.postprocessors = ()
+    archive.fetch_pv(pv, START, START + timedelta(minutes=5))
+    data = archive.fetch_pv_reduced(pv, START, START + timedelta(hours=1), "count", 600)
+    assert data.values.ravel().tolist() == [600] * 6
+
+
+def test_fetch_reduced_ignored_by_the_appliance(appliance, archive) -> None:
+    # one raw sample per bin, but not at the start of the bins
+    appliance.period = 700
+    appliance.postprocessing = False
+    end = START + timedelta(hours=2)
+
+    df = archive.fetch_pv_to_dataframe(
+        "VC_PEAK", START, end, channels=[1], reduce="count", bin_size=600
+    )
+
+    assert (df["VC_Peak"] == 1).all()
+    assert (df["Time"].dt.minute % 10 == 0).all()
+    # not a velocity
+    assert "VC_Level" not in df
+
+
+def test_auto_bin_size(archive) -> None:
+    assert archive.auto_bin_size(START, START + timedelta(days=1), 2000) == 60
+    assert archive.auto_bin_size(START, START + timedelta(hours=1), 2000) == 5
+    assert archive.auto_bin_size(START, START + timedelta(days=365), 2000) == 21600
+    assert archive.auto_bin_size(START, START + timedelta(days=365), 100) == 4 * 86400
+
+    df = archive.fetch_pv_to_dataframe(
+        "VC_PEAK", START, START + timedelta(hours=2), channels=[1], reduce="count"
+    )
+    assert len(df) <= 2000
+    assert df["VC_Peak"].sum() == 2 * 3600
+
+
+def test_bin_archive_data() -> None:
+    severities = np.array([0, 0, 1, 0, 0, 2, 0, 0, 0, 0])
+    data = ArchiveData("PV", np.arange(10.0), 95.0 + np.arange(10) * 2, severities)
+
+    # bins [90, 100), [100, 110) and [110, 120)
+    for reduce, expected in [
+        ("mean", [1.0, 5.0, 8.5]),
+        ("min", [0, 3, 8]),
+        ("max", [2, 7, 9]),
+        ("count", [3, 5, 2]),
+        ("firstSample", [0, 3, 8]),
+        ("lastSample", [2, 7, 9]),
+    ]:
+        reduced = bin_archive_data(data, reduce, 10)
+        np.testing.assert_allclose(reduced.values.ravel(), expected)
+        np.testing.assert_allclose(reduced.timestamps, [90, 100, 110])
+        np.testing.assert_array_equal(reduced.severities, [1, 2, 0])
+
+    with pytest.raises(ValueError):
+        bin_archive_data(data, "median", 10)
@@ -0,0 +1,144 @@
+import asyncio
+import threading
+import time
+from datetime import datetime, timezone
+
+import aiohttp
+import pandas as pd
+import pytest
+
+from dlsVibrationTools import vib_async
+from dlsVibrationTools.vib_async import vib_archive_async
+
+START = datetime(2022, 5, 4, 12, 0, 0, tzinfo=timezone.utc)
+END = datetime(2022, 5, 4, 12, 1, 0, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def client(appliance):
+    return vib_archive_async(
+        appliance_url=appliance.host,
+        appliance_port=appliance.port,
+        beamline="BL20I",
+        backoff=0.01,
+    )
+
+
+async def fetch(client, *args, **kwargs):
+    async with client:
+        return await client.fetch_pv_to_dataframe(*args, **kwargs)
+
+
+@pytest.mark.parametrize("pv_name", ["VC_PEAK", "FFT"])
+def test_matches_sync_archive(client, archive, pv_name: str) -> None:
+    df = asyncio.run(fetch(client, pv_name, START, END, [1, 2], ids=[1, 2]))
+    expected = archive.fetch_pv_to_dataframe(pv_name, START, END, [1, 2], ids=[1, 2])
+
+    if pv_name == "FFT":
+        df["FFT"] = df["FFT"].map(list)
+        expected["FFT"] = expected["FFT"].map(list)
+    pd.testing.assert_frame_equal(df, expected)
+
+
+@pytest.mark.parametrize("pv_name", ["VC_PEAK", "FFT"])
+def test_pv_without_data(appliance, client, archive, pv_name: str) -> None:
+    appliance.empty = {"BL20I-DI-ACCEL-01:DATA:CH01:" + pv_name}
+
+    df = asyncio.run(fetch(client, pv_name, START, END, [1, 2]))
+    expected = archive.fetch_pv_to_dataframe(pv_name, START, END, [1, 2])
+
+    assert len(df) == len(expected) == 60
+    pd.testing.assert_series_equal(df["Time"], expected["Time"])
+
+
+def test_responses_are_decoded_off_the_loop(client, monkeypatch) -> None:
+    threads = []
+    parse_body = vib_async._parse_body
+
+    def recording(pv, body):
+        threads.append(threading.current_thread())
+        return parse_body(pv, body)
+
+    monkeypatch.setattr(vib_async, "_parse_body", recording)
+    asyncio.run(fetch(client, "FFT", START, END, [1, 2]))
+
+    assert len(threads) == 2
+    assert threading.main_thread() not in threads
+
+
+def test_fft_spectra(client, archive) -> None:
+    async def run():
+        async with client:
+            return await client.fetch_fft_spectra(START, END, [1])
+
+    (s,) = asyncio.run(run()).values()
+    (expected,) = archive.fetch_fft_spectra(START, END, [1]).values()
+
+    assert (s.values == expected.values).all()
+
+
+def test_connections_are_reused(appliance, client) -> None:
+    async def run():
+        async with client:
+            for _ in range(5):
+                await client.fetch_pv_to_dataframe("VC_PEAK", START, END, [1, 2, 3])
+
+    asyncio.run(run())
+
+    assert len(appliance.requests) == 15
+    assert len(appliance.connections) <= 3
+
+
+@pytest.mark.parametrize("max_concurrency", [2, 8])
+def test_concurrency_limit(appliance, client, max_concurrency: int) -> None:
+    appliance.delay = 0.2
+    client.max_concurrency = max_concurrency
+
+    t0 = time.perf_counter()
+    asyncio.run(fetch(client, "VC_PEAK", START, END, channels=list(range(1, 9))))
+    elapsed = time.perf_counter() - t0
+
+    assert elapsed >= 0.2 * 8 / max_concurrency
+    assert elapsed < 0.2 * 8 / max_concurrency + 0.5
+
+
+def test_retries_and_timeout(appliance, client) -> None:
+    appliance.failures = 2
+    df = asyncio.run(fetch(client, "VC_PEAK", START, END, [1]))
+    assert len(df) == 60
+
+    appliance.delay = 1.0
+    client.timeout = 0.1
+    client.retries = 1
+    with pytest.raises(asyncio.TimeoutError):
+        asyncio.run(fetch(client, "VC_PEAK", START, END, [1]))
+
+
+def test_client_errors_are_not_retried(appliance, client) -> None:
+    appliance.missing = {"BL20I-DI-ACCEL-01:DATA:CH01:VC_PEAK"}
+
+    with pytest.raises(aiohttp.ClientResponseError) as e:
+        asyncio.run(fetch(client, "VC_PEAK", START, END, [1]))
+
+    assert e.value.status == 404
+    assert len(appliance.requests) == 1
+
+
+def test_cancellation(appliance, client) -> None:
+    appliance.delay = 0.5
+
+    async def run():
+        async with client:
+            task = asyncio.ensure_future(
+                client.fetch_pv_to_dataframe("VC_PEAK", START, END, [1, 2])
+            )
+            await asyncio.sleep(0.1)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+            # the client is still usable
+            appliance.delay = 0
+            return await client.fetch_pv_to_dataframe("VC_PEAK", START, END, [1])
+
+    assert len(asyncio.run(run())) == 60
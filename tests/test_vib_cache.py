@@ -0,0 +1,141 @@
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+
+from dlsVibrationTools.vib_cache import merge_intervals, subtract_intervals, vib_cache
+
+START = datetime(2022, 5, 4, 23, 0, 0, tzinfo=timezone.utc)
+END = datetime(2022, 5, 5, 1, 0, 0, tzinfo=timezone.utc)
+
+
+def test_interval_arithmetic() -> None:
+    assert merge_intervals([[5, 6], [0, 2], [1, 3]]) == [[0, 3], [5, 6]]
+    assert subtract_intervals(0, 10, [[2, 3], [5, 6]]) == [[0, 2], [3, 5], [6, 10]]
+    assert subtract_intervals(2, 3, [[0, 10]]) == []
+
+
+def test_cache_fetches_only_missing_intervals(appliance, archive, tmp_path) -> None:
+    archive.cache = vib_cache(str(tmp_path))
+
+    first = archive.fetch_pv_to_dataframe(
+        "VC_PEAK", START, START + timedelta(hours=1), channels=[1]
+    )
+    assert len(appliance.requests) == 1
+
+    # only the second hour is fetched
+    df = archive.fetch_pv_to_dataframe("VC_PEAK", START, END, channels=[1])
+    assert len(appliance.requests) == 2
+    assert appliance.requests[1]["from"] == ["2022-05-05T00:00:00Z"]
+    assert len(df) == 2 * 3600
+    assert df["Time"].is_monotonic_increasing
+    assert not df["Time"].duplicated().any()
+    np.testing.assert_array_equal(df["VC_Peak"][: len(first)], first["VC_Peak"])
+
+    # everything is cached now, also for a new cache on the same directory
+    archive.cache = vib_cache(str(tmp_path))
+    again = archive.fetch_pv_to_dataframe("VC_PEAK", START, END, channels=[1])
+    assert len(appliance.requests) == 2
+    np.testing.assert_array_equal(again["VC_Peak"], df["VC_Peak"])
+
+
+def test_cache_evicts_least_recently_used(archive, tmp_path) -> None:
+    cache = vib_cache(str(tmp_path))
+    archive.cache = cache
+
+    archive.fetch_pv_to_dataframe("VC_PEAK", START, END, channels=[1])
+    archive.fetch_pv_to_dataframe("VC_PEAK", START, END, channels=[2])
+    pv1, pv2, pv3 = archive.build_pv_names("BL20I", "VC_PEAK", channels=[1, 2, 3])
+
+    # channel 1 is the least recently used, it makes room for channel 3
+    cache.max_bytes = cache.nbytes + 1000
+    archive.fetch_pv_to_dataframe("VC_PEAK", START, END, channels=[3])
+
+    assert cache.nbytes <= cache.max_bytes
+    assert cache.intervals(pv1) == []
+    assert cache.intervals(pv2) == [[START.timestamp(), END.timestamp()]]
+    assert cache.intervals(pv3) == [[START.timestamp(), END.timestamp()]]
+
+
+def test_overwritten_partition_is_no_longer_cached(tmp_path) -> None:
+    cache = vib_cache(str(tmp_path))
+    t0 = START.timestamp()
+    ts = t0 + np.arange(600.0)
+
+    cache.store("PV", t0, t0 + 600, ts, np.ones((600, 16)), np.zeros(600))
+    # the FFT length changed, the day is rewritten with the new data only
+    ts = t0 + 1200 + np.arange(600.0)
+    cache.store("PV", t0 + 1200, t0 + 1800, ts, np.ones((600, 8)), np.zeros(600))
+
+    assert cache.intervals("PV") == [[t0 + 1200, t0 + 1800]]
+    assert cache.missing_intervals("PV", t0, t0 + 1800) == [[t0, t0 + 1200]]
+    timestamps, values, _ = cache.load("PV", t0, t0 + 1800)
+    assert values.shape == (600, 8)
+
+
+def test_load_partitions_of_different_widths(tmp_path) -> None:
+    cache = vib_cache(str(tmp_path))
+    t0, t1 = START.timestamp(), END.timestamp()
+    ts = np.linspace(t0, t1, 10, endpoint=False)
+
+    # the FFT length changed at midnight, each day keeps its own data
+    cache.store("PV", t0, t0 + 3600, ts[:5], np.ones((5, 16)), np.zeros(5))
+    cache.store("PV", t0 + 3600, t1, ts[5:], np.ones((5, 8)), np.zeros(5))
+    assert cache.load("PV", t0 + 3600, t1)[1].shape == (5, 8)
+
+    with pytest.raises(ValueError, match="clear.*'PV'"):
+        cache.load("PV", t0, t1)
+
+    cache.clear("PV")
+    assert cache.intervals("PV") == []
+    assert cache.nbytes == 0
+    assert cache.load("PV", t0, t1)[0].size == 0
+
+
+def test_load_does_not_write_the_index(tmp_path) -> None:
+    cache = vib_cache(str(tmp_path))
+    t0 = START.timestamp()
+    cache.store("PV", t0, t0 + 60, t0 + np.arange(60.0), np.ones(60), np.zeros(60))
+    with open(tmp_path / "index.json") as f:
+        stored = f.read()
+
+    for _ in range(3):
+        cache.load("PV", t0, t0 + 60)
+
+    with open(tmp_path / "index.json") as f:
+        assert f.read() == stored
+
+    # the last use is saved on flush
+    (partition,) = json.loads(stored)["partitions"]
+    cache.flush()
+    with open(tmp_path / "index.json") as f:
+        index = json.load(f)
+    stored = json.loads(stored)
+    assert (
+        index["partitions"][partition]["last_used"]
+        > stored["partitions"][partition]["last_used"]
+    )
+
+
+def _store_pvs(path: str, pvs: list) -> None:
+    # one cache per process, as in separate report runs
+    cache = vib_cache(path)
+    t0 = START.timestamp()
+    for pv in pvs:
+        cache.store(pv, t0, t0 + 60, t0 + np.arange(60.0), np.ones(60), np.zeros(60))
+
+
+def test_concurrent_processes_keep_every_entry(tmp_path) -> None:
+    pvs = ["PV{}".format(i) for i in range(40)]
+
+    with ProcessPoolExecutor(4) as pool:
+        list(pool.map(_store_pvs, [str(tmp_path)] * 4, [pvs[i::4] for i in range(4)]))
+
+    cache = vib_cache(str(tmp_path))
+    t0 = START.timestamp()
+    assert all(cache.intervals(pv) == [[t0, t0 + 60]] for pv in pvs)
+    assert len(cache._index["partitions"]) == len(pvs)
+    assert not [f for f in os.listdir(tmp_path) if f.endswith(".tmp")]
@@ -0,0 +1,135 @@
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from dlsVibrationTools.vib_coherence import cross_spectra, welch_segments
+from dlsVibrationTools.vib_spectra import fft_spectra
+
+START = datetime(2022, 5, 4, 12, 0, 0, tzinfo=timezone.utc)
+END = datetime(2022, 5, 4, 12, 10, 0, tzinfo=timezone.utc)
+
+FS = 1024.0
+
+
+def floor_and_table(n: int = 2**16, seed: int = 0) -> np.ndarray:
+    # table moving twice as much as the floor, 4 samples later, plus independent
+    # sensor noise
+    rng = np.random.default_rng(seed)
+    floor = rng.normal(size=n + 4)
+    table = 2 * floor[:-4]
+    return np.stack(
+        [
+            floor[4:] + 0.01 * rng.normal(size=n),
+            table + 0.01 * rng.normal(size=n),
+            rng.normal(size=n),
+        ]
+    )
+
+
+def test_welch_psd() -> None:
+    rng = np.random.default_rng(0)
+    freq, spectra, scale = welch_segments(rng.normal(size=(1, 2**16)), FS, 256)
+
+    assert spectra.shape == (1, 511, 129)
+    assert freq[1] == FS / 256
+    # white noise of unit variance has a one-sided PSD of 2 / fs
+    psd = scale * np.mean(np.abs(spectra[0]) ** 2, axis=0)
+    assert np.mean(psd[1:-1]) == pytest.approx(2 / FS, rel=0.02)
+
+
+def test_transfer_function() -> None:
+    stats = cross_spectra.from_time_series(
+        floor_and_table(), FS, ["floor", "table", "other"], nperseg=256
+    )
+
+    assert stats.pairs == [("floor", "table"), ("floor", "other"), ("table", "other")]
+    coherence = stats.coherence()
+    assert coherence.shape == (3, 129)
+    assert np.all(coherence[0, 1:-1] > 0.99)
+    assert np.all(coherence[1:, 1:-1].mean(axis=1) < 0.05)
+
+    np.testing.assert_allclose(stats.transmissibility()[0, 1:-1], 2, rtol=0.01)
+    # a delay of 4 samples
+    phase = np.angle(stats.transfer_function()[0, 1:20])
+    np.testing.assert_allclose(phase, -2 * np.pi * stats.freq[1:20] * 4 / FS, atol=0.02)
+
+    df = stats.to_dataframe()
+    assert list(df.columns) == [
+        "Input",
+        "Output",
+        "Frequency",
+        "Coherence",
+        "Transmissibility",
+        "Phase",
+    ]
+    assert len(df) == 3 * 129
+    assert df["Phase"].iloc[1] == pytest.approx(np.degrees(phase[0]), abs=1e-9)
+
+
+def test_merge_and_threads() -> None:
+    data = floor_and_table(2**14)
+    whole = cross_spectra.from_time_series(data, FS, nperseg=256, overlap=0)
+    first = cross_spectra.from_time_series(
+        data[:, : 2**13], FS, nperseg=256, overlap=0
+    )
+    second = cross_spectra.from_time_series(
+        data[:, 2**13 :], FS, nperseg=256, overlap=0, max_workers=1
+    )
+
+    merged = first.merge(second)
+
+    assert merged.count == whole.count == 64
+    np.testing.assert_allclose(merged.coherence(), whole.coherence())
+    np.testing.assert_allclose(merged.auto_spectra(), whole.auto_spectra())
+    with pytest.raises(ValueError):
+        merged.merge(cross_spectra([0, 1], whole.freq, phase=True))
+
+
+def test_all_pairs() -> None:
+    n = 16
+    rng = np.random.default_rng(0)
+    stats = cross_spectra.from_time_series(
+        rng.normal(size=(n, 2**14)), FS, nperseg=256
+    )
+
+    assert len(stats.pairs) == n * (n - 1) // 2 == 120
+    assert stats.coherence().shape == (120, 129)
+    # pair products agree with a direct calculation
+    _, spectra, _ = welch_segments(rng.normal(size=(2, 2**12)), FS, 256)
+    pair = cross_spectra([0, 1], np.zeros(129), phase=True).update(spectra)
+    gxy = np.mean(spectra[0].conj() * spectra[1], axis=0)
+    np.testing.assert_allclose(pair.cross_spectra()[0], gxy)
+
+
+def test_amplitude_spectra() -> None:
+    time = pd.date_range(START, periods=1000, freq="s")
+    rng = np.random.default_rng(0)
+    ground = rng.lognormal(size=(1000, 8))
+    spectra = {
+        "CH01:FFT": fft_spectra(time, ground, pv="CH01:FFT"),
+        # every other sample, responding with twice the amplitude
+        "CH02:FFT": fft_spectra(time[::2], 2 * ground[::2], pv="CH02:FFT"),
+        "CH03:FFT": fft_spectra(time[::-1], rng.lognormal(size=(1000, 8)), pv="CH03"),
+    }
+
+    stats = cross_spectra.from_spectra(spectra, chunk_size=128)
+
+    assert stats.count == 500
+    np.testing.assert_allclose(stats.coherence()[0], 1)
+    np.testing.assert_allclose(stats.transmissibility()[0], 2)
+    assert np.all(stats.coherence()[1:] < 0.05)
+    assert stats.to_dataframe()["Phase"].isna().all()
+    with pytest.raises(ValueError):
+        stats.transfer_function()
+
+
+def test_archive_spectra(archive) -> None:
+    spectra = archive.fetch_fft_spectra(START, END, channels=[1, 2])
+
+    stats = cross_spectra.from_spectra(spectra, tolerance=pd.Timedelta("1s"))
+
+    assert stats.channels == list(spectra)
+    assert stats.count == 600
+    assert stats.coherence().shape == (1, len(stats.freq))
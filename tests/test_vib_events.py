@@ -0,0 +1,119 @@
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from dlsVibrationTools.vib_events import (
+    EVENT_COLUMNS,
+    get_spectral_events,
+    spectral_event_detector,
+)
+from dlsVibrationTools.vib_spectra import fft_spectra
+
+START = datetime(2022, 5, 4, 12, 0, 0, tzinfo=timezone.utc)
+END = datetime(2022, 5, 4, 12, 10, 0, tzinfo=timezone.utc)
+
+
+def spectrogram(n: int = 2000, pv: str = "CH01:FFT", seed: int = 0) -> fft_spectra:
+    # log-normal background with two transients:
+    # a pump at 40-43 Hz from 500s to 560s and a knock at 200-300 Hz at 1200s
+    rng = np.random.default_rng(seed)
+    freq = np.arange(400.0)
+    values = 1e-7 * rng.lognormal(sigma=0.2, size=(n, len(freq)))
+    values[500:561, 40:44] *= 50
+    values[1200:1202, 200:301] *= 100
+    time = pd.date_range(START, periods=n, freq="s")
+    return fft_spectra(time, values.astype(np.float32), freq=freq, pv=pv)
+
+
+@pytest.mark.parametrize("baseline", ["ewma", "median"])
+def test_finds_transients(baseline: str) -> None:
+    events = get_spectral_events(spectrogram(), baseline=baseline)
+
+    assert list(events.columns) == EVENT_COLUMNS
+    assert len(events) == 2
+    pump, knock = events.itertuples()
+    assert pump.PV == "CH01:FFT"
+    assert (pump.Start - START).total_seconds() == 500
+    assert pump.Duration == pd.Timedelta("60s")
+    assert (pump.Low_Freq, pump.High_Freq) == (40, 43)
+    assert pump.Cells == 61 * 4
+    assert 40 <= pump.Peak_Freq <= 43
+    assert pump.Peak > 50 * 1e-7
+    assert (knock.Low_Freq, knock.High_Freq) == (200, 300)
+    assert knock.Duration == pd.Timedelta("1s")
+    assert knock.Energy > pump.Energy / 61
+
+
+def test_event_times_keep_nanoseconds() -> None:
+    s = spectrogram()
+    s = fft_spectra(s.time + pd.Timedelta(1, unit="ns"), s.values, freq=s.freq)
+
+    pump, knock = get_spectral_events(s).itertuples()
+    assert pump.Start == s.time[500]
+    assert pump.End == s.time[560]
+    assert knock.Start == s.time[1200]
+
+
+def test_streaming_matches_batch() -> None:
+    s = spectrogram()
+    batch = get_spectral_events(s)
+
+    detector = spectral_event_detector()
+    chunks = [
+        detector.update(s.sel((a, b))) for a, b in zip(s.time[::97], s.time[97::97])
+    ]
+    chunks.append(detector.update(s.sel((s.time[len(s) // 97 * 97], None))))
+    # already processed
+    chunks.append(detector.update(s.sel((s.time[0], s.time[100]))))
+    chunks.append(detector.flush())
+    streamed = pd.concat(chunks, ignore_index=True)
+
+    pd.testing.assert_frame_equal(streamed, batch)
+    assert detector.open_events == {}
+
+
+def test_events_do_not_become_baseline() -> None:
+    s = spectrogram()
+    detector = spectral_event_detector(baseline="ewma", alpha=0.05)
+    detector.update(s.sel((s.time[0], s.time[550])))
+
+    # the pump has been on for 50 spectra
+    assert detector.open_events == {"CH01:FFT": 1}
+    np.testing.assert_allclose(detector.baseline_of("CH01:FFT")[40:44], 1e-7, rtol=0.2)
+
+
+def test_several_channels() -> None:
+    spectra = {
+        "CH01:FFT": spectrogram(),
+        "CH02:FFT": spectrogram(pv="CH02:FFT", seed=1),
+    }
+    quiet = spectrogram(pv="CH03:FFT", seed=2)
+    quiet.values[:] = quiet.values[0]
+    spectra["CH03:FFT"] = quiet
+
+    events = get_spectral_events(spectra)
+
+    assert events["PV"].tolist() == ["CH01:FFT", "CH02:FFT"] * 2
+    with pytest.raises(ValueError):
+        spectral_event_detector(baseline="mean")
+
+
+def test_archive_spectra(archive) -> None:
+    spectra = archive.fetch_fft_spectra(START, END, [1, 2])
+    batch = get_spectral_events(spectra, warmup=10)
+
+    detector = spectral_event_detector(warmup=10)
+    streamed = [
+        detector.update(chunk)
+        for chunk in archive.iter_fft_spectra(
+            START, END, [1, 2], chunk=(END - START) / 5
+        )
+    ]
+    streamed = pd.concat(streamed + [detector.flush()], ignore_index=True)
+
+    pd.testing.assert_frame_equal(
+        streamed.sort_values(["Start", "PV"], ignore_index=True), batch
+    )
+    assert set(detector.open_events) <= set(spectra)
@@ -0,0 +1,141 @@
+import numpy as np
+import pandas as pd
+import pytest
+from matplotlib import pyplot as plt
+
+from dlsVibrationTools.vib_lod import lod_series, lod_spectrogram
+from dlsVibrationTools.vib_plots import plot_spectrogram, plot_vc_timeseries
+from dlsVibrationTools.vib_spectra import fft_spectra
+
+
+def series(n: int):
+    time = pd.date_range("2022-05-04", periods=n, freq="s", tz="UTC")
+    values = 10 ** np.random.default_rng(0).uniform(-8, -6, n)
+    return time, values
+
+
+def reference(time, values, start, end, n):
+    # brute force min/max/mean of the samples in n equal-width buckets, which
+    # match the pyramid buckets exactly when n divides the number of samples
+    edges = np.linspace(start.value, end.value, n + 1)
+    bucket = np.searchsorted(edges, time.as_unit("ns").asi8, side="right") - 1
+    inside = (bucket >= 0) & (bucket < n)
+    df = pd.Series(values[inside]).groupby(bucket[inside])
+    return df.min().to_numpy(), df.max().to_numpy(), df.mean().to_numpy()
+
+
+@pytest.mark.parametrize("n", [500, 102_400])
+def test_lod_series_view_matches_raw_data(n: int) -> None:
+    time, values = series(n)
+    lod = lod_series(time, values)
+    start, end = time[0], time[-1] + pd.Timedelta(1, "s")
+
+    t, vmin, vmax, vmean = lod.view(start, end, 100)
+    expected = reference(time, values, start, end, 100)
+
+    assert len(t) == 100
+    np.testing.assert_allclose(vmin, expected[0])
+    np.testing.assert_allclose(vmax, expected[1])
+    np.testing.assert_allclose(vmean, expected[2])
+
+
+def test_lod_series_uses_coarse_levels() -> None:
+    time, values = series(100_000)
+    lod = lod_series(time, values)
+
+    assert len(lod.levels) > 3
+    assert len(lod.levels[-1][0]) <= 4 * 256
+    assert lod.levels[-1][4].sum() == len(values)
+
+    # zooming in to fewer samples than pixels returns the samples themselves
+    t, vmin, vmax, vmean = lod.view(time[1000], time[1050], 200)
+    np.testing.assert_array_equal(vmin, values[1000:1050])
+    np.testing.assert_array_equal(vmean, values[1000:1050])
+
+
+def test_lod_series_gaps_and_nan() -> None:
+    time, values = series(1000)
+    values[10:20] = np.nan
+    keep = np.r_[0:400, 600:1000]
+    lod = lod_series(time[keep], values[keep], min_buckets=4)
+
+    t, vmin, vmax, vmean = lod.view(time[0], time[-1], 10)
+
+    assert len(t) == 8  # buckets in the gap are dropped
+    assert np.all(np.isfinite(vmean))
+    assert vmin[0] == np.nanmin(values[:100])
+
+
+def dropout():
+    # a 14h dropout that does not start on a bucket edge of any level, followed
+    # by a 10s spike
+    before = pd.date_range("2022-05-04 03:00", periods=2603, freq="s", tz="UTC")
+    after = pd.date_range("2022-05-04 17:40", periods=2000, freq="s", tz="UTC")
+    values = np.full(len(before) + len(after), 1e-8)
+    values[len(before) : len(before) + 10] = 1e-6
+    return before.append(after), values, after[0]
+
+
+def test_lod_series_gap_between_buckets() -> None:
+    time, values, spike = dropout()
+    lod = lod_series(time, values, min_buckets=4)
+
+    t, vmin, vmax, vmean = lod.view(time[0], time[-1], 50)
+
+    width = (time[-1] - time[0]) / 50
+    assert abs(pd.Timestamp(t[np.argmax(vmax)], tz="UTC") - spike) <= width
+    assert len(lod.levels) > 2
+
+
+def test_lod_spectrogram_view() -> None:
+    time = pd.date_range("2022-05-04", periods=4096, freq="s", tz="UTC")
+    values = np.random.default_rng(0).uniform(1e-8, 1e-6, (4096, 64))
+    lod = lod_spectrogram(fft_spectra(time, values, pv="CH01:FFT"))
+
+    binned = lod.view(width=64, height=16)
+
+    assert binned.values.shape == (64, 16)
+    expected = values.reshape(64, 64, 16, 4).mean(axis=(1, 3))
+    np.testing.assert_allclose(binned.values, expected, rtol=1e-5)
+    np.testing.assert_allclose(binned.freq, np.arange(1.5, 64, 4))
+
+    zoom = lod.view((time[100], time[110]), (8, 16), width=64, height=16)
+    np.testing.assert_allclose(zoom.values, values[100:110, 8:16], rtol=1e-6)
+
+
+def test_lod_spectrogram_gap_between_buckets() -> None:
+    time, values, spike = dropout()
+    lod = lod_spectrogram(
+        fft_spectra(time, np.tile(values[:, None], 8), pv="CH01:FFT"), min_buckets=4
+    )
+
+    binned = lod.view(width=50, height=8)
+
+    width = (time[-1] - time[0]) / 50
+    assert abs(binned.time[np.argmax(binned.values[:, 0])] - spike) <= width
+    assert len(lod.levels) > 2
+
+
+def test_plots_rebin_on_zoom() -> None:
+    time, values = series(100_000)
+    df = pd.DataFrame({"Time": time, "PV": pd.Categorical(["CH1"] * len(time))})
+    df["VC_Peak"] = values
+
+    plot_vc_timeseries(df)
+    ax = plt.gcf().axes[0]
+    (line,) = ax.get_lines()[:1]
+    assert len(line.get_xdata()) <= ax.bbox.width
+
+    ax.set_xlim(time[0], time[100])
+    assert len(line.get_xdata()) == 100
+
+    s = fft_spectra(time[:5000], np.ones((5000, 512)))
+    plot_spectrogram(s, freq_range=[2, 400])
+    ax = plt.gcf().axes[0]
+    (mesh,) = ax.collections
+    assert mesh.get_array().shape[1] <= ax.figure.bbox.width
+
+    ax.set_xlim(time[0], time[10])
+    (mesh,) = ax.collections
+    assert mesh.get_array().shape[1] == 10
+    plt.close("all")
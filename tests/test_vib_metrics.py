@@ -0,0 +1,137 @@
+import json
+import logging
+import tracemalloc
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+
+from dlsVibrationTools import vib_metrics
+from dlsVibrationTools.vib_metrics import (
+    collect_metrics,
+    metrics_handler,
+    metrics_registry,
+    stage,
+    timed_stage,
+)
+from dlsVibrationTools.vib_plots import plot_vc_timeseries
+
+START = datetime(2022, 5, 4, 12, 0, 0, tzinfo=timezone.utc)
+END = datetime(2022, 5, 4, 12, 10, 0, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def registry():
+    logger = logging.getLogger(vib_metrics.METRICS_LOGGER)
+    handler = metrics_handler(registry=metrics_registry())
+    level, propagate = logger.level, logger.propagate
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+    yield handler.registry
+
+    logger.removeHandler(handler)
+    logger.setLevel(level)
+    logger.propagate = propagate
+
+
+def by_stage(registry) -> dict:
+    totals = {}
+    for t in registry.to_list():
+        totals.setdefault(t["stage"], []).append(t)
+    return totals
+
+
+def test_stage_records(registry) -> None:
+    for rows in (3, 4):
+        with stage("transform", pv="CH01") as record:
+            record["rows"] = rows
+    with pytest.raises(ValueError):
+        with stage("transform", pv="CH02"):
+            raise ValueError()
+
+    (ch01, ch02) = registry.to_list()
+    assert ch01["stage"] == "transform" and ch01["pv"] == "CH01"
+    assert ch01["calls"] == 2 and ch01["rows"] == 7
+    assert ch01["seconds"] >= ch01["max_seconds"] > 0
+    assert ch02["calls"] == 1 and "rows" not in ch02
+
+
+def test_disabled_records_nothing(registry) -> None:
+    logging.getLogger(vib_metrics.METRICS_LOGGER).setLevel(logging.WARNING)
+
+    with stage("transform") as record:
+        record["rows"] = 1
+
+    assert registry.to_list() == []
+
+
+def test_peak_memory_of_nested_stages(registry) -> None:
+    tracemalloc.start()
+    try:
+        with stage("outer"):
+            with stage("inner"):
+                data = np.ones(10**6)
+            del data
+            with stage("small"):
+                pass
+    finally:
+        tracemalloc.stop()
+
+    totals = {t["stage"]: t["peak_memory"] for t in registry.to_list()}
+    assert totals["outer"] >= totals["inner"] >= 8 * 10**6
+    assert totals["small"] < 10**5
+
+
+def test_timed_stage(registry) -> None:
+    @timed_stage("plot.test")
+    def plot(data):
+        return len(data)
+
+    assert plot([1, 2, 3]) == 3
+    assert registry.to_list()[0]["rows"] == 3
+
+
+def test_archive_and_plot_stages(registry, archive) -> None:
+    df = archive.fetch_pv_to_dataframe("VC_PEAK", START, END, channels=[1, 2])
+    plot_vc_timeseries(df, show=False)
+
+    totals = by_stage(registry)
+
+    assert len(totals["archiver.request"]) == 2
+    assert all(t["bytes"] > 0 for t in totals["archiver.request"])
+    assert [t["rows"] for t in totals["archiver.parse"]] == [600, 600]
+    assert totals["archiver.fetch"][0]["rows"] == 1200
+    assert totals["dataframe"][0]["rows"] == 1200
+    assert totals["dataframe"][0]["variable"] == "VC_PEAK"
+    assert totals["vc_levels"][0]["rows"] == 1200
+    assert totals["plot.vc_timeseries"][0]["rows"] == 1200
+
+
+def test_collect_metrics() -> None:
+    with collect_metrics() as records:
+        with stage("render"):
+            pass
+    with stage("render"):
+        pass
+
+    assert [r["stage"] for r in records] == ["render"]
+    assert not vib_metrics.metrics_enabled()
+
+
+def test_exports(registry, tmp_path) -> None:
+    with stage("archiver.request", pv='CH"01"') as record:
+        record["bytes"] = 10
+
+    prom = registry.to_prometheus()
+    assert "# TYPE dls_vibration_stage_seconds_total counter" in prom
+    assert (
+        'dls_vibration_stage_bytes_total{stage="archiver.request",pv="CH\\"01\\""}'
+        " 10" in prom
+    )
+    assert "rows" not in prom
+
+    registry.write(str(tmp_path / "metrics.json"))
+    with open(tmp_path / "metrics.json") as f:
+        assert json.load(f)[0]["bytes"] == 10
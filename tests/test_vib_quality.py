@@ -0,0 +1,137 @@
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+from dlsVibrationTools.vib_plots import plot_coverage
+from dlsVibrationTools.vib_quality import (
+    ISSUE_COLUMNS,
+    gap_threshold,
+    get_coverage,
+    get_sampling_issues,
+    sampling_periods,
+)
+
+START = datetime(2022, 5, 4, 12, 0, 0, tzinfo=timezone.utc)
+END = datetime(2022, 5, 4, 12, 10, 0, tzinfo=timezone.utc)
+
+PVS = ["CH01:VC_PEAK", "CH02:VC_PEAK", "CH03:VC_PEAK"]
+
+
+def frame(times: dict, values: dict = {}) -> pd.DataFrame:
+    # seconds after START of the samples of each PV, in arrival order
+    pvs = [pv for pv, t in times.items() for _ in t]
+    t = np.concatenate([np.asarray(t, dtype=np.float64) for t in times.values()])
+    rng = np.random.default_rng(0)
+    return pd.DataFrame(
+        {
+            "Time": pd.Timestamp(START) + pd.to_timedelta(t, unit="s"),
+            "PV": pd.Categorical(pvs, categories=PVS),
+            "VC_Peak": np.concatenate(
+                [values.get(pv, rng.uniform(size=len(t))) for pv, t in times.items()]
+            ),
+        }
+    )
+
+
+def issues_of(issues: pd.DataFrame, issue: str) -> list:
+    rows = issues[issues["Issue"] == issue]
+    return [
+        (
+            row.PV,
+            (row.Start - START).total_seconds(),
+            (row.End - START).total_seconds(),
+            row.Samples,
+        )
+        for row in rows.itertuples()
+    ]
+
+
+def test_clean_data_has_no_issues() -> None:
+    df = frame({pv: np.arange(600) for pv in PVS})
+
+    issues = get_sampling_issues(df, START, END)
+
+    assert list(issues.columns) == ISSUE_COLUMNS
+    assert issues.empty
+    assert (get_coverage(df, START, END)["Coverage"] == 100).all()
+    assert (sampling_periods(df) == pd.Timedelta("1s")).all()
+    assert gap_threshold(df) == pd.Timedelta("3s")
+
+
+def test_gaps() -> None:
+    ch01 = np.r_[np.arange(100), np.arange(160, 600)]
+    ch02 = np.arange(30, 500, 2)
+    df = frame({"CH01:VC_PEAK": ch01, "CH02:VC_PEAK": ch02})
+
+    gaps = issues_of(get_sampling_issues(df, START, END), "gap")
+
+    assert gaps == [
+        ("CH01:VC_PEAK", 99, 160, 60),
+        ("CH02:VC_PEAK", 0, 30, 15),
+        ("CH02:VC_PEAK", 498, 600, 51),
+        # no data at all, at the median sampling period of the others (1.5s)
+        ("CH03:VC_PEAK", 0, 600, 400),
+    ]
+    # without the requested range, only gaps between samples are found
+    assert len(issues_of(get_sampling_issues(df), "gap")) == 1
+
+
+def test_duplicates_and_out_of_order() -> None:
+    ch01 = np.r_[np.arange(100), [99, 99], np.arange(100, 200)]
+    # clock jumping back by 50s, then forward again
+    ch02 = np.r_[np.arange(100), np.arange(50, 60), np.arange(100, 200)]
+    df = frame({"CH01:VC_PEAK": ch01, "CH02:VC_PEAK": ch02})
+
+    issues = get_sampling_issues(df)
+
+    assert issues_of(issues, "duplicate") == [("CH01:VC_PEAK", 99, 99, 2)]
+    assert issues_of(issues, "out_of_order") == [("CH02:VC_PEAK", 50, 99, 10)]
+    assert issues_of(issues, "gap") == []
+
+    # duplicate and out of order samples do not count towards coverage
+    coverage = get_coverage(df, START, START + pd.Timedelta("200s"))
+    assert coverage["Coverage"].tolist()[:2] == [100, 100]
+    assert coverage["Samples"].tolist()[:2] == [200, 200]
+
+
+def test_stalls() -> None:
+    values = np.random.default_rng(0).uniform(size=600)
+    values[100:130] = values[100]
+    values[300:305] = values[300]
+    df = frame({"CH01:VC_PEAK": np.arange(600)}, {"CH01:VC_PEAK": values})
+
+    issues = get_sampling_issues(df, min_stall=10)
+
+    assert issues_of(issues, "stall") == [("CH01:VC_PEAK", 100, 129, 30)]
+
+
+def test_coverage_buckets() -> None:
+    ch01 = np.r_[np.arange(120), np.arange(150, 600)]
+    df = frame({"CH01:VC_PEAK": ch01, "CH02:VC_PEAK": np.arange(0, 600, 0.5)})
+
+    coverage = get_coverage(df, START, END, bucket=pd.Timedelta("60s"))
+
+    assert len(coverage) == 3 * 10
+    ch01 = coverage[coverage["PV"] == "CH01:VC_PEAK"]
+    assert ch01["Coverage"].tolist() == [100, 100, 50] + [100] * 7
+    assert (coverage[coverage["PV"] == "CH02:VC_PEAK"]["Expected"] == 120).all()
+    assert (coverage[coverage["PV"] == "CH03:VC_PEAK"]["Coverage"] == 0).all()
+    assert coverage["Start"].iloc[1] == START + pd.Timedelta("60s")
+
+    fig = plot_coverage(coverage, show=False)
+    assert fig.axes
+
+
+def test_unsorted_pvs(archive) -> None:
+    df = archive.fetch_pv_to_dataframe("VC_PEAK", START, END, channels=[1, 2])
+    dropout = (df["Time"] > START + pd.Timedelta("100s")) & (
+        df["Time"] < START + pd.Timedelta("200s")
+    )
+    df = df[~(dropout & (df["PV"] == df["PV"].cat.categories[1]))]
+    # interleave the PVs
+    df = df.sort_values("Time", kind="stable")
+
+    issues = get_sampling_issues(df, START, END)
+
+    assert issues_of(issues, "gap") == [(df["PV"].cat.categories[1], 100, 200, 99)]
@@ -0,0 +1,72 @@
+import os
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from dlsVibrationTools.vib_report import generate_report, load_frame, save_frame
+from dlsVibrationTools.vib_spectra import fft_spectra
+
+START = datetime(2022, 5, 4, 12, 0, 0, tzinfo=timezone.utc)
+END = datetime(2022, 5, 4, 12, 10, 0, tzinfo=timezone.utc)
+
+
+def test_save_frame_round_trip(archive, tmp_path) -> None:
+    df = archive.fetch_pv_to_dataframe("VC_PEAK", START, END, channels=[1, 2])
+    save_frame(df, str(tmp_path / "data.npz"))
+
+    loaded = load_frame(str(tmp_path / "data.npz"))
+
+    pd.testing.assert_frame_equal(
+        loaded, df[["Time", "PV", "VC_Peak"]], check_categorical=False
+    )
+
+
+def test_spectra_save_load_is_memory_mapped(tmp_path) -> None:
+    time = pd.date_range("2022-05-04", periods=10, freq="s", tz="UTC")
+    s = fft_spectra(time, np.random.default_rng(0).uniform(size=(10, 8)), pv="X")
+    s.save(str(tmp_path / "spectra"))
+
+    loaded = fft_spectra.load(str(tmp_path / "spectra"))
+
+    assert isinstance(loaded.values.base, np.memmap)
+    assert loaded.pv == "X"
+    pd.testing.assert_index_equal(loaded.time, s.time.as_unit("ns"))
+    np.testing.assert_array_equal(loaded.values, s.values)
+
+
+def test_generate_report(archive, appliance, tmp_path) -> None:
+    written = generate_report(
+        archive,
+        START,
+        END,
+        str(tmp_path),
+        beamlines=["BL20I", "BL20J"],
+        channels=[1, 2],
+        formats=("png", "pdf", "html"),
+        max_workers=2,
+    )
+
+    names = sorted(os.path.basename(f) for f in written)
+    for beamline in ("BL20I", "BL20J"):
+        for plot in ("timeseries", "histogram", "alarms"):
+            assert "{}_{}.png".format(beamline, plot) in names
+            assert "{}_{}.pdf".format(beamline, plot) in names
+        assert "{}_alarms.csv".format(beamline) in names
+    assert sum(name.startswith("spectrogram_") for name in names) == 4 * 2
+    assert all(os.path.getsize(f) > 0 for f in written)
+
+    with open(tmp_path / "index.html") as f:
+        index = f.read()
+    assert index.count("<img") == 2 * (2 + 2)
+    # alarms and data quality of each beamline
+    assert index.count("<table") == 2 * 2
+
+    # each PV is fetched once
+    assert len(appliance.requests) == 2 * 2 * 2
+
+
+def test_generate_report_rejects_unknown_format(archive, tmp_path) -> None:
+    with pytest.raises(NotImplementedError):
+        generate_report(archive, START, END, str(tmp_path), formats=("svg",))
@@ -0,0 +1,98 @@
+import multiprocessing
+import pickle
+from datetime import datetime, timezone
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from dlsVibrationTools.vib_shared import (
+    dataframe_from_shared,
+    share_dataframe,
+    share_spectra,
+    spectra_from_shared,
+)
+from dlsVibrationTools.vib_spectra import fft_spectra
+
+START = datetime(2022, 5, 4, 12, 0, 0, tzinfo=timezone.utc)
+END = datetime(2022, 5, 4, 12, 10, 0, tzinfo=timezone.utc)
+
+
+def summarise(shared, queue) -> None:
+    # runs in a child process
+    if "values" in shared:
+        s = spectra_from_shared(shared)
+        queue.put((s.values.flags.writeable, float(s.values.sum()), str(s.time[0])))
+    else:
+        df = dataframe_from_shared(shared)
+        values = df["VC_Peak"].to_numpy()
+        queue.put((values.flags.writeable, float(values.sum()), str(df["Time"][0])))
+
+
+def run_in_child(shared):
+    ctx = multiprocessing.get_context("spawn")
+    queue = ctx.Queue()
+    p = ctx.Process(target=summarise, args=(shared, queue))
+    p.start()
+    result = queue.get(timeout=60)
+    p.join()
+    return result
+
+
+def test_share_dataframe_round_trip(archive) -> None:
+    df = archive.fetch_pv_to_dataframe("VC_PEAK", START, END, channels=[1, 2])
+
+    with share_dataframe(df) as shared:
+        attached = pickle.loads(pickle.dumps(shared))
+        loaded = dataframe_from_shared(attached)
+
+        assert len(pickle.dumps(shared)) < 1000
+        pd.testing.assert_frame_equal(loaded, df)
+        assert not loaded["VC_Peak"].to_numpy().flags.writeable
+
+
+def test_share_dataframe_with_child_process(archive) -> None:
+    df = archive.fetch_pv_to_dataframe("VC_PEAK", START, END, channels=[1])
+
+    with share_dataframe(df) as shared:
+        writeable, total, first = run_in_child(shared)
+
+        # the child must not have unlinked the block
+        shared_memory.SharedMemory(shared._shm.name).close()
+
+    assert not writeable
+    assert total == pytest.approx(df["VC_Peak"].sum())
+    assert first == str(df["Time"][0])
+
+
+def test_share_spectra_with_child_process() -> None:
+    time = pd.date_range("2022-05-04", periods=100, freq="s", tz="UTC")
+    values = np.random.default_rng(0).uniform(size=(100, 64))
+    s = fft_spectra(time, values, pv="CH01:FFT")
+
+    with share_spectra(s) as shared:
+        loaded = spectra_from_shared(pickle.loads(pickle.dumps(shared)))
+        np.testing.assert_array_equal(loaded.values, s.values)
+        pd.testing.assert_index_equal(loaded.time, s.time.as_unit("ns"))
+        assert loaded.pv == "CH01:FFT"
+
+        writeable, total, first = run_in_child(shared)
+
+    assert not writeable
+    assert total == pytest.approx(s.values.sum(), rel=1e-5)
+    assert first == str(time[0])
+
+
+def test_close_unlinks_block() -> None:
+    shared = share_dataframe(pd.DataFrame({"a": np.arange(10)}))
+    name = shared._shm.name
+    shared.close()
+
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name)
+
+
+def test_share_dataframe_rejects_objects() -> None:
+    with pytest.raises(TypeError):
+        share_dataframe(pd.DataFrame({"a": [np.zeros(2), np.zeros(2)]}))
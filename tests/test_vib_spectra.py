@@ -0,0 +1,96 @@
+import sys
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from dlsVibrationTools.vib_plots import plot_spectrogram
+from dlsVibrationTools.vib_spectra import fft_spectra
+
+START = datetime(2022, 5, 4, 12, 0, 0, tzinfo=timezone.utc)
+END = datetime(2022, 5, 4, 12, 1, 0, tzinfo=timezone.utc)
+
+
+def spectra(n_time: int = 100, n_freq: int = 64) -> fft_spectra:
+    time = pd.date_range("2022-05-04", periods=n_time, freq="s", tz="UTC")
+    values = np.random.default_rng(0).uniform(1e-8, 1e-6, (n_time, n_freq))
+    return fft_spectra(time, values, pv="CH01:FFT")
+
+
+def test_spectra_are_dense_float32() -> None:
+    s = spectra()
+
+    assert s.values.dtype == np.float32
+    assert s.values.flags["C_CONTIGUOUS"]
+    assert np.array_equal(s.freq, np.arange(64))
+
+
+def test_sel_returns_views() -> None:
+    s = spectra()
+
+    sub = s.sel(time_range=(s.time[10], s.time[20]), freq_range=(2, 40))
+
+    assert sub.values.shape == (10, 38)
+    assert np.shares_memory(sub.values, s.values)
+    assert sub.freq[0] == 2
+    np.testing.assert_allclose(sub.max_hold(), s.values[10:20, 2:40].max(axis=0))
+    np.testing.assert_allclose(
+        sub.mean(), s.values[10:20, 2:40].mean(axis=0), rtol=1e-6
+    )
+
+
+def test_dataframe_round_trip() -> None:
+    s = spectra()
+
+    df = s.to_dataframe()
+    assert np.shares_memory(df["FFT"].iloc[0], s.values)
+
+    s2 = fft_spectra.from_dataframe(df)
+    assert np.array_equal(s2.values, s.values)
+    assert s2.time.equals(s.time)
+    assert s2.pv == s.pv
+
+
+def test_memory_against_list_column() -> None:
+    s = spectra(1000, 400)
+    lists = s.values.astype(np.float64).tolist()
+
+    list_bytes = sum(
+        sys.getsizeof(row) + sum(sys.getsizeof(x) for x in row) for row in lists
+    )
+    assert list_bytes > 4 * s.nbytes
+
+
+def test_fetch_fft_spectra(appliance, archive) -> None:
+    result = archive.fetch_fft_spectra(START, END, channels=[1, 2])
+
+    assert list(result) == [
+        "BL20I-DI-ACCEL-01:DATA:CH01:FFT",
+        "BL20I-DI-ACCEL-01:DATA:CH02:FFT",
+    ]
+    s = result["BL20I-DI-ACCEL-01:DATA:CH01:FFT"]
+    assert s.values.shape == (60, appliance.fft_length)
+    assert s.time[0] == pd.Timestamp(START)
+
+
+def test_fetch_fft_dataframe_derives_vc(archive) -> None:
+    df = archive.fetch_pv_to_dataframe("FFT", START, END, channels=[1], derive_vc=True)
+    (s,) = archive.fetch_fft_spectra(START, END, channels=[1]).values()
+
+    np.testing.assert_allclose(df["VC_Peak"], s.vc_peak())
+    assert df["VC_Level"].notna().all()
+
+
+def test_fetch_fft_dataframe_rows_are_views(archive) -> None:
+    df = archive.fetch_pv_to_dataframe("FFT", START, END, channels=[1, 2])
+
+    assert len(df) == 120
+    assert df["FFT"].iloc[0].dtype == np.float32
+    assert df["FFT"].iloc[0].base is df["FFT"].iloc[119].base
+
+
+@pytest.mark.parametrize("as_dataframe", [False, True])
+def test_plot_spectrogram(as_dataframe: bool) -> None:
+    s = spectra()
+    plot_spectrogram(s.to_dataframe() if as_dataframe else s, freq_range=[2, 40])
@@ -0,0 +1,239 @@
+import pickle
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from dlsVibrationTools.vc_curves import VC_CATEGORIES, vc_time_at_level
+from dlsVibrationTools.vib_plots import plot_vc_histograms
+from dlsVibrationTools.vib_spectra import fft_spectra
+from dlsVibrationTools.vib_stats import (
+    accumulate_spectra,
+    accumulate_vc,
+    spectral_stats,
+    store_stats,
+    vc_stats,
+)
+from dlsVibrationTools.vib_store import fft_store
+
+START = datetime(2022, 5, 4, 12, 0, 0, tzinfo=timezone.utc)
+END = datetime(2022, 5, 4, 12, 10, 0, tzinfo=timezone.utc)
+
+
+def make_spectra(n: int = 5000, start: str = "2022-05-04", seed: int = 0):
+    time = pd.date_range(start, periods=n, freq="s", tz="UTC")
+    # log-normal amplitudes spanning a few decades, like velocity spectra
+    values = 1e-7 * np.random.default_rng(seed).lognormal(sigma=2, size=(n, 32))
+    return fft_spectra(time, values, pv="CH01:FFT")
+
+
+def test_matches_numpy() -> None:
+    s = make_spectra()
+    stats = spectral_stats.from_spectra(s, chunk_size=700)
+    values = s.values.astype(np.float64)
+
+    assert stats.count == len(s)
+    assert stats.time_range == (s.time[0], s.time[-1])
+    np.testing.assert_allclose(stats.mean(), values.mean(axis=0), rtol=1e-10)
+    np.testing.assert_allclose(stats.variance(), values.var(axis=0), rtol=1e-8)
+    np.testing.assert_allclose(stats.std(1), values.std(axis=0, ddof=1), rtol=1e-8)
+    np.testing.assert_array_equal(stats.min_hold(), s.values.min(axis=0))
+    np.testing.assert_array_equal(stats.max_hold(), s.max_hold())
+
+
+def test_percentiles() -> None:
+    s = make_spectra()
+    stats = spectral_stats.from_spectra(s)
+
+    p = stats.percentile([50, 95, 99])
+    expected = np.percentile(s.values, [50, 95, 99], axis=0)
+
+    assert p.shape == (3, 32)
+    # within one histogram bin, 10**(1/20)
+    np.testing.assert_allclose(p, expected, rtol=0.13)
+    np.testing.assert_allclose(stats.percentile(0), s.values.min(axis=0), rtol=1e-6)
+    np.testing.assert_allclose(stats.percentile(100), s.max_hold(), rtol=1e-6)
+
+    # values outside the edges are bounded by min and max
+    outside = spectral_stats.from_spectra(s, edges=[1.0, 2.0])
+    assert (outside.percentile(50) >= s.values.min(axis=0)).all()
+    assert (outside.percentile(50) <= s.max_hold()).all()
+
+    with pytest.raises(ValueError):
+        spectral_stats.from_spectra(s, edges=None).percentile(95)
+
+
+def test_merge_is_exact() -> None:
+    s = make_spectra()
+    whole = spectral_stats.from_spectra(s)
+    parts = [
+        spectral_stats.from_spectra(s.sel((s.time[a], s.time[b])))
+        for a, b in [(3000, 4999), (0, 1234), (1234, 3000)]
+    ] + [spectral_stats.from_spectra(s.sel((s.time[-1], END)))]
+
+    merged = spectral_stats.combine([pickle.loads(pickle.dumps(p)) for p in parts])
+
+    assert merged.count == whole.count
+    assert merged.time_range == whole.time_range
+    np.testing.assert_array_equal(merged.histogram, whole.histogram)
+    np.testing.assert_allclose(merged.mean(), whole.mean(), rtol=1e-12)
+    np.testing.assert_allclose(merged.variance(), whole.variance(), rtol=1e-9)
+    np.testing.assert_array_equal(merged.max_hold(), whole.max_hold())
+    np.testing.assert_array_equal(merged.percentile(95), whole.percentile(95))
+
+
+def test_rejects_mismatches() -> None:
+    stats = spectral_stats(np.arange(32))
+    with pytest.raises(ValueError):
+        stats.update(fft_spectra(make_spectra().time[:2], np.zeros((2, 16))))
+    with pytest.raises(ValueError):
+        stats.merge(spectral_stats(np.arange(32), edges=[1.0]))
+
+
+def test_empty() -> None:
+    stats = spectral_stats(np.arange(4))
+
+    assert np.isnan(stats.mean()).all()
+    assert np.isnan(stats.percentile([50, 95])).all()
+
+
+def test_accumulate_archive_chunks(archive) -> None:
+    chunks = archive.iter_fft_spectra(START, END, [1, 2], chunk=END - START)
+    streamed = accumulate_spectra(
+        archive.iter_fft_spectra(START, END, [1, 2], chunk=(END - START) / 10)
+    )
+
+    for pv, s in next(chunks).items():
+        np.testing.assert_allclose(streamed[pv].mean(), s.mean(), rtol=1e-6)
+        np.testing.assert_array_equal(streamed[pv].max_hold(), s.max_hold())
+        assert streamed[pv].count == len(s)
+
+
+def test_store_stats_in_parallel(tmp_path) -> None:
+    store = fft_store(str(tmp_path))
+    for channel in [1, 2]:
+        s = make_spectra(seed=channel)
+        s.pv = "CH{:02}:FFT".format(channel)
+        store.append(s)
+
+    stats = store_stats(store, parts=3, max_workers=2)
+
+    assert sorted(stats) == ["CH01:FFT", "CH02:FFT"]
+    for pv, st in stats.items():
+        expected = spectral_stats.from_spectra(store.open(pv))
+        assert st.count == expected.count
+        np.testing.assert_array_equal(st.histogram, expected.histogram)
+        np.testing.assert_allclose(st.mean(), expected.mean(), rtol=1e-12)
+
+
+def vc_frame(n: int = 3000, seed: int = 0) -> pd.DataFrame:
+    # two PVs sampled every second, one with a 5 minute dropout
+    rng = np.random.default_rng(seed)
+    time = pd.date_range(START, periods=n, freq="s")
+    dropout = (time >= START + pd.Timedelta("10min")) & (
+        time < START + pd.Timedelta("15min")
+    )
+    df = pd.DataFrame(
+        {
+            "Time": np.r_[time, time[~dropout]],
+            "PV": np.r_[["CH01"] * n, ["CH02"] * (~dropout).sum()],
+            "VC_Peak": 10 ** rng.uniform(-8.5, -5, n + (~dropout).sum()),
+        }
+    )
+    df.loc[5, "VC_Peak"] = np.nan
+    df["PV"] = df["PV"].astype("category")
+    return df
+
+
+def test_vc_stats_match_samples() -> None:
+    df = vc_frame()
+    stats = vc_stats.from_dataframe(df)
+
+    assert stats.pvs == ["CH01", "CH02"]
+    for pv, group in df.groupby("PV", observed=True):
+        row = stats.pvs.index(pv)
+        values = group["VC_Peak"].dropna()
+        assert stats.samples[row] == len(values)
+        counts, _ = np.histogram(values, stats.edges)
+        np.testing.assert_array_equal(stats.histogram[row, 1:-1], counts)
+
+        # time to the next sample, at most max_gap
+        dT = group["Time"].diff().shift(-1).dt.total_seconds().clip(upper=60)
+        expected = vc_time_at_level(group["VC_Peak"], dT)
+        np.testing.assert_allclose(stats.level_seconds[row], expected)
+
+    # CH02 has no data for 5 minutes, only max_gap of that is counted
+    assert stats.level_seconds.sum(axis=1).tolist() == [2999 - 1, 2698 + 60]
+    assert stats.time_range == (START, START + pd.Timedelta("2999s"))
+
+
+def test_vc_stats_merge_partials(tmp_path) -> None:
+    df = vc_frame()
+    whole = vc_stats.from_dataframe(df)
+    # daily partials from chunks, merged in any order
+    bounds = START + pd.to_timedelta([0, 700, 1000, 3000], unit="s")
+    parts = [
+        df[(df["Time"] >= a) & (df["Time"] < b)] for a, b in zip(bounds, bounds[1:])
+    ]
+    for i, part in enumerate(parts):
+        vc_stats.from_dataframe(part).save(str(tmp_path / "{}.npz".format(i)))
+
+    loaded = [vc_stats.load(str(tmp_path / "{}.npz".format(i))) for i in (2, 0, 1)]
+    merged = vc_stats.combine(loaded)
+    streamed = accumulate_vc(parts)
+
+    for stats in (merged, streamed):
+        assert stats.pvs == whole.pvs
+        np.testing.assert_array_equal(stats.histogram, whole.histogram)
+        np.testing.assert_array_equal(stats.level_samples, whole.level_samples)
+        np.testing.assert_allclose(stats.level_seconds, whole.level_seconds)
+        assert stats.time_range == whole.time_range
+
+    with pytest.raises(ValueError):
+        merged.merge(vc_stats(max_gap=pd.Timedelta("10s")))
+
+
+def test_vc_tables() -> None:
+    df = pd.DataFrame(
+        {
+            "Time": pd.date_range(START, periods=4, freq="10s"),
+            "PV": "CH01",
+            # VC-G, VC-A for three times as long, then ISO
+            "VC_Peak": [0.5e-6, 30e-6, 30e-6, 60e-6],
+        }
+    )
+    df.loc[2:, "Time"] += pd.Timedelta("10s")
+    stats = vc_stats.from_dataframe(df)
+
+    levels = stats.time_at_level()
+    assert list(levels.columns) == VC_CATEGORIES
+    assert levels.loc["CH01", "G"] == pytest.approx(100 / 4)
+    assert levels.loc["CH01", "A"] == pytest.approx(300 / 4)
+    within = stats.time_at_level(cumulative=True)
+    assert within.loc["CH01", "D"] == pytest.approx(25)
+    assert within.loc["CH01", "ISO"] == pytest.approx(100)
+    assert stats.time_at_level(percent=False).loc["CH01"].sum() == 40
+
+    exceedance = stats.exceedance().set_index("VC_Peak")["Exceedance"]
+    assert exceedance.iloc[0] == 100
+    assert exceedance[exceedance.index > 50e-6].iloc[0] == 25
+    assert exceedance.iloc[-1] == 0
+
+    table = stats.histogram_frame()
+    assert table["Samples"].sum() == 4
+    assert len(table) == len(stats.edges) + 1
+
+
+def test_vc_histogram_plot(archive) -> None:
+    chunks = archive.iter_pv_to_dataframe(
+        "VC_PEAK", START, END, [1, 2], chunk=(END - START) / 10
+    )
+    stats = accumulate_vc(chunks)
+    df = archive.fetch_pv_to_dataframe("VC_PEAK", START, END, channels=[1, 2])
+
+    np.testing.assert_array_equal(
+        stats.histogram, vc_stats.from_dataframe(df).histogram
+    )
+    assert plot_vc_histograms(stats, show=False).axes
+    assert plot_vc_histograms(df, show=False).axes
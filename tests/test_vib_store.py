@@ -0,0 +1,117 @@
+import os
+from datetime import datetime, timezone
+
+import matplotlib
+import numpy as np
+import pandas as pd
+import pytest
+
+from dlsVibrationTools.vib_plots import plot_spectrogram
+from dlsVibrationTools.vib_spectra import fft_spectra
+from dlsVibrationTools.vib_store import fft_store
+
+matplotlib.use("Agg")
+
+START = datetime(2022, 5, 4, 12, 0, 0, tzinfo=timezone.utc)
+END = datetime(2022, 5, 4, 12, 10, 0, tzinfo=timezone.utc)
+
+
+def make_spectra(n: int = 100, start: str = "2022-05-04", pv: str = "CH01:FFT"):
+    time = pd.date_range(start, periods=n, freq="s", tz="UTC")
+    values = np.random.default_rng(0).uniform(size=(n, 64))
+    return fft_spectra(time, values, freq_resolution=2.0, pv=pv)
+
+
+def test_append_and_reopen(tmp_path) -> None:
+    s = make_spectra()
+    store = fft_store(str(tmp_path))
+
+    assert store.append(s.sel((s.time[0], s.time[60]))) == 60
+    # overlapping spectra are skipped
+    assert store.append(s) == 40
+    assert store.append(s) == 0
+
+    loaded = fft_store(str(tmp_path)).open("CH01:FFT")
+    assert store.pvs == ["CH01:FFT"]
+    assert len(store) == store.count("CH01:FFT") == 100
+    np.testing.assert_array_equal(loaded.values, s.values)
+    np.testing.assert_array_equal(loaded.freq, s.freq)
+    pd.testing.assert_index_equal(loaded.time, s.time.as_unit("ns"))
+    assert store.time_range("CH01:FFT") == (s.time[0], s.time[-1])
+
+
+def test_open_range_is_memory_mapped(tmp_path) -> None:
+    s = make_spectra(1000)
+    store = fft_store(str(tmp_path))
+    store.append(s)
+
+    part = store.open("CH01:FFT", (s.time[100], s.time[200]))
+
+    assert len(part) == 100
+    assert isinstance(part.values.base, np.memmap)
+    assert not part.values.flags.writeable
+    np.testing.assert_array_equal(part.values, s.values[100:200])
+    assert len(store.open("CH01:FFT", (s.time[-1] + pd.Timedelta("1s"), END))) == 0
+
+    with pytest.raises(KeyError):
+        store.open("CH02:FFT")
+
+
+def test_interrupted_append_is_discarded(tmp_path) -> None:
+    s = make_spectra()
+    store = fft_store(str(tmp_path))
+    store.append(s.sel((s.time[0], s.time[50])))
+
+    # values written without their timestamps
+    with open(os.path.join(store._dir(s.pv), "values.f32"), "ab") as f:
+        f.write(np.ones((3, 64), dtype="<f4").tobytes())
+    assert len(store.open(s.pv)) == 50
+
+    store.append(s)
+    np.testing.assert_array_equal(store.open(s.pv).values, s.values)
+
+
+def test_rejects_other_frequencies(tmp_path) -> None:
+    store = fft_store(str(tmp_path))
+    store.append(make_spectra())
+
+    s = make_spectra(start="2022-05-05")
+    s.freq = s.freq / 2
+    with pytest.raises(ValueError):
+        store.append(s)
+
+
+def test_dataframe_round_trip(tmp_path, archive) -> None:
+    df = archive.fetch_pv_to_dataframe(
+        "FFT", START, END, channels=[1, 2], derive_vc=True
+    )
+    store = fft_store(str(tmp_path))
+
+    assert store.ingest(df, freq_resolution=archive.fft_resolution) == len(df)
+
+    exported = store.to_dataframe(derive_vc=True)
+    pd.testing.assert_frame_equal(exported.drop(columns="FFT"), df.drop(columns="FFT"))
+    np.testing.assert_array_equal(
+        np.stack(exported["FFT"].to_numpy()), np.stack(df["FFT"].to_numpy())
+    )
+
+
+def test_dataframe_keeps_nanoseconds(tmp_path) -> None:
+    s = make_spectra(start="2022-05-04 00:00:00.123456789")
+    store = fft_store(str(tmp_path))
+    store.append(s)
+
+    exported = store.to_dataframe()
+    np.testing.assert_array_equal(exported["Time"], s.time.as_unit("ns"))
+    assert (exported["dT"].iloc[:-1] == pd.Timedelta("1s")).all()
+
+
+def test_plot_spectrogram_from_store(tmp_path) -> None:
+    s = make_spectra(1000)
+    store = fft_store(str(tmp_path))
+    store.append(s)
+
+    fig = plot_spectrogram(
+        store.open(s.pv, (s.time[0], s.time[500])), freq_range=[2, 100], show=False
+    )
+    assert fig.axes